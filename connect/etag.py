@@ -0,0 +1,51 @@
+"""
+Conditional GET (ETag / If-None-Match) for catalog endpoints
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from produit import catalog_cache
+
+
+def catalog_etag(name, scope=None, window=None):
+    """
+    Decorator emitting a strong ETag built from the catalog version of `scope`
+    (a callable receiving the view kwargs, the whole catalog by default) and
+    the query string. A matching If-None-Match is answered with 304 before the
+    view runs, so no ORM query nor serialization happens.
+
+    window (seconds) also rotates the ETag over time, CATALOG_ETAG_WINDOW by
+    default: a client revalidating after a missed version bump gets fresh data
+    within a bounded delay. Responses embedding short-lived data such as signed
+    cover URLs pass a shorter window.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            version_scope = scope(kwargs) if scope else catalog_cache.CATALOG_SCOPE
+            version = catalog_cache.get_version(version_scope)
+            query = '&'.join(sorted(request.GET.urlencode().split('&')))
+            parts = [name, version_scope, f'v{version}', hashlib.md5(query.encode('utf-8')).hexdigest()[:16]]
+            period = window or settings.CATALOG_ETAG_WINDOW
+            parts.append(str(int(time.time() // period)))
+            etag = quote_etag('-'.join(parts))
+
+            if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+            if if_none_match:
+                client_etags = parse_etags(if_none_match)
+                if '*' in client_etags or etag in client_etags or f'W/{etag}' in client_etags:
+                    return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                response['ETag'] = etag
+                response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,70 @@
+"""
+Facet counts (categories, tome numbers) for the search endpoint
+"""
+from django.db.models import Count, Q
+
+from produit import catalog_cache
+from produit.models import Category, Tome
+from produit.text import normalize_title
+
+
+def split_categories(category_list):
+    """Category filter values -> (ids, slugs), the slugs being matched exactly"""
+    ids, slugs = [], []
+    for value in category_list:
+        try:
+            ids.append(int(value))
+        except ValueError:
+            slugs.append(value)
+    return ids, slugs
+
+
+def facets_params(q, fuzzy, category_list, tome_num):
+    """
+    Cache key of the facets, built from the values the search filters actually
+    use, so that only searches returning the same mangas share their facets
+    """
+    ids, slugs = split_categories(category_list)
+    try:
+        tome = int(tome_num) if tome_num else None
+    except ValueError:
+        tome = None
+    return [
+        # The fuzzy search normalizes q itself; the full-text fallback (icontains) does not
+        normalize_title(q) if fuzzy else q.strip(),
+        bool(fuzzy),
+        sorted(set(ids)),
+        sorted(set(slugs)),
+        tome,
+    ]
+
+
+def compute_facets(mangas_for_categories, mangas_for_tomes):
+    """
+    Count the matching mangas per category and per tome number, one grouped
+    query per facet. Each facet is computed on the search without its own
+    filter, so selecting a category still shows the counts of the others.
+    """
+    categories = (
+        Category.objects
+        .annotate(count=Count('mangas', filter=Q(mangas__in=mangas_for_categories.values('id'))))
+        .values('id', 'name', 'slug', 'count')
+        .order_by('name')
+    )
+    tomes = (
+        Tome.objects
+        .filter(manga__in=mangas_for_tomes.values('id'))
+        .values('numero')
+        .annotate(count=Count('id'))
+        .order_by('numero')
+    )
+    return {
+        'categories': list(categories),
+        'tomes': list(tomes),
+    }
+
+
+def get_facets(params, mangas_for_categories, mangas_for_tomes):
+    return catalog_cache.get_or_build(
+        'facets', params, lambda: compute_facets(mangas_for_categories, mangas_for_tomes)
+    )
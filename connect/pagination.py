@@ -0,0 +1,81 @@
+"""
+Keyset (cursor) pagination for catalog endpoints
+"""
+import base64
+import json
+
+from django.db import models
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(nom, pk, direction):
+    """Encode a (nom, id) position into an opaque cursor"""
+    raw = json.dumps([nom, pk, direction], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode an opaque cursor into (nom, id, direction)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        nom, pk, direction = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor('Invalid cursor')
+    # bool is an int subclass: a tampered true/false id is rejected too
+    if not isinstance(nom, str) or type(pk) is not int or direction not in ('next', 'prev'):
+        raise InvalidCursor('Invalid cursor')
+    return nom, pk, direction
+
+
+def paginate_by_cursor(queryset, cursor, page_size, nom_field='nom', pk_field='id'):
+    """
+    Paginate a queryset on (nom, id) without COUNT(*) nor OFFSET.
+    Returns (rows, pagination) where pagination holds the opaque next/previous cursors.
+    """
+    page_size = max(page_size, 1)
+    direction = 'next'
+    if cursor:
+        nom, pk, direction = decode_cursor(cursor)
+        if direction == 'next':
+            queryset = queryset.filter(
+                models.Q(**{f'{nom_field}__gt': nom})
+                | models.Q(**{nom_field: nom, f'{pk_field}__gt': pk})
+            ).order_by(nom_field, pk_field)
+        else:
+            queryset = queryset.filter(
+                models.Q(**{f'{nom_field}__lt': nom})
+                | models.Q(**{nom_field: nom, f'{pk_field}__lt': pk})
+            ).order_by(f'-{nom_field}', f'-{pk_field}')
+    else:
+        queryset = queryset.order_by(nom_field, pk_field)
+
+    # Fetch one extra row to know whether another page exists
+    rows = list(queryset[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    if direction == 'next':
+        has_next = has_more
+        has_previous = bool(cursor)
+    else:
+        rows.reverse()
+        has_next = True
+        has_previous = has_more
+
+    def _position(row):
+        return getattr(row, nom_field), getattr(row, pk_field)
+
+    next_cursor = encode_cursor(*_position(rows[-1]), 'next') if rows and has_next else None
+    previous_cursor = encode_cursor(*_position(rows[0]), 'prev') if rows and has_previous else None
+
+    return rows, {
+        'mode': 'cursor',
+        'page_size': page_size,
+        'has_next': next_cursor is not None,
+        'has_previous': previous_cursor is not None,
+        'next_cursor': next_cursor,
+        'previous_cursor': previous_cursor,
+    }
@@ -1,3 +1,633 @@
-from django.test import TestCase
+import base64
+import statistics
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from produit import catalog_cache, search
+from produit.autocomplete import prefix_index
+from produit.fuzzy import trigram_index
+from produit.management.commands.benchmark_fuzzy_search import (
+    indexer, mesurer, requetes_avec_faute, titres_synthetiques,
+)
+from produit.models import Category, Manga
+
+from . import facets
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+
+
+class CatalogTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('lecteur', 'lecteur@example.com', 'motdepasse')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class CursorPaginationTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        # Deux mangas de même nom : l'id départage
+        for nom in ('Akira', 'Berserk', 'Berserk', 'Claymore', 'Dragon Ball'):
+            Manga.objects.create(nom=nom, prix='6.90', nombre_tome=0)
+
+    def page(self, cursor='', page_size=2):
+        response = self.client.get('/api/manga/', {'cursor': cursor, 'page_size': page_size})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return [(m['nom'], m['id']) for m in data['mangas']], data['pagination']
+
+    def test_aller_retour(self):
+        attendu = list(Manga.objects.order_by('nom', 'id').values_list('nom', 'id'))
+
+        pages, cursor = [], ''
+        while True:
+            rows, pagination = self.page(cursor)
+            pages.append(rows)
+            if not pagination['has_next']:
+                break
+            cursor = pagination['next_cursor']
+        self.assertEqual([row for rows in pages for row in rows], attendu)
+        self.assertEqual(len(pages), 3)
+
+        # Retour en arrière depuis la dernière page
+        rows, pagination = self.page(pagination['previous_cursor'])
+        self.assertEqual(rows, pages[1])
+        rows, pagination = self.page(pagination['previous_cursor'])
+        self.assertEqual(rows, pages[0])
+        self.assertFalse(pagination['has_previous'])
+        self.assertTrue(pagination['has_next'])
+
+    def test_encodage(self):
+        cursor = encode_cursor('Berserk', 12, 'next')
+        self.assertEqual(decode_cursor(cursor), ('Berserk', 12, 'next'))
+
+    def test_curseur_altere(self):
+        cursor = encode_cursor('Berserk', 12, 'next')
+        pk_texte = base64.urlsafe_b64encode(b'["Berserk","12","next"]').decode().rstrip('=')
+        for altere in (cursor[:-3], pk_texte, 'bm9wZQ', encode_cursor('Berserk', 12, 'sideways')):
+            with self.subTest(cursor=altere):
+                with self.assertRaises(InvalidCursor):
+                    decode_cursor(altere)
+                response = self.client.get('/api/manga/', {'cursor': altere})
+                self.assertEqual(response.status_code, 400)
+
+
+class CollectionPaginationTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        autre = User.objects.create_user('autre', 'autre@example.com', 'motdepasse')
+        # Cinq mangas possédés (deux du même nom), un seul possédé par un autre lecteur
+        for nom, possedes in (('Claymore', 2), ('Akira', 1), ('Berserk', 3), ('Berserk', 1), ('Dragon Ball', 2)):
+            manga = Manga.objects.create(nom=nom, prix='6.90', nombre_tome=3)
+            for tome in manga.tomes.order_by('-numero')[:possedes]:
+                tome.possesseurs.add(self.user)
+        Manga.objects.create(nom='Aaa', prix='6.90', nombre_tome=1).tomes.get().possesseurs.add(autre)
+
+    def page(self, **params):
+        response = self.client.get('/api/collection/', {'page_size': 2, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages(self):
+        attendu = list(
+            Manga.objects.filter(tomes__possesseurs=self.user).distinct().order_by('nom', 'id').values_list('nom', 'id')
+        )
+        self.assertEqual([nom for nom, _ in attendu], ['Akira', 'Berserk', 'Berserk', 'Claymore', 'Dragon Ball'])
+
+        lignes = []
+        for numero in (1, 2, 3):
+            data = self.page(page=numero)
+            pagination = data['pagination']
+            self.assertEqual(pagination['current_page'], numero)
+            self.assertEqual(pagination['total_pages'], 3)
+            self.assertEqual(pagination['total_items'], 5)
+            self.assertEqual(pagination['has_previous'], numero > 1)
+            self.assertEqual(pagination['has_next'], numero < 3)
+            self.assertEqual(pagination['next_page'], numero + 1 if numero < 3 else None)
+            self.assertEqual(data['total_tomes'], 9)
+            lignes += [(m['nom'], m['id']) for m in data['mangas_collection']]
+        # Chaque manga une seule fois, dans l'ordre (nom, id), la dernière page incomplète
+        self.assertEqual(lignes, attendu)
+        self.assertEqual(len(self.page(page=3)['mangas_collection']), 1)
+
+    def test_tomes_de_la_page(self):
+        berserk = self.page(page=1)['mangas_collection'][1]
+        self.assertEqual(berserk['nom'], 'Berserk')
+        self.assertEqual([t['numero'] for t in berserk['tomes']], [1, 2, 3])
+
+    def test_page_hors_limites(self):
+        # Au-delà de la dernière page : la dernière ; page invalide : la première
+        self.assertEqual(self.page(page=99)['pagination']['current_page'], 3)
+        self.assertEqual(self.page(page=0)['pagination']['current_page'], 3)
+        self.assertEqual(self.page(page='abc')['pagination']['current_page'], 1)
+        self.assertEqual(self.page(page_size=500)['pagination']['page_size'], 100)
+
+    def test_collection_vide(self):
+        self.client.force_authenticate(User.objects.create_user('nouveau', 'nouveau@example.com', 'motdepasse'))
+        data = self.page()
+        self.assertEqual(data['mangas_collection'], [])
+        self.assertEqual(data['total_tomes'], 0)
+        self.assertEqual(data['pagination']['total_items'], 0)
+        self.assertFalse(data['pagination']['has_next'])
+
+
+class SearchCursorTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        seinen = Category.objects.create(name='Seinen', slug='seinen')
+        # Trois « Berserk » : l'id départage, y compris à la frontière d'une page
+        for nom, categorie in (
+            ('Berserk', True), ('Akira', True), ('Berserk', True), ('Monster', False),
+            ('Berserk', True), ('Détective Conan', True), ('Zetman', True),
+        ):
+            manga = Manga.objects.create(nom=nom, prix='6.90', nombre_tome=1)
+            if categorie:
+                manga.categories.add(seinen)
+            if nom != 'Akira':
+                manga.tomes.get().possesseurs.add(self.user)
+
+    def parcourir(self, url, params, page_size=2):
+        """Toutes les pages en avant puis en arrière : [(nom, id)] et la dernière pagination"""
+        avant, cursor = [], ''
+        while True:
+            response = self.client.get(url, {**params, 'cursor': cursor, 'page_size': page_size})
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            avant.append([(m['nom'], m['id']) for m in data.get('mangas', data.get('mangas_collection'))])
+            pagination = data['pagination']
+            self.assertEqual(pagination['mode'], 'cursor')
+            if not pagination['has_next']:
+                break
+            cursor = pagination['next_cursor']
+
+        arriere = [avant[-1]]
+        while pagination['has_previous']:
+            data = self.client.get(url, {**params, 'cursor': pagination['previous_cursor'], 'page_size': page_size}).json()
+            arriere.insert(0, [(m['nom'], m['id']) for m in data.get('mangas', data.get('mangas_collection'))])
+            pagination = data['pagination']
+        self.assertEqual(arriere, avant)
+        return [ligne for page in avant for ligne in page]
+
+    def test_recherche_filtree(self):
+        attendu = list(
+            Manga.objects.filter(categories__slug='seinen').order_by('nom', 'id').values_list('nom', 'id')
+        )
+        self.assertEqual(len(attendu), 6)
+        self.assertEqual(self.parcourir('/api/recherche/', {'category': 'seinen'}), attendu)
+        # Taille de page qui coupe la série des « Berserk »
+        self.assertEqual(self.parcourir('/api/recherche/', {'category': 'seinen'}, page_size=3), attendu)
+
+    def test_recherche_texte(self):
+        berserk = list(Manga.objects.filter(nom='Berserk').order_by('id').values_list('nom', 'id'))
+        self.assertEqual(self.parcourir('/api/recherche/', {'q': 'berserk'}, page_size=1), berserk)
+
+    def test_collection(self):
+        attendu = list(
+            Manga.objects.filter(tomes__possesseurs=self.user).order_by('nom', 'id').values_list('nom', 'id')
+        )
+        self.assertNotIn('Akira', [nom for nom, _ in attendu])
+        self.assertEqual(self.parcourir('/api/collection/', {}), attendu)
+
+    def test_curseur_au_dela_de_la_fin(self):
+        cursor = encode_cursor('Zzz', 0, 'next')
+        for url in ('/api/recherche/', '/api/collection/'):
+            with self.subTest(url=url):
+                data = self.client.get(url, {'cursor': cursor}).json()
+                self.assertEqual(data.get('mangas', data.get('mangas_collection')), [])
+                self.assertFalse(data['pagination']['has_next'])
+                self.assertIsNone(data['pagination']['next_cursor'])
+
+    def test_encodage(self):
+        # Caractères non ASCII, sans padding base64 dans l'URL
+        cursor = encode_cursor('Détective Conan', 7, 'prev')
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), ('Détective Conan', 7, 'prev'))
+
+    def test_curseur_altere(self):
+        def brut(valeur):
+            return base64.urlsafe_b64encode(valeur).decode().rstrip('=')
+
+        alteres = (
+            encode_cursor('Berserk', 3, 'next')[:-2],
+            brut(b'["Berserk",3]'),
+            brut(b'{"nom":"Berserk"}'),
+            brut(b'["Berserk",true,"next"]'),
+            brut(b'[null,3,"next"]'),
+            brut(b'\xff\xfe'),
+            '%%%',
+        )
+        for url in ('/api/recherche/', '/api/collection/'):
+            for cursor in alteres:
+                with self.subTest(url=url, cursor=cursor):
+                    response = self.client.get(url, {'cursor': cursor})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertEqual(response.json(), {'error': 'Curseur invalide'})
+        # L'erreur n'est pas mise en cache à la place de la première page
+        self.assertEqual(self.client.get('/api/recherche/', {'cursor': ''}).status_code, 200)
+
+
+class FullTextSearchTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        shonen = Category.objects.create(name='Shonen', slug='shonen')
+        self.one_piece = Manga.objects.create(nom='One Piece', prix='6.90', nombre_tome=0)
+        self.one_piece.categories.add(shonen)
+        self.monster = Manga.objects.create(nom='Monster', prix='7.50', nombre_tome=0)
+
+    def rechercher(self, q):
+        response = self.client.get('/api/recherche/', {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [m['nom'] for m in response.json()['mangas']]
+
+    def test_fts(self):
+        self.assertTrue(search.fts_available())
+        # Préfixe de chaque mot, et correspondance sur le nom de catégorie
+        self.assertEqual(self.rechercher('one pie'), ['One Piece'])
+        self.assertEqual(self.rechercher('shonen'), ['One Piece'])
+
+    def test_repli_sans_fts5(self):
+        with mock.patch('produit.search.fts_available', return_value=False):
+            self.assertEqual(self.rechercher('piece'), ['One Piece'])
+            self.assertEqual(self.rechercher('MONST'), ['Monster'])
+            self.assertEqual(
+                list(search.search_mangas(Manga.objects.all(), 'one', rank=False).values_list('nom', flat=True)),
+                ['One Piece'],
+            )
+
+    def indexe(self, manga_id):
+        """Contenu de l'index FTS pour un manga : (nom, catégories) ou None"""
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT nom, categories FROM {search.FTS_TABLE} WHERE rowid = %s', [manga_id])
+            return cursor.fetchone()
+
+    def test_classement_bm25(self):
+        club = Manga.objects.create(nom='Shonen Club', prix='6.90', nombre_tome=0)
+        # Le nom pèse plus que la catégorie, quel que soit l'ordre alphabétique
+        self.assertEqual(self.rechercher('shonen'), ['Shonen Club', 'One Piece'])
+        ranks = list(search.search_mangas(Manga.objects.all(), 'shonen').values_list('id', 'search_rank'))
+        self.assertEqual([pk for pk, _ in ranks], [club.pk, self.one_piece.pk])
+        self.assertLess(ranks[0][1], ranks[1][1])
+
+    def test_requete_echappee(self):
+        self.assertEqual(search.build_match_query('one-pi'), '"one"* "pi"*')
+        self.assertEqual(search.build_match_query('"piece" OR *'), '"piece"* "OR"*')
+        self.assertIsNone(search.build_match_query(' !? '))
+        # Guillemets et opérateurs ne cassent pas la requête MATCH
+        self.assertEqual(self.rechercher('"piece" AND ('), [])
+        self.assertEqual(self.rechercher('"piece"'), ['One Piece'])
+
+    def test_repli_hors_sqlite(self):
+        with mock.patch.object(search, '_fts_available', None), \
+                mock.patch.object(search.connection, 'vendor', 'postgresql'):
+            self.assertFalse(search.fts_available())
+            self.assertEqual(
+                list(search.search_mangas(Manga.objects.all(), 'piece').values_list('nom', flat=True)),
+                ['One Piece'],
+            )
+            # Sans index, les écritures ne tentent pas de le mettre à jour
+            search.index_mangas([self.monster.pk])
+
+    def test_index_synchronise(self):
+        seinen = Category.objects.create(name='Seinen', slug='seinen')
+        self.assertEqual(self.indexe(self.monster.pk), ('Monster', ''))
+
+        self.monster.nom = 'Monster Perfect Edition'
+        self.monster.save()
+        self.monster.categories.add(seinen)
+        self.assertEqual(self.indexe(self.monster.pk), ('Monster Perfect Edition', 'Seinen'))
+        self.assertEqual(self.rechercher('perfect'), ['Monster Perfect Edition'])
+
+        # Catégorie renommée, puis retirée depuis la catégorie elle-même
+        seinen.name = 'Thriller'
+        seinen.save()
+        self.assertEqual(self.indexe(self.monster.pk), ('Monster Perfect Edition', 'Thriller'))
+        seinen.mangas.clear()
+        self.assertEqual(self.indexe(self.monster.pk), ('Monster Perfect Edition', ''))
+
+        # Catégorie supprimée : les mangas qui l'avaient sont réindexés
+        Category.objects.get(slug='shonen').delete()
+        self.assertEqual(self.indexe(self.one_piece.pk), ('One Piece', ''))
+        self.assertEqual(self.rechercher('shonen'), [])
+
+        monster_id = self.monster.pk
+        self.monster.delete()
+        self.assertIsNone(self.indexe(monster_id))
+        self.assertEqual(self.rechercher('monster'), [])
+
+    def test_reconstruction(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.FTS_TABLE}')
+        self.assertEqual(self.rechercher('piece'), [])
+        self.assertEqual(search.rebuild_index(), 2)
+        self.assertEqual(self.indexe(self.one_piece.pk), ('One Piece', 'Shonen'))
+
+    def test_index_inutilisable(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {search.FTS_TABLE}')
+        # L'index se dégrade sans empêcher les écritures du catalogue
+        with self.assertLogs('produit.search', 'WARNING'):
+            self.monster.delete()
+        with self.assertLogs('produit.search', 'WARNING'):
+            Manga.objects.create(nom='Pluto', prix='8.00', nombre_tome=0)
+        self.assertFalse(Manga.objects.filter(nom='Monster').exists())
+
+
+class FuzzySearchTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        trigram_index.reset()
+        for nom in ('Naruto Shippuden', 'Naruto', 'One Piece', 'Monster'):
+            Manga.objects.create(nom=nom, prix='6.90', nombre_tome=0)
+
+    def rechercher(self, q):
+        response = self.client.get('/api/recherche/', {'q': q, 'fuzzy': 1})
+        self.assertEqual(response.status_code, 200)
+        return [m['nom'] for m in response.json()['mangas']]
+
+    def test_faute_de_frappe(self):
+        # La faute est comparée mot à mot : un titre long est retrouvé ; à score égal, le plus court d'abord
+        self.assertEqual(self.rechercher('naurto'), ['Naruto', 'Naruto Shippuden'])
+        self.assertEqual(self.rechercher('shipuden'), ['Naruto Shippuden'])
+        self.assertEqual(self.rechercher('one pice')[0], 'One Piece')
+        self.assertEqual(self.rechercher('zzzz'), [])
+
+    def test_index_mis_a_jour_au_commit(self):
+        self.assertEqual(self.rechercher('monstre'), ['Monster'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Manga.objects.filter(nom='Monster').get().delete()
+            Manga.objects.create(nom='Pluto', prix='8.00', nombre_tome=0)
+        self.assertEqual(self.rechercher('monstre'), [])
+        self.assertEqual(self.rechercher('plutto'), ['Pluto'])
+
+    def test_rollback(self):
+        self.rechercher('naruto')
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Manga.objects.create(nom='Vagabond', prix='8.00', nombre_tome=0)
+                transaction.set_rollback(True)
+        self.assertEqual(trigram_index.search('vagabnd'), [])
+
+    def test_latence(self):
+        titres = titres_synthetiques(100000)
+        requetes = requetes_avec_faute(titres, 200)
+        durees, resultats = mesurer(indexer(titres), requetes)
+        self.assertLess(statistics.median(durees), 0.010)
+        trouves = sum(
+            any(mot in titres[pk - 1].lower().split() for pk, _ in resultat[:10])
+            for (_, mot), resultat in zip(requetes, resultats)
+        )
+        self.assertGreater(trouves / len(requetes), 0.75)
+
+
+class SuggestTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        prefix_index.reset()
+        for nom in ('One Punch Man', 'Onepunch', 'One Piece', 'Ōoku', 'Monster'):
+            Manga.objects.create(nom=nom, prix='6.90', nombre_tome=0)
+
+    def suggerer(self, q, **params):
+        response = self.client.get('/api/recherche/suggest/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [s['nom'] for s in response.json()['suggestions']]
+
+    def test_ordre_alphabetique(self):
+        # Préfixe sans casse ni accents, titres dans l'ordre des noms normalisés
+        self.assertEqual(self.suggerer('ONE'), ['One Piece', 'One Punch Man', 'Onepunch'])
+        self.assertEqual(self.suggerer('one p'), ['One Piece', 'One Punch Man'])
+        self.assertEqual(self.suggerer('oo'), ['Ōoku'])
+        self.assertEqual(self.suggerer(''), [])
+        self.assertEqual(self.suggerer('zz'), [])
+
+    def test_limite(self):
+        self.assertEqual(self.suggerer('one', limit=2), ['One Piece', 'One Punch Man'])
+        self.assertEqual(len(self.suggerer('o', limit='abc')), 4)
+        for numero in range(60):
+            Manga.objects.create(nom=f'Ore {numero:02d}', prix='6.90', nombre_tome=0)
+        prefix_index.reset()
+        self.assertEqual(len(self.suggerer('o', limit=1000)), 50)
+        self.assertEqual(len(self.suggerer('o')), 10)
+
+    def test_titres_renommes_ou_supprimes(self):
+        self.assertEqual(self.suggerer('mon'), ['Monster'])
+        with self.captureOnCommitCallbacks(execute=True):
+            one_piece = Manga.objects.get(nom='One Piece')
+            one_piece.nom = 'Wan Pisu'
+            one_piece.save()
+            Manga.objects.get(nom='Monster').delete()
+        self.assertEqual(self.suggerer('mon'), [])
+        self.assertEqual(self.suggerer('one'), ['One Punch Man', 'Onepunch'])
+        self.assertEqual(self.suggerer('wan'), ['Wan Pisu'])
+
+        # Une écriture annulée n'apparaît pas
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Manga.objects.create(nom='Monster Perfect Edition', prix='9.90', nombre_tome=0)
+                transaction.set_rollback(True)
+        self.assertEqual(self.suggerer('mon'), [])
+
+
+class FacetTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        shonen = Category.objects.create(name='Shonen', slug='shonen')
+        seinen = Category.objects.create(name='Seinen', slug='seinen')
+        self.naruto = Manga.objects.create(nom='Naruto', prix='6.90', nombre_tome=3)
+        self.naruto.categories.add(shonen)
+        Manga.objects.create(nom='Bleach', prix='6.90', nombre_tome=2).categories.add(shonen)
+        Manga.objects.create(nom='Monster', prix='7.50', nombre_tome=1).categories.add(seinen)
+
+    def rechercher(self, **params):
+        response = self.client.get('/api/recherche/', params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        facets = data['facets']
+        return (
+            [m['nom'] for m in data['mangas']],
+            {c['slug']: c['count'] for c in facets['categories']},
+            {t['numero']: t['count'] for t in facets['tomes']},
+        )
+
+    def test_comptes(self):
+        self.assertEqual(
+            self.rechercher(),
+            (['Bleach', 'Monster', 'Naruto'], {'seinen': 1, 'shonen': 2}, {1: 3, 2: 2, 3: 1}),
+        )
+        # Chaque facette ignore son propre filtre
+        self.assertEqual(
+            self.rechercher(category='shonen'),
+            (['Bleach', 'Naruto'], {'seinen': 1, 'shonen': 2}, {1: 2, 2: 2, 3: 1}),
+        )
+        self.assertEqual(
+            self.rechercher(tome=3),
+            (['Naruto'], {'seinen': 0, 'shonen': 1}, {1: 3, 2: 2, 3: 1}),
+        )
+        self.assertEqual(self.rechercher(q='naruto')[1:], ({'seinen': 0, 'shonen': 1}, {1: 1, 2: 1, 3: 1}))
+
+    def test_cache_par_filtre_effectif(self):
+        with mock.patch('connect.facets.compute_facets', wraps=facets.compute_facets) as compute:
+            self.rechercher(category='shonen', page_size=5)
+            self.rechercher(category=['shonen', 'shonen'], page_size=10)
+            self.rechercher(category='shonen', tome='abc')
+            self.assertEqual(compute.call_count, 1)
+
+            # Les slugs sont comparés tels quels par le filtre : pas de facettes d'une autre recherche
+            self.assertEqual(self.rechercher(category='Shonen'), ([], {'seinen': 1, 'shonen': 2}, {}))
+            self.assertEqual(compute.call_count, 2)
+
+    def test_invalidation(self):
+        self.rechercher(category='shonen')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.naruto.nombre_tome = 4
+            self.naruto.save()
+        self.assertEqual(self.rechercher(category='shonen')[2], {1: 2, 2: 2, 3: 1, 4: 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.naruto.categories.clear()
+        self.assertEqual(
+            self.rechercher(category='shonen'),
+            (['Bleach'], {'seinen': 1, 'shonen': 1}, {1: 1, 2: 1}),
+        )
+
+
+class CatalogCacheTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manga = Manga.objects.create(nom='Berserk', prix='6.90', nombre_tome=2)
+
+    def noms(self):
+        return [m['nom'] for m in self.client.get('/api/manga/').json()['mangas']]
+
+    def test_invalidation_apres_commit(self):
+        self.assertEqual(self.noms(), ['Berserk'])
+        version = catalog_cache.get_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manga.nom = 'Berserk Deluxe'
+            self.manga.save()
+            # Pas d'invalidation avant le commit : un lecteur concurrent ne met pas en cache l'ancien état
+            self.assertEqual(catalog_cache.get_version(), version)
+
+        self.assertGreater(catalog_cache.get_version(), version)
+        self.assertEqual(self.noms(), ['Berserk Deluxe'])
+
+    def test_detail_invalide_par_les_tomes(self):
+        url = f'/api/manga/{self.manga.pk}/'
+        self.assertEqual(len(self.client.get(url).json()['tomes']), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manga.nombre_tome = 3
+            self.manga.save()
+
+        self.assertEqual([t['numero'] for t in self.client.get(url).json()['tomes']], [1, 2, 3])
+
+    def test_categories(self):
+        self.assertEqual(self.client.get('/api/manga/').json()['mangas'][0]['categories'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manga.categories.add(Category.objects.create(name='Seinen', slug='seinen'))
+        self.assertEqual(
+            [c['name'] for c in self.client.get('/api/manga/').json()['mangas'][0]['categories']],
+            ['Seinen'],
+        )
+
+
+class SharedVersionTests(CatalogTestCase):
+    def setUp(self):
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        self.location = dossier.name
+        caches = override_settings(
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'catalog_versions': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': self.location,
+                    'TIMEOUT': None,
+                },
+            },
+            CATALOG_VERSION_CACHE_ALIAS='catalog_versions',
+        )
+        caches.enable()
+        self.addCleanup(caches.disable)
+        super().setUp()
+        self.manga = Manga.objects.create(nom='Berserk', prix='6.90', nombre_tome=1)
+
+    def test_version_modifiee_par_un_autre_processus(self):
+        response = self.client.get('/api/manga/')
+        self.assertEqual(response.json()['mangas'][0]['nom'], 'Berserk')
+        etag = response['ETag']
+
+        # Écriture d'un autre processus (worker Celery, import_catalog) : aucun signal ici,
+        # seule la version partagée change, via sa propre instance du cache
+        Manga.objects.filter(pk=self.manga.pk).update(nom='Berserk Deluxe')
+        self.assertEqual(self.client.get('/api/manga/').json()['mangas'][0]['nom'], 'Berserk')
+        autre_processus = FileBasedCache(self.location, {'TIMEOUT': None})
+        autre_processus.incr(catalog_cache._version_key(catalog_cache.CATALOG_SCOPE))
+
+        response = self.client.get('/api/manga/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['mangas'][0]['nom'], 'Berserk Deluxe')
+
+
+class ETagTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manga = Manga.objects.create(nom='Berserk', prix='6.90', nombre_tome=1)
+
+    def test_304_si_etag_identique(self):
+        response = self.client.get('/api/manga/', {'page_size': 5})
+        etag = response['ETag']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        for if_none_match in (etag, f'W/{etag}', f'"autre", {etag}', '*'):
+            with self.subTest(if_none_match=if_none_match):
+                # Réponse sans exécuter la vue : aucune requête SQL
+                with self.assertNumQueries(0):
+                    response = self.client.get('/api/manga/', {'page_size': 5}, HTTP_IF_NONE_MATCH=if_none_match)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+
+    def test_200_si_etag_different(self):
+        etag = self.client.get('/api/manga/')['ETag']
+        # Autre query string : autre ETag
+        response = self.client.get('/api/manga/', {'page_size': 5}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_change_avec_le_catalogue(self):
+        etag = self.client.get('/api/manga/')['ETag']
+        detail_etag = self.client.get(f'/api/manga/{self.manga.pk}/')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manga.prix = '7.20'
+            self.manga.save()
+
+        response = self.client.get('/api/manga/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['mangas'][0]['prix'], '7.20')
+        response = self.client.get(f'/api/manga/{self.manga.pk}/', HTTP_IF_NONE_MATCH=detail_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['manga']['prix'], 7.2)
+
+    @override_settings(CATALOG_ETAG_WINDOW=60)
+    def test_etag_expire_apres_la_fenetre(self):
+        # Même sans changement de version, un ETag de liste ou de recherche ne
+        # donne pas de 304 au-delà de la fenêtre
+        for url in ('/api/manga/', '/api/recherche/'):
+            with self.subTest(url=url):
+                with mock.patch('connect.etag.time.time', return_value=6000.0):
+                    etag = self.client.get(url, {'q': 'berserk'})['ETag']
+                with mock.patch('connect.etag.time.time', return_value=6059.0):
+                    response = self.client.get(url, {'q': 'berserk'}, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                with mock.patch('connect.etag.time.time', return_value=6060.0):
+                    response = self.client.get(url, {'q': 'berserk'}, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
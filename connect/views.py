@@ -1,19 +1,38 @@
 from django.shortcuts import get_object_or_404
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from produit.models import Manga, Tome, Category
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from produit.models import Manga, Tome, Category, ResumeCollection
+from produit import catalog_cache
+from django.conf import settings
+from utils.gcs import get_cached_signed_urls
 from produit.serializer import MangaSerializer
+from produit.search import search_mangas
+from produit.fuzzy import trigram_index
+from produit.autocomplete import prefix_index
+from produit.covers import build_srcset, variant_names
 from django.db import models
-from django.db.models import Prefetch
+from django.db.models import Prefetch, Case, When, IntegerField
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from rest_framework import status
+from .pagination import paginate_by_cursor, InvalidCursor
+from .facets import facets_params, get_facets, split_categories
+from .etag import catalog_etag
+
+# Maximum number of fuzzy matches considered by recherche_view
+FUZZY_MAX_RESULTS = 200
+
+# Default and maximum number of suggestions returned by suggest_view
+SUGGEST_DEFAULT_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def collection_view(request):
     """
     API endpoint to get user's manga collection with pagination
-    Query params: page (page number), page_size (items per page, default 10)
+    Query params: page (page number), page_size (items per page, default 10),
+                 cursor (opt-in keyset pagination on (nom, id), empty for the first page)
     Returns: JSON with user's collection of tomes grouped by manga and pagination info
     """
     # Get pagination parameters
@@ -30,28 +49,26 @@ def collection_view(request):
         page_size = 10
     
     user = request.user
-    collection_tomes = user.tomes_possedes.select_related('manga').order_by('manga__nom', 'numero')
-
-    # Group tomes by manga
-    mangas_dict = {}
-    for tome in collection_tomes:
-        manga = tome.manga
-        if manga.nom not in mangas_dict:
-            mangas_dict[manga.nom] = {
-                'id': manga.id,
-                'nom': manga.nom,
-                # 'auteur': manga.auteur,
-                'prix': float(manga.prix),
-                'tomes': []
-            }
-        mangas_dict[manga.nom]['tomes'].append({
-            "id": tome.id,
-            "numero": tome.numero,
+
+    # Paginate the owned mangas in SQL, then fetch only the tomes of the page
+    mangas = (
+        Manga.objects.filter(id__in=user.tomes_possedes.values('manga_id'))
+        .only('id', 'nom', 'prix')
+        .order_by('nom', 'id')
+    )
+
+    if 'cursor' in request.GET:
+        try:
+            mangas_page, pagination = paginate_by_cursor(mangas, request.GET.get('cursor'), page_size)
+        except InvalidCursor:
+            return Response({'error': 'Curseur invalide'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "mangas_collection": _collection_mangas(user, mangas_page),
+            "pagination": pagination,
         })
 
-    # Convert to list and apply pagination
-    mangas_list = list(mangas_dict.values())
-    paginator = Paginator(mangas_list, page_size)
+    paginator = Paginator(mangas, page_size)
     
     try:
         paginated_mangas = paginator.page(page)
@@ -61,8 +78,8 @@ def collection_view(request):
         paginated_mangas = paginator.page(paginator.num_pages)
 
     return Response({
-        "mangas_collection": list(paginated_mangas),
-        "total_tomes": collection_tomes.count(),
+        "mangas_collection": _collection_mangas(user, paginated_mangas),
+        "total_tomes": Tome.possesseurs.through.objects.filter(user=user).count(),
         "pagination": {
             'current_page': paginated_mangas.number,
             'total_pages': paginator.num_pages,
@@ -74,65 +91,111 @@ def collection_view(request):
             'previous_page': paginated_mangas.previous_page_number() if paginated_mangas.has_previous() else None,
         }
     })
-  
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
-def recherche_view(request):
+def collection_summary_view(request):
     """
-    API endpoint to search for mangas with filters and pagination
-    Query params: q (manga name), category (category id/slug), tome (tome number), 
-                 page (page number), page_size (items per page, default 10)
-    Returns: JSON with filtered mangas, available categories, and pagination info
+    API endpoint to get how many tomes of each manga the user owns and what's missing
+    Returns: JSON with one line per owned manga, read from the denormalized summary
     """
-    # Get pagination parameters
-    page = request.GET.get('page', 1)
-    page_size = request.GET.get('page_size', 10)
-    
-    try:
-        page = int(page)
-        page_size = int(page_size)
-        # Limit page_size to prevent abuse
-        page_size = min(page_size, 100)
-    except ValueError:
-        page = 1
-        page_size = 10
-    
-    # Build a single filtered queryset; avoid broad all() evaluation and N+1s
-    filters = models.Q()
+    resumes = (
+        ResumeCollection.objects.filter(utilisateur=request.user)
+        .select_related('manga')
+        .only('nombre_possedes', 'taux_completion', 'date_dernier_ajout',
+              'manga__id', 'manga__nom', 'manga__nombre_tome')
+        .order_by('manga__nom', 'manga__id')
+    )
 
-    q = request.GET.get('q')
-    
-    category_list = request.GET.getlist('category')
-    if not category_list:
-        single_category = request.GET.get('category')
-        if single_category:
-            category_list = [c.strip() for c in single_category.split(',') if c.strip()]
-    tome_num = request.GET.get('tome')
+    summary = [
+        {
+            'manga': {
+                'id': resume.manga.id,
+                'nom': resume.manga.nom,
+            },
+            'nombre_possedes': resume.nombre_possedes,
+            'nombre_tome': resume.manga.nombre_tome,
+            'nombre_manquants': resume.nombre_manquants,
+            'taux_completion': resume.taux_completion,
+            'date_dernier_ajout': resume.date_dernier_ajout.isoformat() if resume.date_dernier_ajout else None,
+        }
+        for resume in resumes
+    ]
 
-    if q:
-        filters &= models.Q(nom__icontains=q.strip())
+    return Response({
+        "summary": summary,
+        "total_mangas": len(summary),
+        "total_tomes": sum(line['nombre_possedes'] for line in summary),
+    })
+
+def _collection_mangas(user, mangas_page):
+    """Group the user's tomes under the mangas of one collection page"""
+    mangas_dict = {
+        manga.id: {
+            'id': manga.id,
+            'nom': manga.nom,
+            # 'auteur': manga.auteur,
+            'prix': float(manga.prix),
+            'tomes': []
+        }
+        for manga in mangas_page
+    }
+    tomes = (
+        user.tomes_possedes.filter(manga_id__in=mangas_dict.keys())
+        .only('id', 'numero', 'manga_id')
+        .order_by('numero')
+    )
+    for tome in tomes:
+        mangas_dict[tome.manga_id]['tomes'].append({
+            "id": tome.id,
+            "numero": tome.numero,
+        })
+    return list(mangas_dict.values())
+  
+def _search_queryset(q, fuzzy, filters, rank=True):
+    """
+    Mangas matching filters and q (full-text, or trigram when fuzzy),
+    ranked by relevance when q is given and by name otherwise.
+    Without rank, the queryset is only meant to be used as a subquery.
+    """
+    mangas = Manga.objects.filter(filters).order_by('nom')
+    if q and fuzzy:
+        # Typo-tolerant search on the trigram index, ranked by similarity
+        ranked_ids = [pk for pk, _ in trigram_index.search(q, limit=FUZZY_MAX_RESULTS)]
+        mangas = mangas.filter(id__in=ranked_ids)
+        if not rank:
+            return mangas
+        mangas = mangas.order_by(
+            Case(
+                *[When(id=pk, then=position) for position, pk in enumerate(ranked_ids)],
+                output_field=IntegerField(),
+            ),
+            'nom',
+        )
+    elif q:
+        # Full-text search (FTS5), ranked by relevance
+        mangas = search_mangas(mangas, q, rank=rank)
+    return mangas
+
+def _recherche_payload(q, fuzzy, category_list, tome_num, page, page_size, cursor):
+    """Build the recherche_view response body (cached by catalog version)"""
+    # Build a single filtered queryset; avoid broad all() evaluation and N+1s
+    category_filter = models.Q()
+    tome_filter = models.Q()
 
     needs_distinct = False
     if category_list:
-        ids = []
-        slugs = []
-        for t in category_list:
-            try:
-                ids.append(int(t))
-            except ValueError:
-                slugs.append(t)
-        q_filter = models.Q()
+        ids, slugs = split_categories(category_list)
         if ids:
-            q_filter |= models.Q(categories__id__in=ids)
+            category_filter |= models.Q(categories__id__in=ids)
         if slugs:
-            q_filter |= models.Q(categories__slug__in=slugs)
-        filters &= q_filter
+            category_filter |= models.Q(categories__slug__in=slugs)
         needs_distinct = True
 
     if tome_num:
         try:
             num = int(tome_num)
-            filters &= models.Q(tomes__numero=num)
+            tome_filter = models.Q(tomes__numero=num)
             needs_distinct = True
         except ValueError:
             pass
@@ -144,22 +207,35 @@ def recherche_view(request):
     )
 
     mangas = (
-        Manga.objects.filter(filters)
+        _search_queryset(q, fuzzy, category_filter & tome_filter)
         .prefetch_related(prefetch_categories)
-        .order_by('nom')
     )
     if needs_distinct:
         mangas = mangas.distinct()
 
     # Apply pagination
-    paginator = Paginator(mangas, page_size)
-    
-    try:
-        paginated_mangas = paginator.page(page)
-    except PageNotAnInteger:
-        paginated_mangas = paginator.page(1)
-    except EmptyPage:
-        paginated_mangas = paginator.page(paginator.num_pages)
+    if cursor is not None:
+        paginated_mangas, pagination = paginate_by_cursor(mangas, cursor, page_size)
+    else:
+        paginator = Paginator(mangas, page_size)
+
+        try:
+            paginated_mangas = paginator.page(page)
+        except PageNotAnInteger:
+            paginated_mangas = paginator.page(1)
+        except EmptyPage:
+            paginated_mangas = paginator.page(paginator.num_pages)
+
+        pagination = {
+            'current_page': paginated_mangas.number,
+            'total_pages': paginator.num_pages,
+            'total_items': paginator.count,
+            'page_size': page_size,
+            'has_next': paginated_mangas.has_next(),
+            'has_previous': paginated_mangas.has_previous(),
+            'next_page': paginated_mangas.next_page_number() if paginated_mangas.has_next() else None,
+            'previous_page': paginated_mangas.previous_page_number() if paginated_mangas.has_previous() else None,
+        }
 
     # Serialize manga results
     manga_list = []
@@ -174,39 +250,109 @@ def recherche_view(request):
             ]
         })
 
+    # Facet counts; each facet ignores its own filter
+    facets = get_facets(
+        facets_params(q or '', fuzzy, category_list, tome_num),
+        _search_queryset(q, fuzzy, tome_filter, rank=False),
+        _search_queryset(q, fuzzy, category_filter, rank=False),
+    )
+
     # Serialize categories
-    categories = Category.objects.only('id', 'name', 'slug').order_by('name')
     category_list_result = [
-        {'id': cat.id, 'name': cat.name, 'slug': cat.slug}
-        for cat in categories
+        {'id': cat['id'], 'name': cat['name'], 'slug': cat['slug']}
+        for cat in facets['categories']
     ]
 
-    return Response({
+    return {
         "mangas": manga_list,
         "categories": category_list_result,
-        "pagination": {
-            'current_page': paginated_mangas.number,
-            'total_pages': paginator.num_pages,
-            'total_items': paginator.count,
-            'page_size': page_size,
-            'has_next': paginated_mangas.has_next(),
-            'has_previous': paginated_mangas.has_previous(),
-            'next_page': paginated_mangas.next_page_number() if paginated_mangas.has_next() else None,
-            'previous_page': paginated_mangas.previous_page_number() if paginated_mangas.has_previous() else None,
-        },
+        "facets": facets,
+        "pagination": pagination,
         "filters": {
             "q": q or "",
+            "fuzzy": fuzzy,
             "selected_categories": category_list,
             "selected_tome": tome_num or "",
         }
-    })
+    }
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@catalog_etag('recherche')
+def recherche_view(request):
+    """
+    API endpoint to search for mangas with filters and pagination
+    Query params: q (manga name), fuzzy (1 for typo-tolerant matching on q),
+                 category (category id/slug), tome (tome number),
+                 page (page number), page_size (items per page, default 10),
+                 cursor (opt-in keyset pagination on (nom, id), empty for the first page)
+    Returns: JSON with filtered mangas, available categories, facet counts
+             (matching mangas per category and per tome number) and pagination info
+    """
+    # Get pagination parameters
+    page = request.GET.get('page', 1)
+    page_size = request.GET.get('page_size', 10)
+    
+    try:
+        page = int(page)
+        page_size = int(page_size)
+        # Limit page_size to prevent abuse
+        page_size = min(page_size, 100)
+    except ValueError:
+        page = 1
+        page_size = 10
+    cursor = request.GET.get('cursor') if 'cursor' in request.GET else None
+
+    q = request.GET.get('q')
+    fuzzy = request.GET.get('fuzzy') in ('1', 'true')
+
+    category_list = request.GET.getlist('category')
+    if not category_list:
+        single_category = request.GET.get('category')
+        if single_category:
+            category_list = [c.strip() for c in single_category.split(',') if c.strip()]
+    tome_num = request.GET.get('tome')
+
+    try:
+        payload = catalog_cache.get_or_build(
+            'recherche',
+            [q, fuzzy, category_list, tome_num, page, page_size, cursor],
+            lambda: _recherche_payload(q, fuzzy, category_list, tome_num, page, page_size, cursor),
+        )
+    except InvalidCursor:
+        return Response({'error': 'Curseur invalide'}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(payload)
     
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+def suggest_view(request):
+    """
+    API endpoint for search-box autocompletion, answered from memory
+    Query params: q (title prefix), limit (max suggestions, default 10)
+    Returns: JSON with the matching manga ids and names, in name order
+    """
+    q = request.GET.get('q', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', SUGGEST_DEFAULT_LIMIT)), 1), SUGGEST_MAX_LIMIT)
+    except ValueError:
+        limit = SUGGEST_DEFAULT_LIMIT
+
+    return Response({
+        "suggestions": [
+            {'id': pk, 'nom': nom}
+            for pk, nom in prefix_index.suggest(q, limit=limit)
+        ]
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@catalog_etag('mangas')
 def get_mangas(request):
     """
     API endpoint to get all mangas with pagination
-    Query params: page (page number), page_size (items per page, default 10)
+    Query params: page (page number), page_size (items per page, default 10),
+                 cursor (opt-in keyset pagination on (nom, id), empty for the first page)
     Returns: JSON with paginated mangas and pagination info
     """
     # Get pagination parameters
@@ -222,8 +368,31 @@ def get_mangas(request):
         page = 1
         page_size = 10
     
+    cursor = request.GET.get('cursor') if 'cursor' in request.GET else None
+
+    try:
+        payload = catalog_cache.get_or_build(
+            'mangas',
+            [page, page_size, cursor],
+            lambda: _mangas_payload(page, page_size, cursor),
+        )
+    except InvalidCursor:
+        return Response({'error': 'Curseur invalide'}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(payload)
+
+def _mangas_payload(page, page_size, cursor):
+    """Build the get_mangas response body (cached by catalog version)"""
     # Get all mangas with prefetched categories
     mangas = Manga.objects.prefetch_related('categories').all().order_by('nom')
+
+    if cursor is not None:
+        mangas_page, pagination = paginate_by_cursor(mangas, cursor, page_size)
+        serializer = MangaSerializer(mangas_page, many=True)
+        return {
+            'mangas': serializer.data,
+            'pagination': pagination,
+        }
     
     # Create paginator
     paginator = Paginator(mangas, page_size)
@@ -238,7 +407,7 @@ def get_mangas(request):
     # Serialize the paginated results
     serializer = MangaSerializer(paginated_mangas, many=True)
     
-    return Response({
+    return {
         'mangas': serializer.data,
         'pagination': {
             'current_page': paginated_mangas.number,
@@ -250,31 +419,66 @@ def get_mangas(request):
             'next_page': paginated_mangas.next_page_number() if paginated_mangas.has_next() else None,
             'previous_page': paginated_mangas.previous_page_number() if paginated_mangas.has_previous() else None,
         }
-    })
+    }
 
+# Cached signed cover URLs keep at least GCS_SIGNED_URL_SAFETY_MARGIN seconds of
+# validity when served: the detail ETag rotates twice as often, so a revalidated
+# response never hands out an expired URL
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@catalog_etag(
+    'manga',
+    scope=lambda kwargs: catalog_cache.manga_scope(kwargs['manga_id']),
+    window=max(settings.GCS_SIGNED_URL_SAFETY_MARGIN // 2, 1),
+)
 def manga_detail_view(request, manga_id):
     """
     API endpoint to get details of a specific manga
     Returns: JSON with manga details and all its tomes
     """
-    manga = get_object_or_404(Manga, id=manga_id)
-    tomes = manga.tomes.all().order_by('numero')
+    def _build():
+        manga = get_object_or_404(Manga, id=manga_id)
+        return {
+            "manga": {
+                "id": manga.id,
+                "nom": manga.nom,
+                "prix": float(manga.prix),
+                "description": getattr(manga, 'description', ''),
+            },
+            "tomes": list(
+                manga.tomes.order_by('numero').values_list(
+                    'id', 'numero', 'cover', 'cover_variantes', 'cover_placeholder'
+                )
+            ),
+        }
+
+    # Manga and tomes are cached per manga version; cover URLs come from the signed URL cache
+    detail = catalog_cache.get_or_build(
+        'manga_detail', [manga_id], _build, scope=catalog_cache.manga_scope(manga_id)
+    )
+    cover_urls = get_cached_signed_urls(
+        [cover for _, _, cover, _, _ in detail["tomes"]]
+        + [name for _, _, _, variantes, _ in detail["tomes"] for name in variant_names(variantes)]
+    )
     
     return Response({
-        "manga": {
-            "id": manga.id,
-            "nom": manga.nom,
-            "prix": float(manga.prix),
-            "description": getattr(manga, 'description', ''),
-        },
+        "manga": detail["manga"],
         "tomes": [
             {
-                "id": tome.id,
-                "numero": tome.numero,
-                "cover": tome.get_signed_cover_url() if hasattr(tome, 'get_signed_cover_url') else (tome.cover.url if tome.cover else None),
+                "id": tome_id,
+                "numero": numero,
+                "cover": cover_urls.get(cover),
+                "cover_srcset": build_srcset(variantes, placeholder, cover_urls),
             }
-            for tome in tomes
+            for tome_id, numero, cover, variantes, placeholder in detail["tomes"]
         ]
     })
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def catalog_cache_stats_view(request):
+    """
+    API endpoint exposing the catalog cache counters (staff only)
+    Returns: JSON with current catalog version, hits, misses and hit ratio
+    """
+    return Response(catalog_cache.get_stats())
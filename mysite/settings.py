@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from datetime import timedelta
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from google.oauth2 import service_account
 import os
 
@@ -159,6 +160,28 @@ GS_BUCKET_NAME = os.getenv('GS_BUCKET_NAME', 'django-gema-decouverte')  # Votre
 GS_PROJECT_ID = os.getenv('GS_PROJECT_ID', 'mindmap-460721')  # ID de votre projet Google Cloud
 GS_DEFAULT_ACL = None  # Pas d'ACL pour les buckets avec accès uniforme
 GS_FILE_OVERWRITE = False
+# Uploads résumables par morceaux (multiple de 256 Ko) : un fichier n'est jamais envoyé d'un bloc
+GS_BLOB_CHUNK_SIZE = 8 * 1024 * 1024
+
+# URLs signées des couvertures : durée de vie, marge avant expiration sous laquelle
+# une URL n'est plus réutilisée, taille du cache local et cache partagé utilisé
+GCS_SIGNED_URL_LIFETIME = int(os.getenv('GCS_SIGNED_URL_LIFETIME', 3600))  # secondes
+GCS_SIGNED_URL_SAFETY_MARGIN = 300  # secondes
+GCS_SIGNED_URL_CACHE_SIZE = 10000
+GCS_SIGNED_URL_CACHE_ALIAS = 'default'
+
+# Largeurs (px) des déclinaisons WebP/JPEG générées pour chaque couverture
+COVER_DERIVATIVE_WIDTHS = (160, 320, 640)
+
+# Cache disque (LRU) des couvertures lues depuis GCS
+COVER_CACHE_DIR = os.getenv('COVER_CACHE_DIR', str(BASE_DIR / '.cover_cache'))
+COVER_CACHE_MAX_BYTES = int(os.getenv('COVER_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Upload des couvertures : taille max d'une image, taille décompressée max d'une archive zip
+# et threads de l'import zip (admin)
+COVER_UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+COVER_ZIP_MAX_BYTES = 1024 * 1024 * 1024
+COVER_UPLOAD_WORKERS = 8
 
 # Configuration des médias (images uploadées)
 STORAGES = {
@@ -168,6 +191,10 @@ STORAGES = {
     "staticfiles": {
         "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
     },
+    # Lecture des couvertures via un cache disque devant le stockage "default"
+    "cover_cache": {
+        "BACKEND": "utils.cached_storage.CachedStorage",
+    },
 }
 MEDIA_URL = f'https://storage.googleapis.com/{GS_BUCKET_NAME}/karl/'
 MEDIA_ROOT = ''
@@ -297,6 +324,46 @@ DJOSER = {
     'TOKEN_MODEL': None,  # Nous utilisons JWT, pas de token dans la base de données
 }
 
+# Cache Configuration
+# Shared Redis cache when CACHE_REDIS_URL is set, per-process memory cache otherwise.
+# The catalog cache versions (produit/catalog_cache.py) must be shared by every process
+# (web workers, Celery, import_catalog): without Redis they live in a file cache, which
+# only works on a single machine, so CACHE_REDIS_URL is required when DEBUG is off.
+if os.getenv('CACHE_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_REDIS_URL'),
+        }
+    }
+    CATALOG_VERSION_CACHE_ALIAS = 'default'
+elif DEBUG:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'catalog_versions': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CATALOG_VERSION_CACHE_DIR', str(BASE_DIR / '.catalog_versions')),
+            'TIMEOUT': None,
+        },
+    }
+    CATALOG_VERSION_CACHE_ALIAS = 'catalog_versions'
+else:
+    raise ImproperlyConfigured(
+        "CACHE_REDIS_URL is required when DEBUG is off: the catalog cache versions "
+        "must be shared by the web, Celery and management command processes."
+    )
+CATALOG_CACHE_TIMEOUT = 300  # seconds
+CATALOG_ETAG_WINDOW = CATALOG_CACHE_TIMEOUT  # seconds before a catalog ETag rotates even without a version bump
+INDEX_VERSION_CHECK_INTERVAL = 1.0  # seconds between checks of the shared titles version
+
+# Cart store: 'db' (Panier/PanierItem) or 'redis' (Redis hashes written back to the database)
+PANIER_BACKEND = os.getenv('PANIER_BACKEND', 'db')
+PANIER_REDIS_URL = os.getenv('PANIER_REDIS_URL', 'redis://localhost:6379/1')
+PANIER_REDIS_TTL = 30 * 24 * 3600  # seconds without activity before a cart leaves Redis
+PANIER_REDIS_FLUSH_DELAY = 30  # seconds between a change and its write to the database
+
 # Celery Configuration
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
@@ -304,9 +371,25 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+# Balayage périodique des événements Stripe restés en attente (réessais épuisés, worker arrêté) ;
+# nécessite celery beat
+CELERY_BEAT_SCHEDULE = {
+    'traiter-evenements-stripe': {
+        'task': 'produit.tasks.traiter_evenements_stripe_task',
+        'schedule': timedelta(minutes=5),
+        'kwargs': {'reessayer': False},
+    },
+}
 
 # Stripe Configuration
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', 'pk_test_your_publishable_key_here')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', 'sk_test_your_secret_key_here')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', 'whsec_your_webhook_secret_here')
-STRIPE_CURRENCY = 'eur'  # Change to your preferred currency
\ No newline at end of file
+STRIPE_CURRENCY = 'eur'  # Change to your preferred currency
+# URL de l'API Stripe ; ex. http://127.0.0.1:12111 pour le faux Stripe local (manage.py fake_stripe)
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', '')
+# Client Stripe partagé (utils/stripe_client.py) : timeouts en secondes, réessais réseau, taille du pool HTTP
+STRIPE_CONNECT_TIMEOUT = float(os.getenv('STRIPE_CONNECT_TIMEOUT', '3'))
+STRIPE_READ_TIMEOUT = float(os.getenv('STRIPE_READ_TIMEOUT', '10'))
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', '2'))
+STRIPE_HTTP_POOL_SIZE = int(os.getenv('STRIPE_HTTP_POOL_SIZE', '20'))
\ No newline at end of file
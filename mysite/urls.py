@@ -26,7 +26,11 @@ urlpatterns = [
     path('api/manga/', connect_view.get_mangas, name="get_mangas"),
     path('api/manga/<int:manga_id>/', connect_view.manga_detail_view, name='manga_detail'),
     path('api/collection/', connect_view.collection_view, name="collection"),
+    path('api/collection/summary/', connect_view.collection_summary_view, name="collection_summary"),
     path('api/recherche/', connect_view.recherche_view, name="recherche"),
+    path('api/recherche/suggest/', connect_view.suggest_view, name="recherche_suggest"),
+    path('api/catalog/cache/stats/', connect_view.catalog_cache_stats_view, name="catalog_cache_stats"),
+    path('api/tomes/<int:tome_id>/cover/', produit_view.upload_cover_view, name="upload_cover"),
     
     # Shopping Cart API endpoints
     path('api/panier/', produit_view.panier_view, name='panier'),
@@ -34,6 +38,7 @@ urlpatterns = [
     path('api/panier/retirer/<int:tome_id>/', produit_view.retirer_du_panier_view, name='retirer_du_panier'),
     path('api/panier/modifier/<int:tome_id>/', produit_view.modifier_quantite_view, name='modifier_quantite'),
     path('api/panier/vider/', produit_view.vider_panier_view, name='vider_panier'),
+    path('api/panier/batch/', produit_view.panier_batch_view, name='panier_batch'),
     
     # Order API endpoints
     path('api/commandes/create/', produit_view.commander_view, name='commander'),
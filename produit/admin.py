@@ -1,14 +1,86 @@
+import zipfile
+
+from django import forms
 from django.contrib import admin, messages
 from django.contrib.auth.forms import User
 from django.contrib.auth.models import send_mail
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+
+from .models import Manga, Tome, Commande, Category, StripeWebhookEvent
+from .stripe_events import rejouer_evenements
+from .uploads import CoverUploadError, import_covers_zip
+
+
+class CouverturesZipForm(forms.Form):
+    archive = forms.FileField(
+        label="Archive zip",
+        help_text="Une image par tome ; le numéro du tome est le dernier nombre du nom de fichier (ex. tome-12.jpg).",
+    )
+
+    def clean_archive(self):
+        archive = self.cleaned_data['archive']
+        if not zipfile.is_zipfile(archive):
+            raise forms.ValidationError("Le fichier n'est pas une archive zip valide.")
+        archive.seek(0)
+        return archive
 
-from .models import Manga, Tome, Commande, Category
 
 class MangaAdmin(admin.ModelAdmin):
     list_display = ('ref', 'nom', 'prix', 'nombre_tome',)
     search_fields = ('nom', 'prix', 'categories__name')
     list_filter = ('categories',)
     filter_horizontal = ('categories',)
+    actions = ['importer_couvertures_zip']
+
+    def get_urls(self):
+        urls = [
+            path(
+                '<int:manga_id>/couvertures-zip/',
+                self.admin_site.admin_view(self.couvertures_zip_view),
+                name='produit_manga_couvertures_zip',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    @admin.action(description="Importer les couvertures depuis un zip")
+    def importer_couvertures_zip(self, request, queryset):
+        if queryset.count() != 1:
+            self.message_user(request, "Sélectionnez un seul manga.", messages.WARNING)
+            return None
+        return redirect(reverse('admin:produit_manga_couvertures_zip', args=[queryset.get().pk]))
+
+    def couvertures_zip_view(self, request, manga_id):
+        manga = get_object_or_404(Manga, pk=manga_id)
+        if not self.has_change_permission(request, manga):
+            return redirect(reverse('admin:produit_manga_changelist'))
+
+        form = CouverturesZipForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            try:
+                result = import_covers_zip(manga, form.cleaned_data['archive'])
+            except CoverUploadError as exc:
+                self.message_user(request, str(exc), messages.ERROR)
+                return redirect(reverse('admin:produit_manga_change', args=[manga.pk]))
+            self.message_user(
+                request,
+                f"{len(result['uploaded'])} couverture(s) importée(s), "
+                f"{len(result['skipped'])} fichier(s) ignoré(s).",
+                messages.SUCCESS,
+            )
+            for filename, error in result['errors'].items():
+                self.message_user(request, f"{filename} : {error}", messages.ERROR)
+            return redirect(reverse('admin:produit_manga_change', args=[manga.pk]))
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f"Importer les couvertures de {manga.nom}",
+            'manga': manga,
+            'form': form,
+        }
+        return TemplateResponse(request, 'admin/produit/manga/couvertures_zip.html', context)
 
 class TomeAdmin(admin.ModelAdmin):
     list_display = ('manga', 'numero', 'cover')
@@ -21,9 +93,30 @@ class CommandeAdmin(admin.ModelAdmin):
     readonly_fields = ('reference', 'utilisateur', 'statut', 'total_tomes', 'total_prix', 'date_creation', 'date_modification')
     ordering = ('-date_creation',)
 
+class StripeWebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('stripe_event_id', 'event_type', 'processed', 'tentatives', 'date_creation', 'date_traitement')
+    search_fields = ('stripe_event_id',)
+    list_filter = ('processed', 'event_type', 'date_creation')
+    readonly_fields = ('stripe_event_id', 'event_type', 'processed', 'data', 'date_creation',
+                       'date_traitement', 'tentatives', 'derniere_erreur')
+    ordering = ('-date_creation',)
+    actions = ['rejouer']
+
+    @admin.action(description="Retraiter les événements sélectionnés")
+    def rejouer(self, request, queryset):
+        result = rejouer_evenements(queryset)
+        self.message_user(request, f"{result['traites']} événement(s) traité(s).", messages.SUCCESS)
+        if result['echecs']:
+            self.message_user(
+                request,
+                f"{len(result['echecs'])} échec(s) : {', '.join(result['echecs'][:20])}",
+                messages.ERROR,
+            )
+
 admin.site.register(Manga, MangaAdmin)
 admin.site.register(Tome, TomeAdmin)
 admin.site.register(Commande, CommandeAdmin)
+admin.site.register(StripeWebhookEvent, StripeWebhookEventAdmin)
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'slug')
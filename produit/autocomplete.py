@@ -0,0 +1,82 @@
+"""
+In-process prefix index over Manga.nom for search-box autocompletion
+"""
+from bisect import bisect_left, insort
+
+from .catalog_cache import VersionedIndex
+from .text import normalize_title
+
+
+class PrefixIndex(VersionedIndex):
+    """
+    Sorted array of (normalized nom, manga id) answering prefix lookups with bisect
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._keys = []
+        self._noms = {}
+
+    def _clear(self):
+        self._keys = []
+        self._noms = {}
+
+    def _load(self):
+        from .models import Manga
+
+        keys = []
+        noms = {}
+        for pk, nom in Manga.objects.values_list('id', 'nom').iterator(chunk_size=5000):
+            keys.append((normalize_title(nom), pk))
+            noms[pk] = nom
+        keys.sort()
+        self._keys = keys
+        self._noms = noms
+
+    def _remove(self, pk):
+        nom = self._noms.pop(pk, None)
+        if nom is None:
+            return
+        key = (normalize_title(nom), pk)
+        position = bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            del self._keys[position]
+
+    def update(self, pk, nom, version=None):
+        """Index (or re-index) one manga"""
+        if not self._built:
+            return
+        with self._lock:
+            self._remove(pk)
+            self._noms[pk] = nom
+            insort(self._keys, (normalize_title(nom), pk))
+            self._advance(version)
+
+    def remove(self, pk, version=None):
+        """Remove one manga from the index"""
+        if not self._built:
+            return
+        with self._lock:
+            self._remove(pk)
+            self._advance(version)
+
+    def suggest(self, prefix, limit=10):
+        """Return [(manga_id, nom)] for the titles starting with prefix, in name order"""
+        self._ensure_built()
+        prefix = normalize_title(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            keys = self._keys
+            position = bisect_left(keys, (prefix,))
+            suggestions = []
+            while position < len(keys) and len(suggestions) < limit:
+                key, pk = keys[position]
+                if not key.startswith(prefix):
+                    break
+                suggestions.append((pk, self._noms[pk]))
+                position += 1
+        return suggestions
+
+
+prefix_index = PrefixIndex()
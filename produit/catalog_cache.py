@@ -0,0 +1,173 @@
+"""
+Versioned cache for catalog reads (mangas, tomes, categories)
+
+Cached entries are keyed on a version number instead of being deleted: a write
+bumps the version of its scope (from the model signals, once the transaction
+commits) and every entry built on the previous version simply stops being
+read, then expires.
+
+The versions (and the hit/miss counters) are kept in the cache named by
+CATALOG_VERSION_CACHE_ALIAS, shared by every process: a bump made by a Celery
+worker or a management command must reach the web workers. The entries
+themselves may live in a per-process cache.
+
+Scopes:
+    CATALOG_SCOPE  any catalog change (lists, search, facets)
+    TITLES_SCOPE   a manga was added, renamed or removed (in-memory search indexes)
+    manga_scope()  one manga or one of its tomes changed (detail endpoint)
+"""
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+
+CATALOG_SCOPE = 'catalog'
+TITLES_SCOPE = 'titles'
+
+STATS_HITS_KEY = 'catalog:stats:hits'
+STATS_MISSES_KEY = 'catalog:stats:misses'
+
+_MISSING = object()
+
+
+def manga_scope(manga_id):
+    return f'manga:{manga_id}'
+
+
+def _version_key(scope):
+    return f'catalog:version:{scope}'
+
+
+def version_cache():
+    """Cache shared by all processes holding the versions and the counters"""
+    return caches[getattr(settings, 'CATALOG_VERSION_CACHE_ALIAS', 'default')]
+
+
+def get_version(scope=CATALOG_SCOPE):
+    versions = version_cache()
+    version = versions.get(_version_key(scope))
+    if version is None:
+        versions.add(_version_key(scope), 1, timeout=None)
+        version = versions.get(_version_key(scope), 1)
+    return version
+
+
+def bump_version(scope=CATALOG_SCOPE):
+    """Invalidate every entry of the scope. Returns the new version."""
+    versions = version_cache()
+    try:
+        return versions.incr(_version_key(scope))
+    except ValueError:
+        # Version unknown (first write or evicted): start above any reader default
+        versions.add(_version_key(scope), 2, timeout=None)
+        return get_version(scope)
+
+
+def bump_on_commit(*scopes):
+    """
+    Bump the scopes (the whole catalog by default) once the current transaction
+    commits, so that a concurrent reader cannot cache pre-commit rows under the
+    new version. Outside a transaction the bump happens immediately.
+    """
+    scopes = scopes or (CATALOG_SCOPE,)
+
+    def _bump():
+        for scope in scopes:
+            bump_version(scope)
+
+    transaction.on_commit(_bump)
+
+
+def _incr_stat(key):
+    try:
+        version_cache().incr(key)
+    except ValueError:
+        version_cache().add(key, 1, timeout=None)
+
+
+def get_or_build(name, params, builder, scope=CATALOG_SCOPE):
+    """
+    Return the cached value of name/params for the current version of scope,
+    calling builder() on a miss. params must be JSON serializable.
+    """
+    digest = hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    key = f'catalog:{scope}:v{get_version(scope)}:{name}:{digest}'
+
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        _incr_stat(STATS_HITS_KEY)
+        return value
+
+    _incr_stat(STATS_MISSES_KEY)
+    value = builder()
+    cache.set(key, value, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+    return value
+
+
+def get_stats():
+    hits = version_cache().get(STATS_HITS_KEY, 0)
+    misses = version_cache().get(STATS_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'version': get_version(CATALOG_SCOPE),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+def reset_stats():
+    version_cache().delete_many([STATS_HITS_KEY, STATS_MISSES_KEY])
+
+
+class VersionedIndex:
+    """
+    Base class for the in-process search indexes built from the Manga titles.
+
+    The index is loaded lazily and follows TITLES_SCOPE: incremental updates
+    from the signals of this process move it to the new version, while a
+    version bumped by another process (or a bulk import) makes it reload on
+    the next lookup. The shared version is read at most once per
+    INDEX_VERSION_CHECK_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = False
+        self._version = None
+        self._checked_at = 0.0
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _clear(self):
+        raise NotImplementedError
+
+    def _ensure_built(self):
+        now = time.monotonic()
+        interval = getattr(settings, 'INDEX_VERSION_CHECK_INTERVAL', 1.0)
+        if self._built and now - self._checked_at < interval:
+            return
+        version = get_version(TITLES_SCOPE)
+        with self._lock:
+            if not self._built or self._version != version:
+                self._load()
+                self._version = version
+                self._built = True
+            self._checked_at = now
+
+    def _advance(self, version):
+        # Only follow the new version if no other change was missed in between
+        if version is not None and self._version == version - 1:
+            self._version = version
+
+    def reset(self):
+        """Drop the index, it will be rebuilt on next lookup"""
+        with self._lock:
+            self._clear()
+            self._built = False
+            self._version = None
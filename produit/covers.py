@@ -0,0 +1,104 @@
+"""
+Cover image derivatives: fixed-width WebP/JPEG renditions and a blurred placeholder
+"""
+import base64
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from PIL import Image, ImageFilter, ImageOps
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+PLACEHOLDER_SIZE = 16
+
+
+def derivative_widths():
+    return getattr(settings, 'COVER_DERIVATIVE_WIDTHS', (160, 320, 640))
+
+
+def derivative_name(original_name, width, extension):
+    """karlBouvier/cover.png -> karlBouvier/cover_320w.webp (next to the original)"""
+    stem, _ = os.path.splitext(original_name)
+    return f'{stem}_{width}w.{extension}'
+
+
+def _encode(image, image_format, options):
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def build_placeholder(image):
+    """Tiny blurred WebP as a data URI, shown while the real cover loads"""
+    small = image.copy()
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE * 2))
+    small = small.filter(ImageFilter.GaussianBlur(1))
+    data = _encode(small, 'WEBP', {'quality': 40})
+    return 'data:image/webp;base64,' + base64.b64encode(data).decode('ascii')
+
+
+def generate_derivatives(cover_name, storage=None, previous=None):
+    """
+    Render every width/format of the cover and store them next to it.
+    previous (a former `cover_variantes`) is deleted once the new files are saved.
+    Returns (variantes, placeholder).
+    """
+    storage = storage or storages['cover_cache']
+    with storage.open(cover_name, 'rb') as source:
+        image = Image.open(source)
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB')
+
+    variantes = {}
+    for width in derivative_widths():
+        rendition = image.copy()
+        # thumbnail() never upscales: small originals keep their size
+        rendition.thumbnail((width, width * 4), Image.Resampling.LANCZOS)
+        for extension, (image_format, options) in FORMATS.items():
+            name = storage.save(
+                derivative_name(cover_name, width, extension),
+                ContentFile(_encode(rendition, image_format, options)),
+            )
+            variantes.setdefault(extension, {})[str(width)] = name
+
+    placeholder = build_placeholder(image)
+
+    for name in variant_names(previous or {}):
+        if name not in variant_names(variantes):
+            try:
+                storage.delete(name)
+            except Exception as exc:
+                logger.warning(f"Could not delete old cover derivative {name}: {exc}")
+
+    return variantes, placeholder
+
+
+def variant_names(variantes):
+    return [name for sizes in (variantes or {}).values() for name in sizes.values()]
+
+
+def build_srcset(variantes, placeholder, urls):
+    """
+    srcset-style map for the API: {"webp": {"320w": url, ...}, "jpeg": {...}, "placeholder": data URI}
+    urls maps stored file names to (signed) URLs. None when no derivative exists yet.
+    """
+    if not variantes:
+        return None
+    srcset = {
+        extension: {
+            f'{width}w': urls.get(name)
+            for width, name in sorted(sizes.items(), key=lambda item: int(item[0]))
+        }
+        for extension, sizes in variantes.items()
+    }
+    srcset['placeholder'] = placeholder or None
+    return srcset
@@ -0,0 +1,255 @@
+"""
+Local stand-in for the Stripe API, for load tests of the payment flow
+
+Serves the PaymentIntent endpoints used by create_payment_intent (point
+STRIPE_API_BASE at it) with configurable latency and error rate, then
+confirms each intent and posts a signed payment_intent.succeeded or
+payment_intent.payment_failed event to the app's webhook, exactly as
+stripe.Webhook.construct_event expects it. Run with manage.py fake_stripe.
+"""
+import hashlib
+import hmac
+import json
+import random
+import re
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+WEBHOOK_ATTEMPTS = 3
+WEBHOOK_TIMEOUT = 10
+
+INTENT_PATH = re.compile(r'^/v1/payment_intents/(?P<id>pi_[A-Za-z0-9]+)(?P<confirm>/confirm)?$')
+
+
+def signature_header(payload, secret, timestamp=None):
+    """En-tête Stripe-Signature d'un payload (bytes ou str) : 't=...,v1=HMAC-SHA256'"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8')
+    signature = hmac.new(secret.encode('utf-8'), f'{timestamp}.{payload}'.encode('utf-8'), hashlib.sha256)
+    return f't={timestamp},v1={signature.hexdigest()}'
+
+
+def parse_form(body):
+    """Corps form-encoded de stripe-python -> dict imbriqué ('metadata[commande_id]=1')"""
+    data = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        parts = re.findall(r'[^\[\]]+', key)
+        target = data
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return data
+
+
+class FakeStripe:
+    """
+    État du faux Stripe : PaymentIntents en mémoire, injection de latence et d'erreurs,
+    envoi des webhooks signés (pool de threads).
+    """
+
+    def __init__(self, webhook_url=None, webhook_secret='', latency=0.0, jitter=0.0,
+                 error_rate=0.0, decline_rate=0.0, confirm_after=1.0, webhook_workers=8):
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.decline_rate = decline_rate
+        # Délai avant confirmation automatique (None : seulement via /confirm)
+        self.confirm_after = confirm_after
+        self.intents = {}
+        self._confirmed = set()
+        self._idempotency = {}
+        self.stats = {
+            'intents': 0,
+            'errors': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'webhooks_sent': 0,
+            'webhooks_failed': 0,
+        }
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=webhook_workers)
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    # Comportement simulé
+
+    def wait(self):
+        delay = self.latency + (random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def should_fail(self):
+        if self.error_rate and random.random() < self.error_rate:
+            self._count('errors')
+            return True
+        return False
+
+    # PaymentIntents
+
+    def create_intent(self, params, idempotency_key=None):
+        with self._lock:
+            if idempotency_key in self._idempotency:
+                # Comme Stripe : même clé d'idempotence, même PaymentIntent
+                return self.intents[self._idempotency[idempotency_key]]
+            intent_id = f'pi_{secrets.token_hex(12)}'
+            intent = {
+                'id': intent_id,
+                'object': 'payment_intent',
+                'amount': int(params.get('amount', 0)),
+                'currency': params.get('currency', 'eur'),
+                'client_secret': f'{intent_id}_secret_{secrets.token_hex(12)}',
+                'created': int(time.time()),
+                'livemode': False,
+                'metadata': params.get('metadata', {}),
+                'status': 'requires_payment_method',
+            }
+            self.intents[intent_id] = intent
+            if idempotency_key:
+                self._idempotency[idempotency_key] = intent_id
+            self.stats['intents'] += 1
+        if self.confirm_after is not None:
+            timer = threading.Timer(self.confirm_after, self.confirm_intent, args=[intent_id])
+            timer.daemon = True
+            timer.start()
+        return intent
+
+    def confirm_intent(self, intent_id):
+        with self._lock:
+            intent = self.intents.get(intent_id)
+            if intent is None or intent_id in self._confirmed:
+                return intent
+            self._confirmed.add(intent_id)
+            if self.decline_rate and random.random() < self.decline_rate:
+                intent['last_payment_error'] = {'type': 'card_error', 'code': 'card_declined',
+                                                'message': 'Your card was declined.'}
+                event_type, stat = 'payment_intent.payment_failed', 'failed'
+            else:
+                intent['status'] = 'succeeded'
+                event_type, stat = 'payment_intent.succeeded', 'succeeded'
+            self.stats[stat] += 1
+            obj = dict(intent)
+        self.emit(event_type, obj)
+        return obj
+
+    # Webhooks
+
+    def emit(self, event_type, obj):
+        if not self.webhook_url:
+            return None
+        event = {
+            'id': f'evt_{secrets.token_hex(12)}',
+            'object': 'event',
+            'api_version': '2024-06-20',
+            'created': int(time.time()),
+            'livemode': False,
+            'type': event_type,
+            'data': {'object': obj},
+        }
+        return self._executor.submit(self._deliver, json.dumps(event).encode('utf-8'))
+
+    def _deliver(self, payload):
+        for attempt in range(WEBHOOK_ATTEMPTS):
+            request = urllib.request.Request(self.webhook_url, data=payload, method='POST', headers={
+                'Content-Type': 'application/json',
+                'Stripe-Signature': signature_header(payload, self.webhook_secret),
+            })
+            try:
+                with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT) as response:
+                    if 200 <= response.status < 300:
+                        self._count('webhooks_sent')
+                        return True
+            except (urllib.error.URLError, OSError):
+                pass
+            if attempt + 1 < WEBHOOK_ATTEMPTS:
+                time.sleep(0.5 * 2 ** attempt)
+        self._count('webhooks_failed')
+        return False
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeStripe/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def stripe(self):
+        return self.server.fake_stripe
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Request-Id', f'req_{secrets.token_hex(8)}')
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # Le client a abandonné (timeout) : cas normal en test de charge
+            self.close_connection = True
+
+    def _error(self, status, message, error_type='api_error'):
+        self._send(status, {'error': {'type': error_type, 'message': message}})
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length).decode('utf-8') if length else ''
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/_stats':
+            return self._send(200, self.stripe.snapshot())
+        match = INTENT_PATH.match(path)
+        if match is None or match['confirm']:
+            return self._error(404, f'Unrecognized request URL (GET: {path})', 'invalid_request_error')
+        self.stripe.wait()
+        intent = self.stripe.intents.get(match['id'])
+        if intent is None:
+            return self._error(404, f"No such payment_intent: '{match['id']}'", 'invalid_request_error')
+        return self._send(200, intent)
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        params = parse_form(self._body())
+        self.stripe.wait()
+        if self.stripe.should_fail():
+            return self._error(500, 'Simulated Stripe error')
+
+        if path == '/v1/payment_intents':
+            return self._send(200, self.stripe.create_intent(params, self.headers.get('Idempotency-Key')))
+        match = INTENT_PATH.match(path)
+        if match is not None and match['confirm']:
+            intent = self.stripe.confirm_intent(match['id'])
+            if intent is None:
+                return self._error(404, f"No such payment_intent: '{match['id']}'", 'invalid_request_error')
+            return self._send(200, intent)
+        return self._error(404, f'Unrecognized request URL (POST: {path})', 'invalid_request_error')
+
+
+def make_server(host, port, fake_stripe, verbose=False):
+    server = ThreadingHTTPServer((host, port), FakeStripeHandler)
+    server.daemon_threads = True
+    server.fake_stripe = fake_stripe
+    server.verbose = verbose
+    return server
@@ -0,0 +1,190 @@
+"""
+In-process trigram index over the words of Manga.nom for typo-tolerant search
+"""
+import math
+from collections import Counter
+from itertools import islice, takewhile
+from operator import itemgetter
+
+from .catalog_cache import VersionedIndex
+from .text import normalize_title
+
+# Minimum Dice similarity (0..1) for a title to be considered a match
+MIN_SIMILARITY = 0.4
+
+# Maximum number of postings read to gather the candidate words of one query word
+POSTINGS_BUDGET = 20000
+
+# Number of candidate words scored exactly for one query word
+WORD_SHORTLIST = 100
+
+# Number of best titles ordered by length among equal scores, as a multiple of the requested limit
+SHORTLIST_FACTOR = 4
+
+# Maximum number of titles gathered from the matching words of one query word
+TITLES_BUDGET = 5000
+
+
+def word_trigrams(word):
+    """Trigrams of one normalized word, padded like pg_trgm: "one" -> {"  o", " on", "one", "ne "}"""
+    padded = f'  {word} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def trigrams(value):
+    """Trigrams of every word of value"""
+    grams = set()
+    for word in normalize_title(value).split():
+        grams.update(word_trigrams(word))
+    return grams
+
+
+class TrigramIndex(VersionedIndex):
+    """
+    Inverted index trigram -> words over the vocabulary of the catalog titles,
+    and word -> manga ids. Each word of the query is matched against the
+    vocabulary, so a typo inside a long title is scored against the word it
+    belongs to rather than against the whole title.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._clear()
+
+    def _clear(self):
+        self._titles = {}
+        self._word_titles = {}
+        self._word_grams = {}
+        self._postings = {}
+
+    def _load(self):
+        from .models import Manga
+
+        self._clear()
+        for pk, nom in Manga.objects.values_list('id', 'nom').iterator(chunk_size=5000):
+            self._add(pk, nom)
+
+    def _add(self, pk, nom):
+        words = tuple(dict.fromkeys(normalize_title(nom).split()))
+        self._titles[pk] = words
+        for word in words:
+            titles = self._word_titles.get(word)
+            if titles is None:
+                titles = self._word_titles[word] = set()
+                grams = self._word_grams[word] = word_trigrams(word)
+                for gram in grams:
+                    self._postings.setdefault(gram, set()).add(word)
+            titles.add(pk)
+
+    def _remove(self, pk):
+        for word in self._titles.pop(pk, ()):
+            titles = self._word_titles.get(word)
+            if titles is None:
+                continue
+            titles.discard(pk)
+            if titles:
+                continue
+            # Last title using the word: drop it from the vocabulary
+            del self._word_titles[word]
+            for gram in self._word_grams.pop(word, ()):
+                words = self._postings.get(gram)
+                if words is not None:
+                    words.discard(word)
+                    if not words:
+                        del self._postings[gram]
+
+    def update(self, pk, nom, version=None):
+        """Index (or re-index) one manga"""
+        if not self._built:
+            return
+        with self._lock:
+            self._remove(pk)
+            self._add(pk, nom)
+            self._advance(version)
+
+    def remove(self, pk, version=None):
+        """Remove one manga from the index"""
+        if not self._built:
+            return
+        with self._lock:
+            self._remove(pk)
+            self._advance(version)
+
+    def _similar_words(self, word, min_similarity):
+        """{vocabulary word: Dice similarity} for the words close to word"""
+        query_grams = word_trigrams(word)
+        size = len(query_grams)
+
+        # Candidates are gathered from the most selective trigrams first, within
+        # a fixed budget of postings: trigrams shared by a large part of the
+        # vocabulary would otherwise make every search linear in its size.
+        postings = self._postings
+        counts = Counter()
+        budget = POSTINGS_BUDGET
+        read = 0
+        for gram in sorted(query_grams, key=lambda gram: len(postings.get(gram, ()))):
+            words = postings.get(gram, ())
+            if counts and len(words) > budget:
+                break
+            counts.update(words)
+            budget -= len(words)
+            read += 1
+
+        # A word reaching min_similarity shares at least min_similarity * size / (2 - min_similarity)
+        # trigrams with the query, all but (size - read) of them among the trigrams read
+        min_count = max(math.ceil(min_similarity * size / (2 - min_similarity) - 1e-9) - (size - read), 1)
+        candidates = [word for word, count in counts.items() if count >= min_count]
+        if len(candidates) > WORD_SHORTLIST:
+            candidates = [word for word, _ in counts.most_common(WORD_SHORTLIST)]
+
+        grams = self._word_grams
+        similar = {}
+        for candidate in candidates:
+            candidate_grams = grams[candidate]
+            score = 2.0 * len(candidate_grams & query_grams) / (size + len(candidate_grams))
+            if score >= min_similarity:
+                similar[candidate] = score
+        return similar
+
+    def search(self, q, limit=50, min_similarity=MIN_SIMILARITY):
+        """
+        Return [(manga_id, similarity)] best first, similarity being the mean over
+        the words of q of the best Dice coefficient with a word of the title.
+        Among equal scores, shorter titles come first.
+        """
+        self._ensure_built()
+        query_words = list(dict.fromkeys(normalize_title(q).split()))
+        if not query_words:
+            return []
+
+        with self._lock:
+            totals = Counter()
+            for word in query_words:
+                similar = self._similar_words(word, min_similarity)
+                # Best matching words first: a title keeps the score of its best word
+                best = {}
+                for candidate in sorted(similar, key=similar.get, reverse=True):
+                    matches = dict.fromkeys(
+                        islice(self._word_titles[candidate], TITLES_BUDGET - len(best)), similar[candidate]
+                    )
+                    matches.update(best)
+                    best = matches
+                    if len(best) >= TITLES_BUDGET:
+                        break
+                totals.update(best)
+
+            threshold = min_similarity * len(query_words)
+            ranked = sorted(totals.items(), key=itemgetter(1), reverse=True)
+            if not ranked or ranked[0][1] < threshold:
+                return []
+            # Equal scores are ordered by title length, within a bounded shortlist
+            cutoff = max(ranked[min(limit, len(ranked)) - 1][1], threshold)
+            titles = self._titles
+            ranked = sorted(
+                islice(takewhile(lambda item: item[1] >= cutoff, ranked), limit * SHORTLIST_FACTOR),
+                key=lambda item: (-item[1], len(titles[item[0]]), item[0]),
+            )[:limit]
+        return [(pk, round(total / len(query_words), 4)) for pk, total in ranked]
+
+
+trigram_index = TrigramIndex()
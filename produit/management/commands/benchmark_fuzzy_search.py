@@ -0,0 +1,98 @@
+import random
+import statistics
+import time
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand
+
+from produit.fuzzy import TrigramIndex
+from produit.text import normalize_title
+
+CONSONNES = 'bdfghjkmnprstvwyz'
+VOYELLES = 'aeiou'
+
+
+def titres_synthetiques(nombre, seed=1):
+    """
+    Catalogue factice : titres de 1 à 5 mots tirés d'un vocabulaire de pseudo-mots
+    japonais, les plus courants revenant beaucoup plus souvent (loi de Zipf)
+    """
+    rng = random.Random(seed)
+    syllabes = [c + v for c in CONSONNES for v in VOYELLES] + ['n', 'shi', 'chi', 'tsu', 'kyo', 'ryu']
+    vocabulaire = list(dict.fromkeys(
+        ''.join(rng.choice(syllabes) for _ in range(rng.randint(1, 4))) for _ in range(40000)
+    ))
+    poids = list(accumulate(1 / rang for rang in range(1, len(vocabulaire) + 1)))
+    return [
+        ' '.join(rng.choices(vocabulaire, cum_weights=poids, k=rng.randint(1, 5))).title()
+        for _ in range(nombre)
+    ]
+
+
+def requetes_avec_faute(titres, nombre, seed=2):
+    """[(requête, mot visé)] : un mot d'au moins 6 lettres d'un titre, deux lettres inversées"""
+    rng = random.Random(seed)
+    requetes = []
+    while len(requetes) < nombre:
+        mots = [mot for mot in normalize_title(rng.choice(titres)).split() if len(mot) >= 6]
+        if not mots:
+            continue
+        mot = rng.choice(mots)
+        i = rng.randrange(1, len(mot) - 2)
+        requetes.append((mot[:i] + mot[i + 1] + mot[i] + mot[i + 2:], mot))
+    return requetes
+
+
+def indexer(titres):
+    """Index trigramme construit en mémoire, sans base de données"""
+    index = TrigramIndex()
+    for pk, titre in enumerate(titres, start=1):
+        index._add(pk, titre)
+    # Marqué à jour pour la durée de la mesure : pas de rechargement depuis la base
+    index._built = True
+    index._checked_at = float('inf')
+    return index
+
+
+def mesurer(index, requetes, limit=200):
+    """Durées (secondes, triées) des recherches et titres renvoyés pour chaque requête"""
+    durees, resultats = [], []
+    for requete, _ in requetes:
+        start = time.perf_counter()
+        resultats.append(index.search(requete, limit=limit))
+        durees.append(time.perf_counter() - start)
+    return sorted(durees), resultats
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure la recherche approchée (fuzzy=1) sur un catalogue factice en mémoire : "
+        "latence par requête et proportion de fautes de frappe retrouvées dans les 10 premiers résultats"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--titles', type=int, default=100000, help="Nombre de titres du catalogue factice")
+        parser.add_argument('--queries', type=int, default=500, help="Nombre de requêtes mesurées")
+        parser.add_argument('--limit', type=int, default=200, help="Nombre de résultats demandés par requête")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        titres = titres_synthetiques(options['titles'])
+        index = indexer(titres)
+        self.stdout.write(f"{len(titres)} titres indexés en {time.perf_counter() - start:.1f}s")
+
+        requetes = requetes_avec_faute(titres, options['queries'])
+        durees, resultats = mesurer(index, requetes, limit=options['limit'])
+        trouves = sum(
+            any(mot in normalize_title(titres[pk - 1]).split() for pk, _ in resultat[:10])
+            for (_, mot), resultat in zip(requetes, resultats)
+        )
+
+        self.stdout.write(
+            f"médiane {statistics.median(durees) * 1000:.2f}ms | "
+            f"p95 {durees[int(len(durees) * 0.95)] * 1000:.2f}ms | "
+            f"max {durees[-1] * 1000:.2f}ms"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Fautes retrouvées dans les 10 premiers résultats : {trouves}/{len(requetes)}"
+        ))
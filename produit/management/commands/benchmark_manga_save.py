@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+
+from produit import catalog_cache
+from produit.autocomplete import prefix_index
+from produit.fuzzy import trigram_index
+from produit.models import Manga
+
+
+class Command(BaseCommand):
+    help = "Mesure la création et le redimensionnement de séries (Manga.save), sans rien conserver en base"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                            help="Nombres de tomes à tester")
+        parser.add_argument('--repeat', type=int, default=3,
+                            help="Nombre de mesures par taille (la meilleure est gardée)")
+
+    def handle(self, *args, **options):
+        repeat = max(options['repeat'], 1)
+        self.stdout.write(f"{'tomes':>6} | {'création':>10} | {'agrandir x2':>11} | {'réduire /2':>10} | requêtes")
+        try:
+            for size in options['sizes']:
+                best = None
+                for _ in range(repeat):
+                    mesure = self._mesurer(size)
+                    if best is None or mesure[0] < best[0]:
+                        best = mesure
+                creation, agrandir, reduire, queries = best
+                self.stdout.write(
+                    f"{size:>6} | {creation * 1000:>8.1f}ms | {agrandir * 1000:>9.1f}ms | "
+                    f"{reduire * 1000:>8.1f}ms | {queries}"
+                )
+        finally:
+            # Les index en mémoire ont vu passer les mangas annulés : ils seront reconstruits
+            trigram_index.reset()
+            prefix_index.reset()
+            catalog_cache.bump_version(catalog_cache.TITLES_SCOPE)
+            catalog_cache.bump_version()
+
+        self.stdout.write(self.style.SUCCESS("Benchmark terminé (transactions annulées)."))
+
+    def _mesurer(self, size):
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                manga = Manga(nom=f"Benchmark {size}", prix='1.00', nombre_tome=size)
+                manga.save()
+                creation = time.perf_counter() - start
+                queries = len(ctx.captured_queries)
+
+            manga.nombre_tome = size * 2
+            start = time.perf_counter()
+            manga.save()
+            agrandir = time.perf_counter() - start
+
+            manga.nombre_tome = max(size // 2, 1)
+            start = time.perf_counter()
+            manga.save()
+            reduire = time.perf_counter() - start
+
+            transaction.set_rollback(True)
+        reset_queries()
+        return creation, agrandir, reduire, queries
@@ -0,0 +1,65 @@
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from produit import catalog_cache
+from produit.autocomplete import prefix_index
+from produit.fuzzy import trigram_index
+from produit.models import Commande, CommandeItem, Manga, Payment
+from produit.stripe_events import handle_payment_success
+
+
+class Command(BaseCommand):
+    help = "Mesure le traitement d'un paiement réussi (attribution des tomes) pour de grosses commandes, sans rien conserver en base"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 200, 1000],
+                            help="Nombres de tomes commandés")
+        parser.add_argument('--quantite', type=int, default=2,
+                            help="Quantité commandée par tome")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'tomes':>6} | {'durée':>10} | requêtes | tomes possédés")
+        try:
+            for size in options['sizes']:
+                duree, requetes, possedes = self._mesurer(size, options['quantite'])
+                self.stdout.write(f"{size:>6} | {duree * 1000:>8.1f}ms | {requetes:>8} | {possedes}")
+        finally:
+            # Les index en mémoire ont vu passer les mangas annulés : ils seront reconstruits
+            trigram_index.reset()
+            prefix_index.reset()
+            catalog_cache.bump_version(catalog_cache.TITLES_SCOPE)
+            catalog_cache.bump_version()
+
+        self.stdout.write(self.style.SUCCESS("Benchmark terminé (transactions annulées)."))
+
+    def _mesurer(self, size, quantite):
+        with transaction.atomic():
+            user = User.objects.create_user(f'benchmark-{uuid.uuid4().hex[:12]}')
+            manga = Manga(nom=f"Benchmark {size}", prix='1.00', nombre_tome=size)
+            manga.save()
+            commande = Commande.objects.create(utilisateur=user, total_tomes=size * quantite, total_prix=size * quantite)
+            CommandeItem.objects.bulk_create([
+                CommandeItem(commande=commande, tome=tome, quantite=quantite, prix_unitaire=manga.prix)
+                for tome in manga.tomes.all()
+            ])
+            intent_id = f'pi_benchmark_{uuid.uuid4().hex}'
+            Payment.objects.create(
+                commande=commande,
+                stripe_payment_intent_id=intent_id,
+                stripe_client_secret='benchmark',
+                montant=commande.total_prix,
+            )
+
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                handle_payment_success({'id': intent_id})
+                duree = time.perf_counter() - start
+            possedes = user.tomes_possedes.count()
+
+            transaction.set_rollback(True)
+        return duree, len(ctx.captured_queries), possedes
@@ -0,0 +1,59 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from produit.fake_stripe import FakeStripe, make_server
+
+
+class Command(BaseCommand):
+    help = (
+        "Lance un faux Stripe local pour les tests de charge : PaymentIntents avec latence et erreurs "
+        "simulées, puis webhooks signés vers l'application. Démarrer l'application avec "
+        "STRIPE_API_BASE=http://<host>:<port>."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--webhook-url', default='http://127.0.0.1:8000/api/webhooks/stripe/',
+                            help="Webhook de l'application ('' pour ne pas en envoyer)")
+        parser.add_argument('--webhook-secret', default=settings.STRIPE_WEBHOOK_SECRET,
+                            help="Secret de signature (STRIPE_WEBHOOK_SECRET par défaut)")
+        parser.add_argument('--latency-ms', type=float, default=0,
+                            help="Latence ajoutée à chaque appel d'API")
+        parser.add_argument('--jitter-ms', type=float, default=0,
+                            help="Variation aléatoire (+/-) de la latence")
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help="Proportion d'appels en erreur 500 (0 à 1)")
+        parser.add_argument('--decline-rate', type=float, default=0,
+                            help="Proportion de paiements refusés (payment_intent.payment_failed)")
+        parser.add_argument('--confirm-after', type=float, default=1.0,
+                            help="Secondes avant la confirmation automatique d'un PaymentIntent "
+                                 "(négatif : seulement via POST /v1/payment_intents/<id>/confirm)")
+        parser.add_argument('--webhook-workers', type=int, default=8,
+                            help="Nombre d'envois de webhooks simultanés")
+        parser.add_argument('--verbose-http', action='store_true', help="Journaliser chaque requête")
+
+    def handle(self, *args, **options):
+        fake = FakeStripe(
+            webhook_url=options['webhook_url'] or None,
+            webhook_secret=options['webhook_secret'],
+            latency=options['latency_ms'] / 1000,
+            jitter=options['jitter_ms'] / 1000,
+            error_rate=options['error_rate'],
+            decline_rate=options['decline_rate'],
+            confirm_after=options['confirm_after'] if options['confirm_after'] >= 0 else None,
+            webhook_workers=max(options['webhook_workers'], 1),
+        )
+        server = make_server(options['host'], options['port'], fake, verbose=options['verbose_http'])
+        host, port = server.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(f"Faux Stripe sur http://{host}:{port} (statistiques : /_stats)"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            fake.shutdown()
+            self.stdout.write(json.dumps(fake.snapshot()))
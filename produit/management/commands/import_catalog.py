@@ -0,0 +1,255 @@
+import csv
+import json
+import sys
+import time
+import uuid
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+from produit import catalog_cache, search
+from produit.models import Category, Manga, Panier, PanierItem, ResumeCollection, Tome
+
+# Séparateur des catégories dans une colonne CSV : "Shonen|Action"
+CATEGORY_SEPARATOR = '|'
+
+
+class RowError(ValueError):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Importe un catalogue (CSV ou JSONL) par lots : mangas, catégories, liens et tomes. "
+        "Colonnes : ref (optionnelle), nom, prix, nombre_tome, categories."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Fichier à importer ('-' pour l'entrée standard)")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help="Format du fichier (déduit de l'extension par défaut)")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Nombre de lignes traitées par transaction")
+        parser.add_argument('--delimiter', default=',', help="Séparateur CSV")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        batch_size = max(options['batch_size'], 1)
+
+        stream = sys.stdin if path == '-' else self._open(path)
+        try:
+            rows = self._read_jsonl(stream) if fmt == 'jsonl' else self._read_csv(stream, options['delimiter'])
+            stats = {'rows': 0, 'created': 0, 'updated': 0, 'errors': 0}
+            start = time.perf_counter()
+
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                valid = self._clean_batch(batch, stats)
+                with transaction.atomic():
+                    created, updated = self._import_batch(valid)
+                stats['rows'] += len(batch)
+                stats['created'] += created
+                stats['updated'] += updated
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"{stats['rows']} ligne(s) - {stats['rows'] / max(elapsed, 1e-6):.0f} lignes/s"
+                )
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        # Les écritures en masse n'envoient pas de signaux : caches et index en mémoire à rafraîchir
+        catalog_cache.bump_version()
+        catalog_cache.bump_version(catalog_cache.TITLES_SCOPE)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['rows']} ligne(s) en {elapsed:.1f}s ({stats['rows'] / max(elapsed, 1e-6):.0f} lignes/s) : "
+            f"{stats['created']} manga(s) créé(s), {stats['updated']} mis à jour, {stats['errors']} erreur(s)."
+        ))
+
+    # Lecture
+
+    def _open(self, path):
+        try:
+            return open(path, newline='', encoding='utf-8')
+        except OSError as exc:
+            raise CommandError(f"Impossible d'ouvrir {path} : {exc}")
+
+    def _read_csv(self, stream, delimiter):
+        for line, row in enumerate(csv.DictReader(stream, delimiter=delimiter), start=2):
+            if 'categories' in row:
+                row['categories'] = [c for c in (row['categories'] or '').split(CATEGORY_SEPARATOR)]
+            yield line, row
+
+    def _read_jsonl(self, stream):
+        for line, raw in enumerate(stream, start=1):
+            if not raw.strip():
+                continue
+            try:
+                yield line, json.loads(raw)
+            except json.JSONDecodeError as exc:
+                yield line, exc
+
+    def _clean_batch(self, batch, stats):
+        """Valide les lignes ; pour une même clé (ref, sinon nom), la dernière ligne l'emporte"""
+        valid = {}
+        for line, row in batch:
+            try:
+                data = self._clean_row(row)
+            except RowError as exc:
+                stats['errors'] += 1
+                self.stderr.write(f"Ligne {line} ignorée : {exc}")
+                continue
+            valid[('ref', data['ref']) if data['ref'] else ('nom', data['nom'])] = data
+        return list(valid.values())
+
+    def _clean_row(self, row):
+        if not isinstance(row, dict):
+            raise RowError(row)
+        nom = (row.get('nom') or '').strip()
+        if not nom:
+            raise RowError("nom manquant")
+        try:
+            ref = uuid.UUID(str(row['ref']).strip()) if row.get('ref') else None
+            prix = Decimal(str(row.get('prix')).strip())
+            nombre_tome = int(row.get('nombre_tome'))
+        except (ValueError, TypeError, InvalidOperation) as exc:
+            raise RowError(f"valeur invalide ({exc})")
+        if nombre_tome < 0:
+            raise RowError("nombre_tome négatif")
+        categories = row.get('categories')
+        if categories is not None:
+            categories = list(dict.fromkeys(c.strip() for c in categories if c and c.strip()))
+        return {'ref': ref, 'nom': nom, 'prix': prix, 'nombre_tome': nombre_tome, 'categories': categories}
+
+    # Écriture
+
+    def _import_batch(self, rows):
+        if not rows:
+            return 0, 0
+        mangas, updated, resized = self._upsert_mangas(rows)
+        ids = [manga.pk for manga in mangas]
+        # Paniers touchés par un changement de prix ou de tomes, relevés avant suppression des tomes en trop
+        paniers = list(
+            PanierItem.objects.filter(tome__manga_id__in=ids).values_list('panier_id', flat=True).distinct()
+        ) if updated else []
+        self._sync_categories(rows, mangas)
+        self._sync_tomes(mangas)
+
+        search.index_mangas(ids)
+        if resized:
+            ResumeCollection.recalculer(manga_ids=resized)
+        if paniers:
+            Panier.recalculer(panier_ids=paniers)
+        # Fiches en cache des mangas modifiés, invalidées au commit du lot
+        if updated:
+            catalog_cache.bump_on_commit(*(catalog_cache.manga_scope(pk) for pk in updated))
+        return len(rows) - len(updated), len(updated)
+
+    def _upsert_mangas(self, rows):
+        refs = [row['ref'] for row in rows if row['ref']]
+        noms = [row['nom'] for row in rows if not row['ref']]
+        by_ref = {m.ref: m for m in Manga.objects.filter(ref__in=refs)} if refs else {}
+        by_nom = {}
+        if noms:
+            for m in Manga.objects.filter(nom__in=noms).order_by('id'):
+                by_nom.setdefault(m.nom, m)
+
+        mangas, to_create, to_update, resized = [], [], [], []
+        for row in rows:
+            manga = by_ref.get(row['ref']) if row['ref'] else by_nom.get(row['nom'])
+            if manga is None:
+                manga = Manga(ref=row['ref'] or uuid.uuid4(), nom=row['nom'],
+                              prix=row['prix'], nombre_tome=row['nombre_tome'])
+                to_create.append(manga)
+            else:
+                if manga.nombre_tome != row['nombre_tome']:
+                    resized.append(manga.pk)
+                manga.nom, manga.prix, manga.nombre_tome = row['nom'], row['prix'], row['nombre_tome']
+                to_update.append(manga)
+            mangas.append(manga)
+
+        Manga.objects.bulk_create(to_create)
+        if to_update:
+            Manga.objects.bulk_update(to_update, ['nom', 'prix', 'nombre_tome'])
+        return mangas, [manga.pk for manga in to_update], resized
+
+    def _sync_categories(self, rows, mangas):
+        """Les catégories d'une ligne remplacent celles du manga (si la colonne est fournie)"""
+        wanted = {manga.pk: row['categories'] for row, manga in zip(rows, mangas) if row['categories'] is not None}
+        if not wanted:
+            return
+
+        names = {name for categories in wanted.values() for name in categories}
+        existing = {c.name: c.pk for c in Category.objects.filter(name__in=names)}
+        missing = sorted(name for name in names if name not in existing)
+        if missing:
+            Category.objects.bulk_create(self._new_categories(missing), ignore_conflicts=True)
+            existing = {c.name: c.pk for c in Category.objects.filter(name__in=names)}
+            for name in sorted(names - existing.keys()):
+                self.stderr.write(f"Catégorie « {name} » non créée (conflit), liens ignorés")
+
+        through = Manga.categories.through
+        desired = {
+            (manga_id, existing[name])
+            for manga_id, categories in wanted.items()
+            for name in categories
+            if name in existing
+        }
+        current = {
+            (link['manga_id'], link['category_id']): link['id']
+            for link in through.objects.filter(manga_id__in=wanted).values('id', 'manga_id', 'category_id')
+        }
+        obsolete = [link_id for pair, link_id in current.items() if pair not in desired]
+        if obsolete:
+            through.objects.filter(id__in=obsolete).delete()
+        through.objects.bulk_create(
+            [through(manga_id=m, category_id=c) for m, c in desired if (m, c) not in current],
+            ignore_conflicts=True,
+        )
+
+    def _new_categories(self, names):
+        """Catégories à créer, avec un slug unique : "Shōnen" et "Shonen" -> shonen, shonen-2"""
+        bases = {name: slugify(name) or 'categorie' for name in names}
+        prefixes = Q()
+        for base in set(bases.values()):
+            prefixes |= Q(slug__startswith=base)
+        taken = set(Category.objects.filter(prefixes).values_list('slug', flat=True))
+
+        categories = []
+        for name in names:
+            slug, suffix = bases[name], 2
+            while slug in taken:
+                slug, suffix = f'{bases[name]}-{suffix}', suffix + 1
+            taken.add(slug)
+            categories.append(Category(name=name, slug=slug))
+        return categories
+
+    def _sync_tomes(self, mangas):
+        nombre = {manga.pk: manga.nombre_tome for manga in mangas}
+        existing = set(Tome.objects.filter(manga_id__in=nombre).values_list('manga_id', 'numero'))
+        dernier = {}
+        for manga_id, numero in existing:
+            dernier[manga_id] = max(dernier.get(manga_id, 0), numero)
+
+        Tome.objects.bulk_create([
+            Tome(manga_id=manga_id, numero=numero)
+            for manga_id, total in nombre.items()
+            for numero in range(1, total + 1)
+            if (manga_id, numero) not in existing
+        ])
+
+        trop = Q()
+        for manga_id, total in nombre.items():
+            if dernier.get(manga_id, 0) > total:
+                trop |= Q(manga_id=manga_id, numero__gt=total)
+        if trop:
+            Tome.objects.filter(trop).delete()
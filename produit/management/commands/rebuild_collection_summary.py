@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from produit.models import ResumeCollection
+
+
+class Command(BaseCommand):
+    help = "Reconstruit les résumés de collection (tomes possédés par utilisateur et par manga)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help="Nombre d'utilisateurs traités par transaction")
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help="Limiter à cet utilisateur (répétable)")
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        user_ids = options['user_ids'] or list(User.objects.order_by('id').values_list('id', flat=True))
+
+        total = 0
+        for i in range(0, len(user_ids), batch_size):
+            batch = user_ids[i:i + batch_size]
+            with transaction.atomic():
+                total += ResumeCollection.recalculer(utilisateur_ids=batch)
+            self.stdout.write(f"{min(i + batch_size, len(user_ids))}/{len(user_ids)} utilisateur(s) traité(s)")
+
+        self.stdout.write(self.style.SUCCESS(f"{total} résumé(s) de collection reconstruit(s)."))
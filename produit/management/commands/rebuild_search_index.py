@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from produit.search import fts_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Reconstruit l'index plein texte (FTS5) des mangas"
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            raise CommandError("L'index FTS5 n'est pas disponible (base SQLite migrée requise).")
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"{count} manga(s) indexé(s)."))
@@ -0,0 +1,87 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from produit.models import StripeWebhookEvent
+from produit.stripe_events import BATCH_SIZE, planifier_rejeu, rejouer_evenements
+
+
+class Command(BaseCommand):
+    help = (
+        "Retraite les événements webhook Stripe enregistrés (par défaut ceux en attente), "
+        "par lots, dans un seul thread par défaut. Avec --workers ou --celery, les lots sont répartis "
+        "en files parallèles ; les événements d'un même paiement restent traités dans l'ordre."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', action='append', dest='types',
+                            help="Type d'événement, ex. payment_intent.succeeded (répétable)")
+        parser.add_argument('--since', help="Reçus à partir de cette date (AAAA-MM-JJ ou ISO 8601)")
+        parser.add_argument('--until', help="Reçus avant cette date (AAAA-MM-JJ ou ISO 8601)")
+        parser.add_argument('--include-processed', action='store_true',
+                            help="Retraiter aussi les événements déjà traités")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help="Nombre d'événements traités par lot")
+        # Un seul thread par défaut : sur SQLite, les threads supplémentaires ne font
+        # qu'attendre le verrou d'écriture de la base
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Nombre de threads (ou de files Celery avec --celery), 1 par défaut")
+        parser.add_argument('--celery', action='store_true',
+                            help="Planifier les lots sur les workers Celery au lieu de les traiter ici")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Afficher le nombre d'événements sélectionnés sans les traiter")
+
+    def handle(self, *args, **options):
+        queryset = StripeWebhookEvent.objects.all()
+        if options['types']:
+            queryset = queryset.filter(event_type__in=options['types'])
+        if options['since']:
+            queryset = queryset.filter(date_creation__gte=self._date(options['since']))
+        if options['until']:
+            queryset = queryset.filter(date_creation__lt=self._date(options['until']))
+        if not options['include_processed']:
+            queryset = queryset.filter(processed=False)
+
+        total = queryset.count()
+        self.stdout.write(f"{total} événement(s) sélectionné(s)")
+        if not total or options['dry_run']:
+            return
+
+        batch_size = max(options['batch_size'], 1)
+        workers = max(options['workers'], 1)
+
+        if options['celery']:
+            lots = planifier_rejeu(queryset, batch_size=batch_size, files=workers)
+            self.stdout.write(self.style.SUCCESS(f"{lots} lot(s) planifié(s) sur {workers} file(s) Celery."))
+            return
+
+        start = time.perf_counter()
+        faits = [0]
+
+        def progression(lot, result):
+            faits[0] += len(lot)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{faits[0]}/{total} événement(s) - {faits[0] / max(elapsed, 1e-6):.0f} événements/s")
+
+        result = rejouer_evenements(queryset, batch_size=batch_size, workers=workers, progression=progression)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['traites']} événement(s) traité(s) en {elapsed:.1f}s "
+            f"({total / max(elapsed, 1e-6):.0f} événements/s), {len(result['echecs'])} échec(s)."
+        ))
+        for stripe_event_id in result['echecs']:
+            self.stderr.write(f"Échec : {stripe_event_id}")
+
+    def _date(self, value):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is None:
+                raise CommandError(f"Date invalide : {value}")
+            parsed = timezone.datetime(day.year, day.month, day.day)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+FTS_TABLE = 'produit_manga_fts'
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "nom, categories, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        f"""
+        INSERT INTO {FTS_TABLE} (rowid, nom, categories)
+        SELECT m.id, m.nom, COALESCE((
+            SELECT group_concat(c.name, ' ')
+            FROM produit_manga_categories mc
+            JOIN produit_category c ON c.id = mc.category_id
+            WHERE mc.manga_id = m.id
+        ), '')
+        FROM produit_manga m
+        """
+    )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produit', '0010_stripewebhookevent_payment'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
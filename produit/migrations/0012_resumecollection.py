@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produit', '0011_manga_fts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumeCollection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre_possedes', models.PositiveIntegerField(default=0)),
+                ('taux_completion', models.FloatField(default=0)),
+                ('date_dernier_ajout', models.DateTimeField(blank=True, null=True)),
+                ('manga', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumes_collection', to='produit.manga')),
+                ('utilisateur', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumes_collection', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('utilisateur', 'manga')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produit', '0012_resumecollection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tome',
+            name='cover_placeholder',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='tome',
+            name='cover_variantes',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:43
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def calculer_totaux(apps, schema_editor):
+    Panier = apps.get_model('produit', 'Panier')
+    PanierItem = apps.get_model('produit', 'PanierItem')
+    items = PanierItem.objects.filter(panier=OuterRef('pk')).values('panier')
+    Panier.objects.update(
+        total_tomes=Coalesce(Subquery(items.annotate(total=Sum('quantite')).values('total')), 0),
+        total_prix=Coalesce(
+            Subquery(items.annotate(
+                total=Sum(F('quantite') * F('tome__manga__prix'), output_field=models.DecimalField())
+            ).values('total')),
+            Value(Decimal('0')),
+            output_field=models.DecimalField(),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produit', '0013_tome_cover_variantes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='panier',
+            name='total_prix',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='panier',
+            name='total_tomes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(calculer_totaux, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produit', '0014_panier_totaux'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripewebhookevent',
+            name='date_traitement',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stripewebhookevent',
+            name='derniere_erreur',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='stripewebhookevent',
+            name='tentatives',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='stripewebhookevent',
+            name='processed',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
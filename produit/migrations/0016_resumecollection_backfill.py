@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-17 14:05
+
+from django.db import migrations
+from django.db.models import Count, Exists, OuterRef
+
+
+def remplir_resumes(apps, schema_editor):
+    Tome = apps.get_model('produit', 'Tome')
+    ResumeCollection = apps.get_model('produit', 'ResumeCollection')
+    Possession = Tome.possesseurs.through
+
+    comptes = (
+        Possession.objects
+        .values('user_id', 'tome__manga_id', 'tome__manga__nombre_tome')
+        .annotate(nombre=Count('id'))
+    )
+    resumes = []
+    for row in comptes.iterator(chunk_size=2000):
+        nombre_tome = row['tome__manga__nombre_tome']
+        resumes.append(ResumeCollection(
+            utilisateur_id=row['user_id'],
+            manga_id=row['tome__manga_id'],
+            nombre_possedes=row['nombre'],
+            taux_completion=min(row['nombre'] / nombre_tome, 1.0) if nombre_tome else 0.0,
+        ))
+
+    # Les résumés déjà présents gardent leur date de dernier ajout
+    ResumeCollection.objects.bulk_create(
+        resumes,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['utilisateur', 'manga'],
+        update_fields=['nombre_possedes', 'taux_completion'],
+    )
+    # Les résumés sans plus aucun tome possédé disparaissent
+    possessions = Possession.objects.filter(user_id=OuterRef('utilisateur_id'), tome__manga_id=OuterRef('manga_id'))
+    ResumeCollection.objects.exclude(Exists(possessions)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produit', '0015_stripewebhookevent_traitement'),
+    ]
+
+    operations = [
+        migrations.RunPython(remplir_resumes, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,14 @@
-from django.db import models
+from django.db import models, transaction
+from decimal import Decimal
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.contrib.auth.models import User
 import uuid
 from django.core.exceptions import PermissionDenied
-from utils.gcs import generate_signed_url
+from utils.gcs import generate_signed_url, get_cached_signed_url
 from django.utils.text import slugify
+from . import catalog_cache
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -33,19 +38,37 @@ class Manga(models.Model):
         if not self.ref:
             self.ref = uuid.uuid4()
 
-        super().save(*args, **kwargs)
-
-        current_count = self.tomes.count()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.synchroniser_tomes(is_new) and not is_new:
+                # Le nombre de tomes change : les taux de complétion aussi
+                ResumeCollection.recalculer(manga_ids=[self.pk])
+
+    def synchroniser_tomes(self, is_new=False):
+        """
+        Aligne les tomes sur nombre_tome : un seul bulk_create pour les numéros
+        manquants et un seul DELETE pour ceux en trop. Retourne True si les tomes ont changé.
+        """
+        existants = set() if is_new else set(self.tomes.values_list('numero', flat=True))
+        manquants = [i for i in range(1, self.nombre_tome + 1) if i not in existants]
+        en_trop = any(numero > self.nombre_tome for numero in existants)
+
+        if manquants:
+            Tome.objects.bulk_create([Tome(manga=self, numero=i) for i in manquants])
+        if en_trop:
+            tomes_en_trop = self.tomes.filter(numero__gt=self.nombre_tome)
+            paniers = list(
+                PanierItem.objects.filter(tome__in=tomes_en_trop).values_list('panier_id', flat=True).distinct()
+            )
+            tomes_en_trop.delete()
+            if paniers:
+                Panier.recalculer(panier_ids=paniers)
+        if not manquants and not en_trop:
+            return False
 
-        if is_new:
-            for i in range(1, self.nombre_tome + 1):
-                Tome.objects.create(manga=self, numero=i)
-        else:
-            if self.nombre_tome > current_count:
-                for i in range(current_count + 1, self.nombre_tome + 1):
-                    Tome.objects.create(manga=self, numero=i)
-            elif self.nombre_tome < current_count:
-                self.tomes.filter(numero__gt=self.nombre_tome).delete()
+        # bulk_create n'envoie pas post_save : invalidation du cache catalogue faite ici, après commit
+        catalog_cache.bump_on_commit(catalog_cache.CATALOG_SCOPE, catalog_cache.manga_scope(self.pk))
+        return True
 
     def __str__(self):
         return self.nom
@@ -55,14 +78,99 @@ class Tome(models.Model):
     numero = models.IntegerField()
     possesseurs = models.ManyToManyField(User, related_name='tomes_possedes', blank=True)
     cover = models.ImageField(upload_to='karlBouvier/', null=True, blank=True)
-
-    def get_signed_cover_url(self, expiration_minutes=1):
-        if self.cover:
-            return generate_signed_url(f'{self.cover.name}', expiration_minutes=expiration_minutes)
-        return None
+    # Déclinaisons de la couverture {format: {largeur: nom du fichier}} et aperçu flou (data URI)
+    cover_variantes = models.JSONField(default=dict, blank=True)
+    cover_placeholder = models.TextField(blank=True, default='')
+
+    def get_signed_cover_url(self, expiration_minutes=None):
+        """
+        URL signée de la couverture. Sans durée explicite, l'URL vient du cache
+        (durée GCS_SIGNED_URL_LIFETIME) et reste la même d'une requête à l'autre.
+        """
+        if not self.cover:
+            return None
+        if expiration_minutes is None:
+            return get_cached_signed_url(self.cover.name)
+        return generate_signed_url(f'{self.cover.name}', expiration_minutes=expiration_minutes)
 
     def __str__(self):
         return f"Tome {self.numero} de {self.manga.nom}"
+
+
+class ResumeCollection(models.Model):
+    """
+    Résumé dénormalisé de la collection d'un utilisateur pour un manga
+    (tomes possédés, taux de complétion, dernier ajout)
+    """
+    utilisateur = models.ForeignKey(User, on_delete=models.CASCADE, related_name='resumes_collection')
+    manga = models.ForeignKey(Manga, on_delete=models.CASCADE, related_name='resumes_collection')
+    nombre_possedes = models.PositiveIntegerField(default=0)
+    taux_completion = models.FloatField(default=0)
+    date_dernier_ajout = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ['utilisateur', 'manga']
+
+    @property
+    def nombre_manquants(self):
+        return max(self.manga.nombre_tome - self.nombre_possedes, 0)
+
+    def __str__(self):
+        return f"{self.utilisateur.username} - {self.manga.nom} ({self.nombre_possedes}/{self.manga.nombre_tome})"
+
+    @classmethod
+    def recalculer(cls, utilisateur_ids=None, manga_ids=None, date_ajout=None):
+        """
+        Recalcule les résumés depuis la table des possesseurs pour les
+        utilisateurs et/ou mangas donnés, en une requête groupée et un upsert.
+        date_ajout, si fourni, devient la date de dernier ajout des résumés touchés.
+        """
+        possessions = Tome.possesseurs.through.objects.all()
+        resumes = cls.objects.all()
+        if utilisateur_ids is not None:
+            possessions = possessions.filter(user_id__in=utilisateur_ids)
+            resumes = resumes.filter(utilisateur_id__in=utilisateur_ids)
+        if manga_ids is not None:
+            possessions = possessions.filter(tome__manga_id__in=manga_ids)
+            resumes = resumes.filter(manga_id__in=manga_ids)
+
+        comptes = (
+            possessions
+            .values('user_id', 'tome__manga_id', 'tome__manga__nombre_tome')
+            .annotate(nombre=Count('id'))
+        )
+        existants = {
+            (r['utilisateur_id'], r['manga_id']): (r['id'], r['date_dernier_ajout'])
+            for r in resumes.values('id', 'utilisateur_id', 'manga_id', 'date_dernier_ajout')
+        }
+
+        nouveaux = []
+        for row in comptes:
+            key = (row['user_id'], row['tome__manga_id'])
+            nombre_tome = row['tome__manga__nombre_tome']
+            nouveaux.append(cls(
+                utilisateur_id=key[0],
+                manga_id=key[1],
+                nombre_possedes=row['nombre'],
+                taux_completion=min(row['nombre'] / nombre_tome, 1.0) if nombre_tome else 0.0,
+                date_dernier_ajout=date_ajout or existants.get(key, (None, None))[1],
+            ))
+
+        # Les résumés sans plus aucun tome possédé disparaissent
+        for key in {(r.utilisateur_id, r.manga_id) for r in nouveaux}:
+            existants.pop(key, None)
+        obsoletes = [pk for pk, _ in existants.values()]
+        for i in range(0, len(obsoletes), 500):
+            cls.objects.filter(pk__in=obsoletes[i:i + 500]).delete()
+
+        cls.objects.bulk_create(
+            nouveaux,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['utilisateur', 'manga'],
+            update_fields=['nombre_possedes', 'taux_completion', 'date_dernier_ajout'],
+        )
+        return len(nouveaux)
     
 class Panier(models.Model):
     """
@@ -71,51 +179,162 @@ class Panier(models.Model):
     utilisateur = models.OneToOneField(User, on_delete=models.CASCADE, related_name='panier')
     date_creation = models.DateTimeField(auto_now_add=True)
     date_modification = models.DateTimeField(auto_now=True)
+    # Totaux dénormalisés, recalculés après chaque modification des lignes
+    total_tomes = models.PositiveIntegerField(default=0)
+    total_prix = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     
     def __str__(self):
         return f"Panier de {self.utilisateur.username}"
-    
-    @property
-    def total_tomes(self):
-        """Retourne le nombre total de tomes dans le panier"""
-        return sum(item.quantite for item in self.items.all())
-    
-    @property
-    def total_prix(self):
-        """Retourne le prix total du panier"""
-        return sum(item.prix_total for item in self.items.all())
+
+    @staticmethod
+    def _totaux(items):
+        return items.aggregate(
+            total_tomes=Coalesce(Sum('quantite'), 0),
+            total_prix=Coalesce(
+                Sum(F('quantite') * F('tome__manga__prix'), output_field=models.DecimalField()),
+                Value(Decimal('0')),
+                output_field=models.DecimalField(),
+            ),
+        )
+
+    def recalculer_totaux(self):
+        """Recalcule les totaux du panier en une requête d'agrégation"""
+        totaux = self._totaux(self.items.all())
+        self.total_tomes = totaux['total_tomes']
+        self.total_prix = totaux['total_prix']
+        Panier.objects.filter(pk=self.pk).update(
+            total_tomes=self.total_tomes,
+            total_prix=self.total_prix,
+            date_modification=timezone.now(),
+        )
+
+    @classmethod
+    def recalculer(cls, panier_ids=None, manga_ids=None):
+        """
+        Recalcule les totaux des paniers donnés, ou de ceux contenant un des mangas
+        (changement de prix), en un seul UPDATE.
+        """
+        paniers = cls.objects.all()
+        if panier_ids is not None:
+            paniers = paniers.filter(pk__in=panier_ids)
+        if manga_ids is not None:
+            paniers = paniers.filter(
+                pk__in=PanierItem.objects.filter(tome__manga_id__in=manga_ids).values('panier_id')
+            )
+        items = PanierItem.objects.filter(panier=OuterRef('pk')).values('panier')
+        return paniers.update(
+            total_tomes=Coalesce(
+                Subquery(items.annotate(total=Sum('quantite')).values('total')), 0
+            ),
+            total_prix=Coalesce(
+                Subquery(items.annotate(
+                    total=Sum(F('quantite') * F('tome__manga__prix'), output_field=models.DecimalField())
+                ).values('total')),
+                Value(Decimal('0')),
+                output_field=models.DecimalField(),
+            ),
+        )
     
     def ajouter_tome(self, tome, quantite=1):
         """Ajoute un tome au panier ou met à jour la quantité"""
-        item, created = PanierItem.objects.get_or_create(
-            panier=self,
-            tome=tome,
-            defaults={'quantite': quantite}
-        )
-        if not created:
-            item.quantite += quantite
-            item.save()
-
-        item.save()
+        with transaction.atomic():
+            item, created = PanierItem.objects.get_or_create(
+                panier=self,
+                tome=tome,
+                defaults={'quantite': quantite}
+            )
+            if not created:
+                PanierItem.objects.filter(pk=item.pk).update(quantite=F('quantite') + quantite)
+                item.refresh_from_db(fields=['quantite'])
+            self.recalculer_totaux()
         return item
+
+    def modifier_quantite(self, tome, quantite):
+        """Fixe la quantité d'un tome déjà dans le panier. Retourne la ligne, ou None si absente."""
+        with transaction.atomic():
+            if not self.items.filter(tome=tome).update(quantite=quantite):
+                return None
+            self.recalculer_totaux()
+        return self.items.select_related('tome__manga').get(tome=tome)
     
+    @staticmethod
+    def plier_operations(quantites, operations):
+        """
+        Applique les opérations, dans l'ordre, aux quantités actuelles {tome_id: quantite}.
+        Retourne la quantité finale de chaque tome touché ; ValueError au-delà de QUANTITE_MAX.
+        """
+        quantites = dict(quantites)
+        for action, tome_id, quantite in operations:
+            if action == 'add':
+                quantites[tome_id] = quantites.get(tome_id, 0) + quantite
+            elif action == 'set':
+                quantites[tome_id] = quantite
+            else:
+                quantites[tome_id] = 0
+
+        finales = {tome_id: quantites.get(tome_id, 0) for _, tome_id, _ in operations}
+        trop = [tome_id for tome_id, quantite in finales.items() if quantite > PanierItem.QUANTITE_MAX]
+        if trop:
+            raise ValueError(f"Quantité maximale de {PanierItem.QUANTITE_MAX} dépassée pour les tomes {sorted(trop)}")
+        return finales
+
+    def persister(self):
+        """Le panier en base est déjà persistant (voir PanierRedis.persister)"""
+        return self
+
+    def appliquer_operations(self, operations):
+        """
+        Applique une liste d'opérations validées (action, tome_id, quantite), dans l'ordre,
+        avec une lecture des lignes concernées, un upsert et un DELETE.
+        action : 'add' ajoute la quantité, 'set' la fixe (0 retire), 'remove' retire la ligne.
+        Retourne {tome_id: quantité finale} (0 pour une ligne retirée).
+        """
+        tome_ids = {tome_id for _, tome_id, _ in operations}
+        with transaction.atomic():
+            list(Panier.objects.select_for_update().filter(pk=self.pk).values_list('pk'))
+            finales = self.plier_operations(
+                dict(self.items.filter(tome_id__in=tome_ids).values_list('tome_id', 'quantite')),
+                operations,
+            )
+            PanierItem.objects.bulk_create(
+                [
+                    PanierItem(panier=self, tome_id=tome_id, quantite=quantite)
+                    for tome_id, quantite in finales.items() if quantite > 0
+                ],
+                update_conflicts=True,
+                unique_fields=['panier', 'tome'],
+                update_fields=['quantite'],
+            )
+            retires = [tome_id for tome_id, quantite in finales.items() if quantite <= 0]
+            if retires:
+                self.items.filter(tome_id__in=retires).delete()
+            self.recalculer_totaux()
+        return finales
+
     def retirer_tome(self, tome):
         """Retire un tome du panier"""
-        try:
-            item = self.items.get(tome=tome)
-            item.delete()
-            return True
-        except PanierItem.DoesNotExist:
-            return False
+        with transaction.atomic():
+            deleted, _ = self.items.filter(tome=tome).delete()
+            if deleted:
+                self.recalculer_totaux()
+        return bool(deleted)
     
     def vider(self):
         """Vide complètement le panier"""
-        self.items.all().delete()
+        with transaction.atomic():
+            self.items.all().delete()
+            self.total_tomes = 0
+            self.total_prix = Decimal('0')
+            Panier.objects.filter(pk=self.pk).update(
+                total_tomes=0, total_prix=0, date_modification=timezone.now()
+            )
 
 class PanierItem(models.Model):
     """
     Modèle pour les éléments individuels dans le panier
     """
+    QUANTITE_MAX = 10
+
     panier = models.ForeignKey(Panier, on_delete=models.CASCADE, related_name='items')
     tome = models.ForeignKey(Tome, on_delete=models.CASCADE)
     quantite = models.PositiveIntegerField(default=1)
@@ -160,6 +379,24 @@ class Commande(models.Model):
     def __str__(self):
         return f"Commande {self.reference} de {self.utilisateur.username} ({self.get_statut_display()})"
 
+    def attribuer_tomes(self):
+        """
+        Ajoute les tomes de la commande à la collection de l'utilisateur :
+        une lecture des lignes et un seul INSERT (les tomes déjà possédés sont ignorés).
+        Retourne les ids des mangas concernés.
+        """
+        lignes = list(self.items.values_list('tome_id', 'tome__manga_id'))
+        Possession = Tome.possesseurs.through
+        Possession.objects.bulk_create(
+            [
+                Possession(tome_id=tome_id, user_id=self.utilisateur_id)
+                for tome_id in dict.fromkeys(tome_id for tome_id, _ in lignes)
+            ],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+        return {manga_id for _, manga_id in lignes}
+
     def recalculer_totaux(self):
         total_tomes = 0
         total_prix = 0
@@ -226,9 +463,12 @@ class StripeWebhookEvent(models.Model):
     """
     stripe_event_id = models.CharField(max_length=255, unique=True)
     event_type = models.CharField(max_length=100)
-    processed = models.BooleanField(default=False)
+    processed = models.BooleanField(default=False, db_index=True)
     data = models.JSONField()
     date_creation = models.DateTimeField(auto_now_add=True)
+    date_traitement = models.DateTimeField(null=True, blank=True)
+    tentatives = models.PositiveIntegerField(default=0)
+    derniere_erreur = models.TextField(blank=True, default='')
 
     def __str__(self):
         return f"Webhook {self.stripe_event_id} - {self.event_type}"
\ No newline at end of file
@@ -0,0 +1,287 @@
+"""
+Redis cart store, enabled with PANIER_BACKEND = 'redis'
+
+Each cart is a Redis hash {tome_id: quantite} read and written by the cart
+views through PanierRedis, which exposes the same methods as Panier. Every
+change marks the user as dirty; the carts are then written to Panier /
+PanierItem in the background (persister_paniers_redis_task, at most
+PANIER_REDIS_FLUSH_DELAY seconds later) and synchronously at checkout.
+
+A cart missing from Redis (first use, expiry) is loaded from the database.
+"""
+from decimal import Decimal
+
+import redis
+from django.conf import settings
+from django.db import transaction
+
+from .models import Panier, PanierItem, Tome
+
+ITEMS_KEY = 'panier:{}:items'
+DIRTY_KEY = 'panier:dirty'
+FLUSH_SCHEDULED_KEY = 'panier:flush:scheduled'
+# Champ présent dans tout panier chargé : distingue un panier vide d'un panier absent de Redis
+LOADED_FIELD = '_'
+
+FLUSH_BATCH_SIZE = 500
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.PANIER_REDIS_URL, decode_responses=True)
+    return _client
+
+
+def set_client(client):
+    """Remplace le client Redis (ex. fakeredis.FakeRedis(decode_responses=True) en test)"""
+    global _client
+    _client = client
+
+
+def _items_key(utilisateur_id):
+    return ITEMS_KEY.format(utilisateur_id)
+
+
+def _quantites(data):
+    return {int(tome_id): int(quantite) for tome_id, quantite in data.items()
+            if tome_id != LOADED_FIELD and int(quantite) > 0}
+
+
+class _LignesRedis:
+    """Sous-ensemble du manager `panier.items` utilisé par les vues"""
+
+    def __init__(self, panier):
+        self._panier = panier
+
+    def select_related(self, *fields):
+        return self
+
+    def all(self):
+        return self._panier.lignes()
+
+    def __iter__(self):
+        return iter(self.all())
+
+
+class PanierRedis:
+    """
+    Panier stocké dans Redis, interchangeable avec Panier pour les vues.
+    Les lignes (PanierItem non enregistrés) ont pour id l'identifiant du tome.
+    """
+
+    def __init__(self, utilisateur, client=None):
+        self.utilisateur = utilisateur
+        self.utilisateur_id = utilisateur.pk
+        self._client = client
+        self._cache = None
+        self._total_prix = None
+
+    @property
+    def client(self):
+        return self._client or get_client()
+
+    @property
+    def key(self):
+        return _items_key(self.utilisateur_id)
+
+    @property
+    def items(self):
+        return _LignesRedis(self)
+
+    # Lecture
+
+    def _charger(self):
+        if self._cache is not None:
+            return self._cache
+        data = self.client.hgetall(self.key)
+        if LOADED_FIELD not in data:
+            # Premier accès ou clé expirée : le panier en base fait foi
+            data = {
+                str(tome_id): str(quantite)
+                for tome_id, quantite in PanierItem.objects.filter(
+                    panier__utilisateur_id=self.utilisateur_id
+                ).values_list('tome_id', 'quantite')
+            }
+            pipe = self.client.pipeline()
+            pipe.hset(self.key, mapping={**data, LOADED_FIELD: 1})
+            pipe.expire(self.key, settings.PANIER_REDIS_TTL)
+            pipe.execute()
+        self._cache = _quantites(data)
+        return self._cache
+
+    @property
+    def total_tomes(self):
+        return sum(self._charger().values())
+
+    @property
+    def total_prix(self):
+        if self._total_prix is None:
+            quantites = self._charger()
+            prix = dict(Tome.objects.filter(id__in=quantites).values_list('id', 'manga__prix'))
+            self._total_prix = sum(
+                (prix[tome_id] * quantite for tome_id, quantite in quantites.items() if tome_id in prix),
+                Decimal('0'),
+            )
+        return self._total_prix
+
+    def lignes(self):
+        quantites = self._charger()
+        tomes = Tome.objects.select_related('manga').in_bulk(list(quantites))
+        return [
+            PanierItem(id=tome_id, tome=tomes[tome_id], quantite=quantite)
+            for tome_id, quantite in quantites.items()
+            if tome_id in tomes
+        ]
+
+    # Écriture
+
+    def _modifie(self, quantites):
+        self._cache = quantites
+        self._total_prix = None
+        marquer_modifie(self.utilisateur_id, self.client)
+
+    def recalculer_totaux(self):
+        self._cache = None
+        self._total_prix = None
+
+    def ajouter_tome(self, tome, quantite=1):
+        quantites = dict(self._charger())
+        pipe = self.client.pipeline()
+        pipe.hincrby(self.key, tome.pk, quantite)
+        pipe.expire(self.key, settings.PANIER_REDIS_TTL)
+        quantites[tome.pk] = pipe.execute()[0]
+        self._modifie(quantites)
+        return PanierItem(id=tome.pk, tome=tome, quantite=quantites[tome.pk])
+
+    def modifier_quantite(self, tome, quantite):
+        quantites = dict(self._charger())
+        if tome.pk not in quantites:
+            return None
+        self.client.hset(self.key, tome.pk, quantite)
+        quantites[tome.pk] = quantite
+        self._modifie(quantites)
+        return PanierItem(id=tome.pk, tome=tome, quantite=quantite)
+
+    def retirer_tome(self, tome):
+        quantites = dict(self._charger())
+        if not self.client.hdel(self.key, tome.pk):
+            return False
+        quantites.pop(tome.pk, None)
+        self._modifie(quantites)
+        return True
+
+    def appliquer_operations(self, operations):
+        self._charger()
+        finales = {}
+
+        def _appliquer(pipe):
+            actuelles = _quantites(pipe.hgetall(self.key))
+            finales.update(Panier.plier_operations(actuelles, operations))
+            pipe.multi()
+            a_garder = {tome_id: quantite for tome_id, quantite in finales.items() if quantite > 0}
+            a_retirer = [tome_id for tome_id, quantite in finales.items() if quantite <= 0]
+            if a_garder:
+                pipe.hset(self.key, mapping=a_garder)
+            if a_retirer:
+                pipe.hdel(self.key, *a_retirer)
+            pipe.expire(self.key, settings.PANIER_REDIS_TTL)
+            actuelles.update(a_garder)
+            for tome_id in a_retirer:
+                actuelles.pop(tome_id, None)
+            self._cache = actuelles
+
+        # WATCH/MULTI : recommencé si le panier change entre la lecture et l'écriture
+        self.client.transaction(_appliquer, self.key)
+        self._modifie(self._cache)
+        return finales
+
+    def vider(self):
+        """Vide le panier dans Redis et en base (appelé au paiement)"""
+        panier = Panier.objects.filter(utilisateur_id=self.utilisateur_id).first()
+        if panier is not None:
+            panier.vider()
+
+        def _vider_redis():
+            pipe = self.client.pipeline()
+            pipe.delete(self.key)
+            pipe.hset(self.key, LOADED_FIELD, 1)
+            pipe.expire(self.key, settings.PANIER_REDIS_TTL)
+            pipe.srem(DIRTY_KEY, self.utilisateur_id)
+            pipe.execute()
+
+        self._cache = {}
+        self._total_prix = None
+        transaction.on_commit(_vider_redis)
+
+    def persister(self):
+        """Écrit le panier en base tout de suite (passage de commande)"""
+        self.client.srem(DIRTY_KEY, self.utilisateur_id)
+        try:
+            persister_panier(self.utilisateur_id, self.client)
+        except Exception:
+            self.client.sadd(DIRTY_KEY, self.utilisateur_id)
+            raise
+        return self
+
+
+def marquer_modifie(utilisateur_id, client=None):
+    """Note le panier à écrire en base et planifie l'écriture différée si besoin"""
+    from .tasks import persister_paniers_redis_task
+
+    client = client or get_client()
+    client.sadd(DIRTY_KEY, utilisateur_id)
+    delay = settings.PANIER_REDIS_FLUSH_DELAY
+    # Une seule tâche planifiée à la fois ; la clé expire au cas où la tâche serait perdue
+    if client.set(FLUSH_SCHEDULED_KEY, 1, nx=True, ex=delay * 2):
+        try:
+            persister_paniers_redis_task.apply_async(countdown=delay)
+        except Exception as exc:
+            client.delete(FLUSH_SCHEDULED_KEY)
+            print(f"❌ Impossible de planifier l'écriture des paniers: {exc}")
+
+
+def persister_panier(utilisateur_id, client=None):
+    """Remplace les lignes du panier en base par celles de Redis"""
+    client = client or get_client()
+    data = client.hgetall(_items_key(utilisateur_id))
+    if LOADED_FIELD not in data:
+        return False
+    quantites = _quantites(data)
+
+    with transaction.atomic():
+        panier, _ = Panier.objects.get_or_create(utilisateur_id=utilisateur_id)
+        tome_ids = set(Tome.objects.filter(id__in=quantites).values_list('id', flat=True))
+        panier.items.exclude(tome_id__in=tome_ids).delete()
+        PanierItem.objects.bulk_create(
+            [PanierItem(panier=panier, tome_id=tome_id, quantite=quantites[tome_id]) for tome_id in tome_ids],
+            update_conflicts=True,
+            unique_fields=['panier', 'tome'],
+            update_fields=['quantite'],
+        )
+        panier.recalculer_totaux()
+    return True
+
+
+def persister_paniers_modifies(client=None):
+    """Écrit en base tous les paniers modifiés depuis la dernière écriture. Retourne leur nombre."""
+    client = client or get_client()
+    client.delete(FLUSH_SCHEDULED_KEY)
+    total, echecs = 0, []
+    while True:
+        utilisateur_ids = client.spop(DIRTY_KEY, FLUSH_BATCH_SIZE)
+        if not utilisateur_ids:
+            break
+        for utilisateur_id in utilisateur_ids:
+            try:
+                persister_panier(int(utilisateur_id), client)
+                total += 1
+            except Exception as exc:
+                echecs.append(utilisateur_id)
+                print(f"❌ Erreur lors de l'écriture du panier {utilisateur_id}: {exc}")
+    if echecs:
+        # Réessayés à la prochaine écriture
+        client.sadd(DIRTY_KEY, *echecs)
+    return total
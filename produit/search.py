@@ -0,0 +1,130 @@
+"""
+Full-text search index (SQLite FTS5) over manga names and category names
+"""
+import re
+import logging
+
+from django.db import connection, OperationalError
+from django.db.models.expressions import RawSQL
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'produit_manga_fts'
+
+# Column weights for bm25(): a match on the name counts far more than on a category
+NOM_WEIGHT = 10.0
+CATEGORIES_WEIGHT = 1.0
+
+_fts_available = None
+
+
+def fts_available():
+    """
+    True when the FTS5 table exists on the current database (SQLite only).
+    Only a positive answer is cached, so the check keeps working once migrations ran.
+    """
+    global _fts_available
+    if _fts_available:
+        return True
+    if connection.vendor != 'sqlite':
+        return False
+    _fts_available = FTS_TABLE in connection.introspection.table_names()
+    return _fts_available
+
+
+def build_match_query(q):
+    """
+    Turn free text into an FTS5 MATCH expression with prefix matching on every word:
+    "one pi" -> "one"* "pi"*
+    """
+    tokens = re.findall(r'\w+', q or '')
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_mangas(queryset, q, rank=True):
+    """
+    Restrict a Manga queryset to the full-text matches of q. With rank, the
+    queryset is ordered by relevance (`search_rank`, bm25: lower is more
+    relevant); without, it is only filtered, which keeps it usable as a
+    subquery. Falls back to icontains when the FTS index is not available.
+    """
+    match = build_match_query(q)
+    if match is None or not fts_available():
+        return queryset.filter(nom__icontains=q.strip())
+
+    if not rank:
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+        )
+
+    manga_table = queryset.model._meta.db_table
+    return queryset.extra(
+        select={'search_rank': f'bm25({FTS_TABLE}, %s, %s)'},
+        select_params=[NOM_WEIGHT, CATEGORIES_WEIGHT],
+        tables=[FTS_TABLE],
+        where=[
+            f'{FTS_TABLE}.rowid = {manga_table}.id',
+            f'{FTS_TABLE} MATCH %s',
+        ],
+        params=[match],
+    ).order_by('search_rank', 'nom', 'id')
+
+
+def _index_select_sql(where=''):
+    from .models import Manga, Category
+
+    manga_table = Manga._meta.db_table
+    through_table = Manga.categories.through._meta.db_table
+    category_table = Category._meta.db_table
+    return f"""
+        INSERT INTO {FTS_TABLE} (rowid, nom, categories)
+        SELECT m.id, m.nom, COALESCE((
+            SELECT group_concat(c.name, ' ')
+            FROM {through_table} mc
+            JOIN {category_table} c ON c.id = mc.category_id
+            WHERE mc.manga_id = m.id
+        ), '')
+        FROM {manga_table} m
+        {where}
+    """
+
+
+def index_mangas(manga_ids):
+    """(Re)index the given mangas in one set-based statement"""
+    manga_ids = [int(pk) for pk in manga_ids]
+    if not manga_ids or not fts_available():
+        return
+    placeholders = ', '.join(['%s'] * len(manga_ids))
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', manga_ids)
+            cursor.execute(_index_select_sql(f'WHERE m.id IN ({placeholders})'), manga_ids)
+    except OperationalError as exc:
+        logger.warning(f"FTS index update failed: {exc}")
+
+
+def unindex_mangas(manga_ids):
+    """Remove the given mangas from the index"""
+    manga_ids = [int(pk) for pk in manga_ids]
+    if not manga_ids or not fts_available():
+        return
+    placeholders = ', '.join(['%s'] * len(manga_ids))
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', manga_ids)
+    except OperationalError as exc:
+        logger.warning(f"FTS index update failed: {exc}")
+
+
+def rebuild_index():
+    """Rebuild the whole index from the catalog. Returns the number of indexed mangas."""
+    if not fts_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(_index_select_sql())
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {FTS_TABLE}')
+        return cursor.fetchone()[0]
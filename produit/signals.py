@@ -1,11 +1,17 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
 from django.core.mail import send_mail
 from django.utils import timezone
 from django.db import transaction
 from django.conf import settings
+from decimal import Decimal
 
-from .models import Commande
+from .models import Commande, Manga, Category, Tome, Panier, PanierItem, ResumeCollection
+from . import search, catalog_cache
+from .tasks import generate_cover_derivatives_task
+from utils.gcs import evict_signed_url
+from .fuzzy import trigram_index
+from .autocomplete import prefix_index
 
 
 def _build_commande_email_content(commande: Commande):
@@ -141,3 +147,200 @@ def envoyer_email_confirmation_commande(sender, instance: Commande, created: boo
     transaction.on_commit(_send)
 
 
+# Search indexes synchronisation
+
+@receiver(pre_save, sender=Manga)
+def memoriser_nom_manga(sender, instance: Manga, **kwargs):
+    precedent = (
+        Manga.objects.filter(pk=instance.pk).values_list('nom', 'prix').first()
+        if instance.pk else None
+    )
+    instance._nom_precedent, instance._prix_precedent = precedent or (None, None)
+
+
+@receiver(post_save, sender=Manga)
+def indexer_manga(sender, instance: Manga, created: bool, **kwargs):
+    search.index_mangas([instance.pk])
+    if created or instance.nom != getattr(instance, '_nom_precedent', None):
+        pk, nom = instance.pk, instance.nom
+
+        # Après commit : un rollback ne laisse pas de titre fantôme dans l'index,
+        # et un autre processus ne recharge pas l'ancien état sous la nouvelle version
+        def _indexer():
+            version = catalog_cache.bump_version(catalog_cache.TITLES_SCOPE)
+            trigram_index.update(pk, nom, version)
+            prefix_index.update(pk, nom, version)
+
+        transaction.on_commit(_indexer)
+
+
+@receiver(post_delete, sender=Manga)
+def desindexer_manga(sender, instance: Manga, **kwargs):
+    search.unindex_mangas([instance.pk])
+    pk = instance.pk
+
+    def _desindexer():
+        version = catalog_cache.bump_version(catalog_cache.TITLES_SCOPE)
+        trigram_index.remove(pk, version)
+        prefix_index.remove(pk, version)
+
+    transaction.on_commit(_desindexer)
+
+
+@receiver(m2m_changed, sender=Manga.categories.through)
+def indexer_categories_manga(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # Les liens vont disparaître : on garde les mangas concernés pour post_clear
+        instance._fts_manga_ids = list(instance.mangas.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        search.index_mangas([instance.pk])
+    elif action == 'post_clear':
+        search.index_mangas(getattr(instance, '_fts_manga_ids', []))
+    else:
+        search.index_mangas(pk_set or [])
+
+
+@receiver(post_save, sender=Category)
+def indexer_mangas_categorie(sender, instance: Category, created: bool, **kwargs):
+    if not created:
+        search.index_mangas(instance.mangas.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Category)
+def memoriser_mangas_categorie(sender, instance: Category, **kwargs):
+    instance._fts_manga_ids = list(instance.mangas.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def reindexer_mangas_categorie(sender, instance: Category, **kwargs):
+    search.index_mangas(getattr(instance, '_fts_manga_ids', []))
+
+
+# Catalog cache invalidation
+
+@receiver(post_save, sender=Manga)
+@receiver(post_delete, sender=Manga)
+def invalider_cache_manga(sender, instance: Manga, **kwargs):
+    catalog_cache.bump_on_commit(catalog_cache.CATALOG_SCOPE, catalog_cache.manga_scope(instance.pk))
+
+
+@receiver(post_save, sender=Tome)
+@receiver(post_delete, sender=Tome)
+def invalider_cache_tome(sender, instance: Tome, **kwargs):
+    catalog_cache.bump_on_commit(catalog_cache.CATALOG_SCOPE, catalog_cache.manga_scope(instance.manga_id))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalider_cache_categorie(sender, instance: Category, **kwargs):
+    catalog_cache.bump_on_commit()
+
+
+@receiver(m2m_changed, sender=Manga.categories.through)
+def invalider_cache_categories_manga(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        catalog_cache.bump_on_commit()
+
+
+# Cart totals
+
+@receiver(post_save, sender=Manga)
+def recalculer_paniers_prix(sender, instance: Manga, created: bool, **kwargs):
+    precedent = getattr(instance, '_prix_precedent', None)
+    if created or precedent is None or Decimal(str(instance.prix)) == precedent:
+        return
+    Panier.recalculer(manga_ids=[instance.pk])
+
+
+@receiver(pre_delete, sender=Tome)
+def memoriser_paniers_tome(sender, instance: Tome, **kwargs):
+    # Les lignes de panier partent en cascade avec le tome (ou son manga) : on garde les paniers touchés
+    instance._panier_ids = list(PanierItem.objects.filter(tome=instance).values_list('panier_id', flat=True))
+
+
+@receiver(post_delete, sender=Tome)
+def recalculer_paniers_tome_supprime(sender, instance: Tome, **kwargs):
+    panier_ids = getattr(instance, '_panier_ids', None)
+    if panier_ids:
+        Panier.recalculer(panier_ids=panier_ids)
+
+
+# Collection summary
+
+@receiver(m2m_changed, sender=Tome.possesseurs.through)
+def recalculer_resume_collection(sender, instance, action, reverse, pk_set, **kwargs):
+    # reverse : instance est un utilisateur et pk_set des tomes, sinon l'inverse
+    if action == 'pre_clear':
+        # Les liens vont disparaître : on garde ceux de l'autre côté pour post_clear
+        if reverse:
+            instance._resume_manga_ids = list(instance.tomes_possedes.values_list('manga_id', flat=True).distinct())
+        else:
+            instance._resume_utilisateur_ids = list(instance.possesseurs.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action != 'post_clear' and not pk_set:
+        return
+
+    if reverse:
+        utilisateur_ids = [instance.pk]
+        if action == 'post_clear':
+            manga_ids = getattr(instance, '_resume_manga_ids', [])
+        else:
+            manga_ids = list(Tome.objects.filter(pk__in=pk_set).values_list('manga_id', flat=True).distinct())
+    else:
+        manga_ids = [instance.manga_id]
+        if action == 'post_clear':
+            utilisateur_ids = getattr(instance, '_resume_utilisateur_ids', [])
+        else:
+            utilisateur_ids = list(pk_set)
+    if not utilisateur_ids or not manga_ids:
+        return
+
+    ResumeCollection.recalculer(
+        utilisateur_ids=utilisateur_ids,
+        manga_ids=manga_ids,
+        date_ajout=timezone.now() if action == 'post_add' else None,
+    )
+
+
+# Signed cover URL cache eviction
+
+@receiver(pre_save, sender=Tome)
+def memoriser_couverture_tome(sender, instance: Tome, **kwargs):
+    instance._cover_precedente = (
+        Tome.objects.filter(pk=instance.pk).values_list('cover', flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Tome)
+def oublier_url_couverture_remplacee(sender, instance: Tome, **kwargs):
+    precedente = getattr(instance, '_cover_precedente', None)
+    if precedente and precedente != instance.cover.name:
+        evict_signed_url(precedente)
+
+
+# Cover derivatives
+
+@receiver(post_save, sender=Tome)
+def generer_declinaisons_couverture(sender, instance: Tome, **kwargs):
+    if not instance.cover or instance.cover.name == getattr(instance, '_cover_precedente', None):
+        return
+
+    def _enqueue():
+        try:
+            generate_cover_derivatives_task.delay(instance.pk)
+        except Exception as exc:
+            print(f"❌ Impossible de planifier les déclinaisons de la couverture du tome {instance.pk}: {exc}")
+
+    transaction.on_commit(_enqueue)
+
+
+@receiver(post_delete, sender=Tome)
+def oublier_url_couverture_supprimee(sender, instance: Tome, **kwargs):
+    if instance.cover:
+        evict_signed_url(instance.cover.name)
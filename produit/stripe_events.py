@@ -0,0 +1,252 @@
+"""
+Stripe webhook event processing
+
+The webhook only verifies the signature and records the event in
+StripeWebhookEvent (one row per stripe_event_id, duplicates ignored);
+traiter_evenements_stripe_task then applies the pending events in arrival
+order. The handlers raise on failure so the task can retry: an event is
+marked processed in the same transaction as its effects.
+"""
+import logging
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Commande, Payment, ResumeCollection, StripeWebhookEvent
+
+logger = logging.getLogger(__name__)
+
+# Nombre d'événements lus par requête lors du traitement
+BATCH_SIZE = 100
+
+
+def handle_payment_success(payment_intent):
+    """
+    Traite un paiement réussi
+    """
+    from .views import get_or_create_panier
+
+    try:
+        payment = Payment.objects.select_related('commande__utilisateur').get(
+            stripe_payment_intent_id=payment_intent['id']
+        )
+    except Payment.DoesNotExist:
+        # Webhook reçu avant l'enregistrement du Payment : l'événement reste en attente et sera retraité
+        raise Payment.DoesNotExist(f"Payment not found for intent: {payment_intent['id']}")
+
+    if payment.statut == Payment.STATUT_REUSSI:
+        # Déjà traité (événement rejoué)
+        return
+
+    with transaction.atomic():
+        # Mettre à jour le statut du paiement
+        payment.statut = Payment.STATUT_REUSSI
+        payment.save()
+
+        # Mettre à jour le statut de la commande
+        commande = payment.commande
+        commande.statut = Commande.STATUT_PAYEE
+        commande.save()
+
+        # Ajouter les tomes à la collection de l'utilisateur
+        manga_ids = commande.attribuer_tomes()
+
+        # Mettre à jour le résumé de collection dans la même transaction
+        ResumeCollection.recalculer(
+            utilisateur_ids=[commande.utilisateur_id],
+            manga_ids=manga_ids,
+            date_ajout=timezone.now(),
+        )
+
+        # Vider le panier de l'utilisateur
+        panier = get_or_create_panier(commande.utilisateur)
+        panier.vider()
+
+
+def handle_payment_failure(payment_intent):
+    """
+    Traite un échec de paiement
+    """
+    try:
+        payment = Payment.objects.get(
+            stripe_payment_intent_id=payment_intent['id']
+        )
+    except Payment.DoesNotExist:
+        raise Payment.DoesNotExist(f"Payment not found for intent: {payment_intent['id']}")
+
+    if payment.statut == Payment.STATUT_REUSSI:
+        # Un échec reçu après le succès ne doit pas l'annuler
+        return
+    payment.statut = Payment.STATUT_ECHEC
+    payment.save()
+
+
+HANDLERS = {
+    'payment_intent.succeeded': handle_payment_success,
+    'payment_intent.payment_failed': handle_payment_failure,
+}
+
+
+def enregistrer_evenement(event, payload):
+    """
+    Enregistre un événement vérifié ; un événement déjà reçu (retry Stripe) est ignoré.
+    Planifie le traitement après commit.
+    """
+    StripeWebhookEvent.objects.bulk_create(
+        [StripeWebhookEvent(stripe_event_id=event['id'], event_type=event['type'], data=payload)],
+        ignore_conflicts=True,
+    )
+    transaction.on_commit(planifier_traitement)
+
+
+def planifier_traitement():
+    from .tasks import traiter_evenements_stripe_task
+
+    try:
+        traiter_evenements_stripe_task.delay()
+    except Exception as exc:
+        # L'événement est enregistré : il sera traité au prochain passage
+        print(f"❌ Impossible de planifier le traitement des événements Stripe: {exc}")
+
+
+def _objet(evenement):
+    return (evenement.data.get('data') or {}).get('object') or {}
+
+
+def traiter_evenement(evenement):
+    """
+    Applique un événement et le marque traité dans la même transaction.
+    Retourne False s'il avait déjà été traité (autre worker, rejeu). Lève l'erreur du handler.
+    """
+    try:
+        with transaction.atomic():
+            # Réserve l'événement : un traitement concurrent ne trouve plus de ligne à mettre à jour
+            reserve = StripeWebhookEvent.objects.filter(pk=evenement.pk, processed=False).update(
+                processed=True, date_traitement=timezone.now()
+            )
+            if not reserve:
+                return False
+            handler = HANDLERS.get(evenement.event_type)
+            if handler is not None:
+                handler(_objet(evenement))
+    except Exception as exc:
+        StripeWebhookEvent.objects.filter(pk=evenement.pk).update(
+            tentatives=evenement.tentatives + 1, derniere_erreur=str(exc)
+        )
+        raise
+    evenement.processed = True
+    return True
+
+
+def traiter_evenements_en_attente(queryset=None, objets_bloques=None):
+    """
+    Traite les événements non traités par ordre d'arrivée.
+    Un événement en échec est laissé en attente, ainsi que les suivants portant sur le même objet
+    Stripe pour ne pas les appliquer dans le désordre (objets_bloques : set partagé entre appels).
+    Retourne {'traites': n, 'echecs': [stripe_event_id, ...]}.
+    """
+    queryset = StripeWebhookEvent.objects.all() if queryset is None else queryset
+    queryset = queryset.filter(processed=False)
+    traites, echecs = 0, []
+    objets_bloques = set() if objets_bloques is None else objets_bloques
+    dernier_id = 0
+
+    while True:
+        # Pagination par id : les événements traités sortent du filtre au fil de l'eau
+        lot = list(queryset.filter(id__gt=dernier_id).order_by('id')[:BATCH_SIZE])
+        if not lot:
+            break
+        dernier_id = lot[-1].id
+        for evenement in lot:
+            objet_id = _objet(evenement).get('id')
+            if objet_id and objet_id in objets_bloques:
+                echecs.append(evenement.stripe_event_id)
+                continue
+            try:
+                if traiter_evenement(evenement):
+                    traites += 1
+            except Exception as exc:
+                logger.warning(f"Stripe event {evenement.stripe_event_id} failed: {exc}")
+                echecs.append(evenement.stripe_event_id)
+                if objet_id:
+                    objets_bloques.add(objet_id)
+
+    return {'traites': traites, 'echecs': echecs}
+
+
+# Rejeu
+
+def partitionner(queryset, files, batch_size):
+    """
+    Répartit les événements en au plus `files` files de lots d'ids, dans l'ordre d'arrivée.
+    Les événements d'un même objet Stripe (payment intent) tombent dans la même file.
+    """
+    contenu = [[] for _ in range(max(files, 1))]
+    for event_id, objet_id in queryset.order_by('id').values_list('id', 'data__data__object__id'):
+        cle = str(objet_id or event_id).encode()
+        contenu[zlib.crc32(cle) % len(contenu)].append(event_id)
+    return [
+        [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+        for ids in contenu if ids
+    ]
+
+
+def rejouer_evenements(queryset, batch_size=BATCH_SIZE, workers=1, progression=None):
+    """
+    Retraite les événements sélectionnés, déjà traités ou non (les handlers sont idempotents),
+    par lots de batch_size, dans le thread appelant ou sur `workers` threads (utile seulement
+    avec une base qui accepte des écritures concurrentes). progression(lot, resultat) est appelé après chaque lot.
+    Retourne {'traites': n, 'echecs': [stripe_event_id, ...]}.
+    """
+    queryset.filter(processed=True).update(processed=False, date_traitement=None)
+    files = partitionner(queryset, workers, batch_size)
+    total = {'traites': 0, 'echecs': []}
+    lock = threading.Lock()
+
+    def _traiter_file(lots):
+        objets_bloques = set()
+        for lot in lots:
+            result = traiter_evenements_en_attente(
+                StripeWebhookEvent.objects.filter(id__in=lot), objets_bloques
+            )
+            with lock:
+                total['traites'] += result['traites']
+                total['echecs'].extend(result['echecs'])
+                if progression is not None:
+                    progression(lot, result)
+
+    if len(files) <= 1:
+        for lots in files:
+            _traiter_file(lots)
+        return total
+
+    def _thread(lots):
+        try:
+            _traiter_file(lots)
+        finally:
+            # Chaque thread a sa propre connexion
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=len(files)) as executor:
+        for future in [executor.submit(_thread, lots) for lots in files]:
+            future.result()
+    return total
+
+
+def planifier_rejeu(queryset, batch_size=BATCH_SIZE, files=4):
+    """
+    Variante Celery de rejouer_evenements : une chaîne de tâches par file, les files
+    s'exécutant en parallèle sur les workers. Retourne le nombre de lots planifiés.
+    """
+    from celery import chain
+    from .tasks import traiter_lot_evenements_stripe_task
+
+    queryset.filter(processed=True).update(processed=False, date_traitement=None)
+    lots = 0
+    for file in partitionner(queryset, files, batch_size):
+        chain(*(traiter_lot_evenements_stripe_task.si(lot) for lot in file)).delay()
+        lots += len(file)
+    return lots
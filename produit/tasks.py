@@ -66,3 +66,90 @@ def process_order_task(order_id):
     
     logger.info(f"Order processed successfully: {result}")
     return result
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def generate_cover_derivatives_task(self, tome_id):
+    """
+    Generate the resized WebP/JPEG covers and the blurred placeholder of a tome.
+    """
+    from .covers import generate_derivatives
+    from .models import Tome
+    from . import catalog_cache
+
+    tome = Tome.objects.filter(pk=tome_id).only('id', 'manga_id', 'cover', 'cover_variantes').first()
+    if tome is None or not tome.cover:
+        return {'status': 'skipped', 'tome_id': tome_id}
+
+    cover_name = tome.cover.name
+    try:
+        variantes, placeholder = generate_derivatives(cover_name, previous=tome.cover_variantes)
+    except Exception as exc:
+        logger.error(f"Cover derivatives failed for tome {tome_id}: {exc}")
+        raise self.retry(exc=exc)
+
+    # update() plutôt que save() : pas de signal, donc pas de nouvelle génération.
+    # Le filtre sur cover ignore le résultat si la couverture a changé entre-temps.
+    updated = Tome.objects.filter(pk=tome_id, cover=cover_name).update(
+        cover_variantes=variantes,
+        cover_placeholder=placeholder,
+    )
+    if updated:
+        catalog_cache.bump_version(catalog_cache.manga_scope(tome.manga_id))
+
+    result = {
+        'status': 'generated' if updated else 'stale',
+        'tome_id': tome_id,
+        'variantes': variantes,
+    }
+    logger.info(f"Cover derivatives generated: {result}")
+    return result
+
+
+@shared_task
+def persister_paniers_redis_task():
+    """
+    Write the carts changed in Redis back to Panier/PanierItem (PANIER_BACKEND = 'redis').
+    """
+    from .panier_redis import persister_paniers_modifies
+
+    total = persister_paniers_modifies()
+    logger.info(f"Redis carts persisted: {total}")
+    return {'status': 'completed', 'paniers': total}
+
+
+@shared_task(bind=True, max_retries=5)
+def traiter_evenements_stripe_task(self, reessayer=True):
+    """
+    Apply the pending Stripe webhook events in arrival order; retried with backoff while some fail.
+    Events still failing afterwards stay pending for the periodic sweep (CELERY_BEAT_SCHEDULE,
+    reessayer=False) and are logged as errors.
+    """
+    from .stripe_events import traiter_evenements_en_attente
+
+    result = traiter_evenements_en_attente()
+    logger.info(f"Stripe events processed: {result['traites']}, failed: {len(result['echecs'])}")
+    if result['echecs']:
+        echecs = ', '.join(result['echecs'])
+        if reessayer and self.request.retries < self.max_retries:
+            raise self.retry(
+                exc=RuntimeError(f"Stripe events failed: {echecs}"),
+                countdown=30 * 2 ** self.request.retries,
+            )
+        logger.error(f"Stripe events still failing, left pending: {echecs}")
+        return {'status': 'failed', 'traites': result['traites'], 'echecs': result['echecs']}
+    return {'status': 'completed', 'traites': result['traites']}
+
+
+@shared_task
+def traiter_lot_evenements_stripe_task(event_ids):
+    """
+    Reprocess a batch of Stripe webhook events (replay_stripe_events --celery).
+    Failed events stay pending with their error recorded.
+    """
+    from .models import StripeWebhookEvent
+    from .stripe_events import traiter_evenements_en_attente
+
+    result = traiter_evenements_en_attente(StripeWebhookEvent.objects.filter(id__in=event_ids))
+    logger.info(f"Stripe events replayed: {result['traites']}, failed: {len(result['echecs'])}")
+    return result
@@ -1,3 +1,1157 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import importlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+import stripe
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core import mail
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from PIL import Image
+from utils import gcs, stripe_client
+from utils.cached_storage import CHECKSUM_SUFFIX, CachedStorage
+
+from . import catalog_cache, covers, panier_redis
+from .autocomplete import prefix_index
+from .models import (
+    Category, Commande, Manga, Panier, PanierItem, Payment, ResumeCollection, StripeWebhookEvent, Tome,
+)
+from .fake_stripe import FakeStripe, make_server, signature_header
+from .fuzzy import trigram_index
+from .stripe_events import traiter_evenements_en_attente
+from .tasks import generate_cover_derivatives_task, traiter_evenements_stripe_task
+from .uploads import CoverUploadError, import_covers_zip, store_cover
+
+
+class CommanderViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('lecteur', 'lecteur@example.com', 'motdepasse')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.panier = Panier.objects.create(utilisateur=self.user)
+
+    def remplir_panier(self, nombre_tomes):
+        manga = Manga.objects.create(nom=f'Série {nombre_tomes}', prix='6.90', nombre_tome=nombre_tomes)
+        for tome in manga.tomes.all():
+            self.panier.ajouter_tome(tome, 2)
+
+    def test_nombre_de_requetes_constant(self):
+        # panier, lignes, savepoint, commande, lignes de commande, release
+        for nombre_tomes in (1, 25):
+            with self.subTest(nombre_tomes=nombre_tomes):
+                Commande.objects.all().delete()
+                self.panier.vider()
+                self.remplir_panier(nombre_tomes)
+                with self.assertNumQueries(6):
+                    response = self.client.post('/api/commandes/create/')
+                self.assertEqual(response.status_code, 201)
+
+    def test_totaux_et_lignes(self):
+        self.remplir_panier(3)
+        response = self.client.post('/api/commandes/create/')
+
+        commande = Commande.objects.get()
+        self.assertEqual(response.json()['commande']['total_tomes'], 6)
+        self.assertEqual(commande.total_tomes, 6)
+        self.assertEqual(commande.total_prix, Decimal('41.40'))
+        self.assertEqual(
+            sorted(commande.items.values_list('tome__numero', 'quantite', 'prix_unitaire')),
+            [(1, 2, Decimal('6.90')), (2, 2, Decimal('6.90')), (3, 2, Decimal('6.90'))],
+        )
+
+    def test_panier_vide(self):
+        response = self.client.post('/api/commandes/create/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Commande.objects.exists())
+
+
+def signer(payload, secret=None):
+    timestamp = int(time.time())
+    secret = secret or settings.STRIPE_WEBHOOK_SECRET
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+class StripeWebhookTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('lecteur', 'lecteur@example.com', 'motdepasse')
+        manga = Manga.objects.create(nom='Série', prix='6.90', nombre_tome=2)
+        panier = Panier.objects.create(utilisateur=self.user)
+        for tome in manga.tomes.all():
+            panier.ajouter_tome(tome)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        client.post('/api/commandes/create/')
+        self.commande = Commande.objects.get()
+        self.payment = Payment.objects.create(
+            commande=self.commande,
+            stripe_payment_intent_id='pi_test',
+            stripe_client_secret='secret',
+            montant=self.commande.total_prix,
+        )
+
+    def envoyer(self, event_id, event_type='payment_intent.succeeded'):
+        payload = json.dumps({
+            'id': event_id,
+            'object': 'event',
+            'type': event_type,
+            'data': {'object': {'id': 'pi_test', 'object': 'payment_intent'}},
+        })
+        with mock.patch('produit.tasks.traiter_evenements_stripe_task.delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post(
+                '/api/webhooks/stripe/', payload, content_type='application/json',
+                HTTP_STRIPE_SIGNATURE=signer(payload),
+            )
+        return response, delay
+
+    def test_evenement_enregistre_sans_traitement(self):
+        response, delay = self.envoyer('evt_1')
+
+        self.assertEqual(response.status_code, 200)
+        delay.assert_called_once()
+        evenement = StripeWebhookEvent.objects.get()
+        self.assertFalse(evenement.processed)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.statut, Payment.STATUT_EN_ATTENTE)
+
+    def test_evenement_rejoue_ignore(self):
+        self.envoyer('evt_1')
+        self.envoyer('evt_1')
+        self.assertEqual(StripeWebhookEvent.objects.count(), 1)
+
+    def test_signature_invalide(self):
+        payload = json.dumps({'id': 'evt_1', 'type': 'payment_intent.succeeded'})
+        response = APIClient().post(
+            '/api/webhooks/stripe/', payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=signer(payload, secret='whsec_autre'),
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeWebhookEvent.objects.exists())
+
+    def test_traitement(self):
+        self.envoyer('evt_1')
+        self.envoyer('evt_2', 'payment_intent.payment_failed')
+
+        result = traiter_evenements_en_attente()
+
+        self.assertEqual(result, {'traites': 2, 'echecs': []})
+        self.assertFalse(StripeWebhookEvent.objects.filter(processed=False).exists())
+        self.payment.refresh_from_db()
+        self.commande.refresh_from_db()
+        # L'échec reçu après le succès ne l'annule pas
+        self.assertEqual(self.payment.statut, Payment.STATUT_REUSSI)
+        self.assertEqual(self.commande.statut, Commande.STATUT_PAYEE)
+        self.assertEqual(self.user.tomes_possedes.count(), 2)
+        self.assertEqual(traiter_evenements_en_attente(), {'traites': 0, 'echecs': []})
+
+    def test_echec_laisse_en_attente(self):
+        self.envoyer('evt_1')
+        with mock.patch.object(Commande, 'attribuer_tomes', side_effect=RuntimeError('boom')):
+            result = traiter_evenements_en_attente()
+
+        self.assertEqual(result, {'traites': 0, 'echecs': ['evt_1']})
+        evenement = StripeWebhookEvent.objects.get()
+        self.assertFalse(evenement.processed)
+        self.assertEqual(evenement.tentatives, 1)
+        self.assertEqual(evenement.derniere_erreur, 'boom')
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.statut, Payment.STATUT_EN_ATTENTE)
+
+        self.assertEqual(traiter_evenements_en_attente(), {'traites': 1, 'echecs': []})
+
+    def test_paiement_inconnu_laisse_en_attente(self):
+        # Webhook reçu avant que le Payment ne soit enregistré
+        Payment.objects.filter(pk=self.payment.pk).update(stripe_payment_intent_id='pi_plus_tard')
+        self.envoyer('evt_1')
+        self.envoyer('evt_2', 'payment_intent.payment_failed')
+
+        self.assertEqual(traiter_evenements_en_attente(), {'traites': 0, 'echecs': ['evt_1', 'evt_2']})
+        evenement = StripeWebhookEvent.objects.get(stripe_event_id='evt_1')
+        self.assertFalse(evenement.processed)
+        self.assertEqual(evenement.derniere_erreur, 'Payment not found for intent: pi_test')
+
+        Payment.objects.filter(pk=self.payment.pk).update(stripe_payment_intent_id='pi_test')
+        self.assertEqual(traiter_evenements_en_attente(), {'traites': 2, 'echecs': []})
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.statut, Payment.STATUT_REUSSI)
+
+    def test_reessais_epuises(self):
+        self.envoyer('evt_1')
+        with mock.patch.object(Commande, 'attribuer_tomes', side_effect=RuntimeError('boom')), \
+                self.assertLogs('produit.tasks', 'ERROR') as logs:
+            result = traiter_evenements_stripe_task.apply().get()
+
+        self.assertEqual(result, {'status': 'failed', 'traites': 0, 'echecs': ['evt_1']})
+        self.assertIn('evt_1', logs.output[-1])
+        evenement = StripeWebhookEvent.objects.get()
+        self.assertFalse(evenement.processed)
+        self.assertEqual(evenement.tentatives, traiter_evenements_stripe_task.max_retries + 1)
+
+        # Le balayage périodique reprend l'événement, sans chaîne de réessais
+        balayage = settings.CELERY_BEAT_SCHEDULE['traiter-evenements-stripe']
+        self.assertEqual(balayage['task'], traiter_evenements_stripe_task.name)
+        with mock.patch.object(Commande, 'attribuer_tomes', side_effect=RuntimeError('boom')), \
+                self.assertLogs('produit.tasks', 'ERROR'):
+            traiter_evenements_stripe_task.apply(kwargs=balayage['kwargs'])
+        evenement.refresh_from_db()
+        self.assertEqual(evenement.tentatives, traiter_evenements_stripe_task.max_retries + 2)
+
+        result = traiter_evenements_stripe_task.apply(kwargs=balayage['kwargs']).get()
+        self.assertEqual(result, {'status': 'completed', 'traites': 1})
+
+    def test_rejeu(self):
+        self.envoyer('evt_1', 'payment_intent.payment_failed')
+        self.envoyer('evt_2')
+        with mock.patch.object(Commande, 'attribuer_tomes', side_effect=RuntimeError('boom')):
+            traiter_evenements_en_attente()
+
+        out = StringIO()
+        call_command('replay_stripe_events', '--type', 'payment_intent.succeeded', '--workers', '1', stdout=out)
+
+        self.assertIn('1 événement(s) traité(s)', out.getvalue())
+        self.assertEqual(
+            dict(StripeWebhookEvent.objects.values_list('stripe_event_id', 'processed')),
+            {'evt_1': True, 'evt_2': True},
+        )
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.statut, Payment.STATUT_REUSSI)
+
+    def etat(self):
+        self.payment.refresh_from_db()
+        self.commande.refresh_from_db()
+        return {
+            'payment': self.payment.statut,
+            'commande': self.commande.statut,
+            'tomes': sorted(self.user.tomes_possedes.values_list('id', flat=True)),
+            'resumes': list(ResumeCollection.objects.values_list(
+                'utilisateur_id', 'manga_id', 'nombre_possedes', 'date_dernier_ajout',
+            )),
+            'panier': list(PanierItem.objects.values_list('tome_id', 'quantite')),
+            'emails': len(mail.outbox),
+        }
+
+    def test_rejeu_idempotent(self):
+        self.envoyer('evt_1')
+        self.envoyer('evt_2', 'payment_intent.payment_failed')
+        traiter_evenements_en_attente()
+        etat = self.etat()
+        self.assertEqual(etat['payment'], Payment.STATUT_REUSSI)
+        self.assertEqual(len(etat['tomes']), 2)
+
+        # Rejouer plusieurs fois l'historique complet ne change rien
+        for _ in range(2):
+            out = StringIO()
+            call_command('replay_stripe_events', '--include-processed', stdout=out)
+            self.assertIn('2 événement(s) traité(s)', out.getvalue())
+            self.assertIn('0 échec(s)', out.getvalue())
+            self.assertEqual(self.etat(), etat)
+        self.assertFalse(StripeWebhookEvent.objects.filter(processed=False).exists())
+
+    def test_rejeu_sequentiel_par_defaut(self):
+        self.envoyer('evt_1')
+        with mock.patch('produit.stripe_events.ThreadPoolExecutor') as executor:
+            call_command('replay_stripe_events', stdout=StringIO())
+        executor.assert_not_called()
+        self.assertTrue(StripeWebhookEvent.objects.get().processed)
+
+
+class FakeStripeTests(TestCase):
+    def setUp(self):
+        self.fake = FakeStripe(webhook_secret=settings.STRIPE_WEBHOOK_SECRET, confirm_after=None)
+        self.server = make_server('127.0.0.1', 0, self.fake)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.fake.shutdown)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        api_base = f'http://127.0.0.1:{self.server.server_address[1]}'
+        patcher = mock.patch.multiple(stripe, api_base=api_base, api_key='sk_test_fake')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Client partagé (create_payment_intent) dirigé vers le faux Stripe
+        reglages = override_settings(STRIPE_API_BASE=api_base, STRIPE_MAX_NETWORK_RETRIES=0)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        stripe_client.close_client()
+        self.addCleanup(stripe_client.close_client)
+
+    def test_payment_intent(self):
+        intent = stripe.PaymentIntent.create(amount=1380, currency='eur', metadata={'commande_id': 7})
+
+        self.assertTrue(intent.id.startswith('pi_'))
+        self.assertEqual(intent.amount, 1380)
+        self.assertEqual(intent.metadata['commande_id'], '7')
+        self.assertEqual(stripe.PaymentIntent.retrieve(intent.id).status, 'requires_payment_method')
+
+    def test_webhook_signe(self):
+        self.fake.webhook_url = 'http://testserver/api/webhooks/stripe/'
+        intent = stripe.PaymentIntent.create(amount=690, currency='eur')
+        with mock.patch.object(self.fake, '_deliver') as deliver:
+            stripe.PaymentIntent.confirm(intent.id)
+            self.fake.shutdown()
+
+        payload = deliver.call_args.args[0]
+        secret = settings.STRIPE_WEBHOOK_SECRET
+        event = stripe.Webhook.construct_event(payload, signature_header(payload, secret), secret)
+        self.assertEqual(event['type'], 'payment_intent.succeeded')
+        self.assertEqual(event['data']['object']['id'], intent.id)
+
+    def test_erreur_simulee(self):
+        self.fake.error_rate = 1
+        with self.assertRaises(stripe.error.APIError):
+            stripe.PaymentIntent.create(amount=690, currency='eur')
+        self.assertEqual(self.fake.snapshot()['errors'], 1)
+
+    def commander(self):
+        user = User.objects.create_user('acheteur', 'acheteur@example.com', 'motdepasse')
+        manga = Manga.objects.create(nom='Série', prix='6.90', nombre_tome=2)
+        Panier.objects.create(utilisateur=user).ajouter_tome(manga.tomes.first())
+        client = APIClient()
+        client.force_authenticate(user)
+        reference = client.post('/api/commandes/create/').json()['commande']['reference']
+        return client, reference
+
+    def test_create_payment_intent(self):
+        client, reference = self.commander()
+
+        response = client.post('/api/payments/create-intent/', {'commande_id': reference}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        payment = Payment.objects.get()
+        self.assertEqual(payment.stripe_payment_intent_id, response.json()['payment_intent_id'])
+        self.assertEqual(response.json()['amount'], 690)
+        self.assertEqual(payment.stripe_metadata['commande_reference'], reference)
+
+    def test_idempotence(self):
+        client, reference = self.commander()
+        commande = Commande.objects.get()
+        params = {'amount': 690, 'currency': 'eur'}
+        cle = f'payment-intent-{commande.reference}'
+
+        premier = stripe_client.create_payment_intent(params, idempotency_key=cle)
+        second = stripe_client.create_payment_intent(params, idempotency_key=cle)
+
+        self.assertEqual(premier.id, second.id)
+        self.assertEqual(self.fake.snapshot()['intents'], 1)
+        # La vue utilise la même clé : pas de second PaymentIntent
+        response = client.post('/api/payments/create-intent/', {'commande_id': reference}, format='json')
+        self.assertEqual(response.json()['payment_intent_id'], premier.id)
+
+    def test_reessai_reseau(self):
+        client, reference = self.commander()
+        stripe_client.close_client()
+        self.fake.error_rate = 1
+        with override_settings(STRIPE_MAX_NETWORK_RETRIES=2):
+            response = client.post('/api/payments/create-intent/', {'commande_id': reference}, format='json')
+        # Les erreurs 500 de Stripe sont réessayées puis remontées
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.fake.snapshot()['errors'], 3)
+
+    def test_timeout(self):
+        client, reference = self.commander()
+        stripe_client.close_client()
+        self.fake.latency = 0.5
+        with override_settings(STRIPE_READ_TIMEOUT=0.1):
+            response = client.post('/api/payments/create-intent/', {'commande_id': reference}, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(Payment.objects.exists())
+
+
+class CoverDerivativeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dossier.cleanup)
+        self.storage = FileSystemStorage(location=self.dossier.name)
+        patcher = mock.patch('produit.covers.storages', {'cover_cache': self.storage})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manga = Manga.objects.create(nom='Akira', prix='6.90', nombre_tome=1)
+        self.tome = self.manga.tomes.get()
+
+    def couverture(self, nom, taille=(400, 600)):
+        buffer = BytesIO()
+        Image.new('RGB', taille, (200, 30, 30)).save(buffer, format='PNG')
+        return self.storage.save(nom, ContentFile(buffer.getvalue()))
+
+    def dimensions(self, nom):
+        with self.storage.open(nom, 'rb') as fichier:
+            return Image.open(fichier).size
+
+    @override_settings(COVER_DERIVATIVE_WIDTHS=(160, 320, 640))
+    def test_declinaisons(self):
+        nom = self.couverture('karlBouvier/akira-01.png')
+        variantes, placeholder = covers.generate_derivatives(nom)
+
+        self.assertEqual(sorted(variantes), ['jpeg', 'webp'])
+        self.assertEqual(variantes['webp']['320'], 'karlBouvier/akira-01_320w.webp')
+        self.assertEqual(self.dimensions(variantes['webp']['160']), (160, 240))
+        self.assertEqual(self.dimensions(variantes['jpeg']['320']), (320, 480))
+        # Pas d'agrandissement au-delà de l'original
+        self.assertEqual(self.dimensions(variantes['jpeg']['640']), (400, 600))
+        self.assertTrue(placeholder.startswith('data:image/webp;base64,'))
+
+    @override_settings(COVER_DERIVATIVE_WIDTHS=(160,))
+    def test_anciennes_declinaisons_supprimees(self):
+        ancienne = self.couverture('karlBouvier/akira-01.png')
+        precedentes, _ = covers.generate_derivatives(ancienne)
+        nouvelle = self.couverture('karlBouvier/akira-01-v2.png')
+        variantes, _ = covers.generate_derivatives(nouvelle, previous=precedentes)
+
+        for nom in covers.variant_names(precedentes):
+            self.assertFalse(self.storage.exists(nom))
+        for nom in covers.variant_names(variantes):
+            self.assertTrue(self.storage.exists(nom))
+
+    @override_settings(COVER_DERIVATIVE_WIDTHS=(160,))
+    def test_tache(self):
+        nom = self.couverture('karlBouvier/akira-01.png')
+        # update() : pas de signal, la tâche est lancée à la main
+        Tome.objects.filter(pk=self.tome.pk).update(cover=nom)
+        version = catalog_cache.get_version(catalog_cache.manga_scope(self.manga.pk))
+
+        result = generate_cover_derivatives_task(self.tome.pk)
+        self.assertEqual(result['status'], 'generated')
+        self.tome.refresh_from_db()
+        self.assertEqual(covers.variant_names(self.tome.cover_variantes), [
+            'karlBouvier/akira-01_160w.webp', 'karlBouvier/akira-01_160w.jpeg',
+        ])
+        self.assertTrue(self.tome.cover_placeholder)
+        self.assertGreater(catalog_cache.get_version(catalog_cache.manga_scope(self.manga.pk)), version)
+
+    def test_tache_sans_couverture_ou_perimee(self):
+        self.assertEqual(generate_cover_derivatives_task(self.tome.pk)['status'], 'skipped')
+
+        nom = self.couverture('karlBouvier/akira-01.png')
+        Tome.objects.filter(pk=self.tome.pk).update(cover=nom)
+
+        def remplacer_pendant_la_generation(cover_name, previous=None):
+            Tome.objects.filter(pk=self.tome.pk).update(cover='karlBouvier/akira-01-v2.png')
+            return {'webp': {'160': 'karlBouvier/akira-01_160w.webp'}}, 'data:image/webp;base64,xx'
+
+        # Couverture remplacée pendant la génération : le résultat est ignoré
+        with mock.patch('produit.covers.generate_derivatives', side_effect=remplacer_pendant_la_generation):
+            result = generate_cover_derivatives_task(self.tome.pk)
+        self.assertEqual(result['status'], 'stale')
+        self.tome.refresh_from_db()
+        self.assertEqual(self.tome.cover_variantes, {})
+
+    def test_tache_original_introuvable(self):
+        Tome.objects.filter(pk=self.tome.pk).update(cover='karlBouvier/absente.png')
+        # L'échec remonte à Celery pour une nouvelle tentative, sans toucher au tome
+        with self.assertLogs('produit.tasks', 'ERROR'), self.assertRaises(Exception):
+            generate_cover_derivatives_task(self.tome.pk)
+        self.tome.refresh_from_db()
+        self.assertEqual(self.tome.cover_variantes, {})
+
+    def test_repli_sans_declinaisons(self):
+        self.assertIsNone(covers.build_srcset({}, '', {}))
+        self.assertIsNone(covers.build_srcset(None, 'data:image/webp;base64,xx', {}))
+        self.assertEqual(covers.variant_names(None), [])
+
+        variantes = {'webp': {'640': 'a_640w.webp', '160': 'a_160w.webp'}}
+        srcset = covers.build_srcset(variantes, '', {'a_160w.webp': 'https://signee/a_160w.webp'})
+        # Tri numérique des largeurs ; URL absente si le fichier n'a pas été signé
+        self.assertEqual(list(srcset['webp']), ['160w', '640w'])
+        self.assertEqual(srcset['webp'], {'160w': 'https://signee/a_160w.webp', '640w': None})
+        self.assertIsNone(srcset['placeholder'])
+
+    def test_detail_sans_declinaisons(self):
+        Tome.objects.filter(pk=self.tome.pk).update(cover='karlBouvier/akira-01.png')
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('lecteur', 'lecteur@example.com', 'motdepasse'))
+
+        def signer(noms):
+            return {nom: f'https://signee/{nom}' for nom in noms if nom}
+
+        # Déclinaisons pas encore générées : la couverture d'origine seule
+        with mock.patch('connect.views.get_cached_signed_urls', side_effect=signer):
+            tome = client.get(f'/api/manga/{self.manga.pk}/').json()['tomes'][0]
+        self.assertEqual(tome['cover'], 'https://signee/karlBouvier/akira-01.png')
+        self.assertIsNone(tome['cover_srcset'])
+
+
+class CachedStorageTests(TestCase):
+    def setUp(self):
+        self.dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dossier.cleanup)
+        self.backend = FileSystemStorage(location=f'{self.dossier.name}/distant', allow_overwrite=True)
+        self.storage = CachedStorage(backend=self.backend, cache_dir=f'{self.dossier.name}/cache', max_bytes=1000)
+
+    def lire(self, nom):
+        with self.storage.open(nom) as fichier:
+            return bytes(fichier.read())
+
+    def test_lecture_depuis_le_cache(self):
+        self.backend.save('karlBouvier/akira-01.jpg', ContentFile(b'couverture'))
+        self.assertEqual(self.lire('karlBouvier/akira-01.jpg'), b'couverture')
+
+        # Deuxième lecture : aucun accès au stockage distant
+        with mock.patch.object(self.backend, 'open', side_effect=AssertionError('lecture distante')):
+            with self.storage.open('karlBouvier/akira-01.jpg') as fichier:
+                self.assertEqual(fichier.size, len(b'couverture'))
+                self.assertEqual(bytes(fichier.read()), b'couverture')
+
+    def test_fichier_remplace(self):
+        self.storage.save('karlBouvier/akira-01.jpg', ContentFile(b'ancienne'))
+        self.assertEqual(self.lire('karlBouvier/akira-01.jpg'), b'ancienne')
+
+        # Même nom réécrit : la copie locale est oubliée
+        self.assertEqual(self.storage.save('karlBouvier/akira-01.jpg', ContentFile(b'nouvelle')), 'karlBouvier/akira-01.jpg')
+        self.assertEqual(self.lire('karlBouvier/akira-01.jpg'), b'nouvelle')
+
+        self.storage.delete('karlBouvier/akira-01.jpg')
+        self.assertFalse(os.path.exists(self.storage._cache_path('karlBouvier/akira-01.jpg')))
+        with self.assertRaises(FileNotFoundError):
+            self.lire('karlBouvier/akira-01.jpg')
+
+    def test_copie_locale_alteree(self):
+        self.backend.save('karlBouvier/akira-01.jpg', ContentFile(b'couverture'))
+        self.lire('karlBouvier/akira-01.jpg')
+        chemin = self.storage._cache_path('karlBouvier/akira-01.jpg')
+        with open(chemin, 'wb') as fichier:
+            fichier.write(b'couverturX')
+
+        # Somme de contrôle vérifiée par un autre processus : copie rechargée
+        autre = CachedStorage(backend=self.backend, cache_dir=self.storage.cache_dir)
+        with autre.open('karlBouvier/akira-01.jpg') as fichier:
+            self.assertEqual(bytes(fichier.read()), b'couverture')
+        # Taille différente de celle enregistrée : rechargée aussi
+        with open(chemin + CHECKSUM_SUFFIX, 'w') as fichier:
+            fichier.write('0' * 64 + ' 3')
+        self.assertEqual(self.lire('karlBouvier/akira-01.jpg'), b'couverture')
+
+    def test_eviction_lru(self):
+        for numero in (1, 2, 3):
+            self.backend.save(f'karlBouvier/akira-0{numero}.jpg', ContentFile(bytes([numero]) * 400))
+        self.lire('karlBouvier/akira-01.jpg')
+        self.lire('karlBouvier/akira-02.jpg')
+        ancien = time.time() - 60
+        os.utime(self.storage._cache_path('karlBouvier/akira-01.jpg'), (ancien, ancien))
+        self.lire('karlBouvier/akira-03.jpg')
+
+        # 1200 octets > 1000 : le moins récemment lu est évincé
+        self.assertFalse(os.path.exists(self.storage._cache_path('karlBouvier/akira-01.jpg')))
+        self.assertTrue(os.path.exists(self.storage._cache_path('karlBouvier/akira-02.jpg')))
+        self.assertTrue(os.path.exists(self.storage._cache_path('karlBouvier/akira-03.jpg')))
+
+
+class StoreCoverTests(TestCase):
+    def setUp(self):
+        self.dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dossier.cleanup)
+        self.storage = FileSystemStorage(location=self.dossier.name)
+        self.manga = Manga.objects.create(nom='Akira', prix='6.90', nombre_tome=1)
+        self.tome = self.manga.tomes.get()
+
+    def test_flux_enregistre(self):
+        nom = store_cover(self.tome, BytesIO(b'image' * 1000), 'Akira 01.JPG', storage=self.storage)
+        self.assertEqual(nom, 'karlBouvier/Akira_01.JPG')
+        with self.storage.open(nom) as fichier:
+            self.assertEqual(fichier.read(), b'image' * 1000)
+
+        # Nom déjà pris : un autre nom est choisi, l'existant n'est pas écrasé
+        autre = store_cover(self.tome, BytesIO(b'autre'), 'Akira 01.JPG', storage=self.storage)
+        self.assertNotEqual(autre, nom)
+        with self.storage.open(nom) as fichier:
+            self.assertEqual(fichier.read(), b'image' * 1000)
+
+    def test_extension_refusee(self):
+        for filename in ('akira.pdf', 'akira'):
+            with self.subTest(filename=filename), self.assertRaises(CoverUploadError):
+                store_cover(self.tome, BytesIO(b'x'), filename, storage=self.storage)
+        self.assertEqual(self.storage.listdir('')[1], [])
+
+    def test_envoi_gcs_par_morceaux(self):
+        from storages.backends.gcloud import GoogleCloudStorage
+
+        storage = GoogleCloudStorage(bucket_name='couvertures', file_overwrite=True)
+        with mock.patch('produit.uploads.upload_stream') as upload_stream:
+            nom = store_cover(self.tome, BytesIO(b'image'), 'akira-01.webp', storage=storage)
+        self.assertEqual(nom, 'karlBouvier/akira-01.webp')
+        upload_stream.assert_called_once_with(
+            nom, mock.ANY, content_type='image/webp', bucket_name='couvertures',
+        )
+
+    def test_vue(self):
+        staff = User.objects.create_user('admin', 'admin@example.com', 'motdepasse', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(staff)
+        url = f'/api/tomes/{self.tome.pk}/cover/?filename=akira-01.png'
+
+        with mock.patch('produit.uploads.default_storage', self.storage):
+            response = client.post(url, b'\x89PNG' + b'\0' * 100, content_type='image/png')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.json()['cover'], 'karlBouvier/akira-01.png')
+            self.assertEqual(self.storage.size('karlBouvier/akira-01.png'), 104)
+            self.tome.refresh_from_db()
+            self.assertEqual(self.tome.cover.name, 'karlBouvier/akira-01.png')
+
+            self.assertEqual(client.post(url, b'texte', content_type='text/plain').status_code, 415)
+            self.assertEqual(client.post(url, b'', content_type='image/png').status_code, 411)
+            with override_settings(COVER_UPLOAD_MAX_BYTES=10):
+                self.assertEqual(client.post(url, b'\0' * 11, content_type='image/png').status_code, 413)
+            response = client.post(url.replace('.png', '.exe'), b'x', content_type='image/png')
+            self.assertEqual(response.status_code, 400)
+
+
+class GcsHelperTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        gcs._url_cache.clear()
+        self.addCleanup(gcs._url_cache.clear)
+
+    def test_upload_par_morceaux(self):
+        recu = BytesIO()
+        recu.close = lambda: None
+        bucket = mock.Mock()
+        bucket.blob.return_value.open.return_value = recu
+
+        with mock.patch('utils.gcs.get_bucket', return_value=bucket):
+            ecrit = gcs.upload_stream(
+                'karlBouvier/akira.jpg', BytesIO(b'x' * 2500), content_type='image/jpeg', chunk_size=1024,
+            )
+
+        self.assertEqual(ecrit, 2500)
+        self.assertEqual(recu.getvalue(), b'x' * 2500)
+        bucket.blob.assert_called_once_with('karlBouvier/akira.jpg', chunk_size=1024)
+        bucket.blob.return_value.open.assert_called_once_with('wb', content_type='image/jpeg', chunk_size=1024)
+
+    @override_settings(GCS_SIGNED_URL_LIFETIME=3600, GCS_SIGNED_URL_SAFETY_MARGIN=300)
+    def test_urls_signees_en_cache(self):
+        def signer(noms, bucket_name=None, expiration_minutes=None):
+            return {nom: f'https://signee/{nom}?v={signer.appels}' for nom in noms}
+        signer.appels = 0
+
+        with mock.patch('utils.gcs.generate_signed_urls', side_effect=signer) as signature:
+            urls = gcs.get_cached_signed_urls(['a.jpg', 'b.jpg', 'a.jpg', None])
+            self.assertEqual(set(urls), {'a.jpg', 'b.jpg'})
+            signature.assert_called_once_with(
+                ['a.jpg', 'b.jpg'], bucket_name=settings.GS_BUCKET_NAME, expiration_minutes=60,
+            )
+
+            # Même URL tant qu'elle reste valide plus longtemps que la marge
+            signer.appels = 1
+            self.assertEqual(gcs.get_cached_signed_url('a.jpg'), urls['a.jpg'])
+            # Processus sans LRU local : l'URL vient du cache partagé
+            gcs._url_cache.clear()
+            self.assertEqual(gcs.get_cached_signed_url('b.jpg'), urls['b.jpg'])
+            self.assertEqual(signature.call_count, 1)
+
+            # Proche de l'expiration : signée à nouveau
+            with mock.patch('utils.gcs.time.time', return_value=time.time() + 3400):
+                self.assertEqual(gcs.get_cached_signed_url('a.jpg'), 'https://signee/a.jpg?v=1')
+
+            # Couverture remplacée : l'URL est oubliée partout
+            signer.appels = 2
+            gcs.evict_signed_url('b.jpg')
+            self.assertEqual(gcs.get_cached_signed_url('b.jpg'), 'https://signee/b.jpg?v=2')
+
+
+class CoverZipImportTests(TestCase):
+    def setUp(self):
+        self.manga = Manga.objects.create(nom='Akira', prix='6.90', nombre_tome=3)
+        self.dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dossier.cleanup)
+        self.storage = FileSystemStorage(location=self.dossier.name)
+
+    def archive(self, fichiers):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for nom, contenu in fichiers.items():
+                zf.writestr(nom, contenu)
+        buffer.seek(0)
+        return buffer
+
+    def test_import(self):
+        archive = self.archive({
+            'akira/Tome 01.jpg': b'premier',
+            'akira/akira-03.png': b'troisieme',
+            'akira/akira-09.jpg': b'hors serie',
+            'akira/notes.txt': b'texte',
+            '__MACOSX/.akira-02.jpg': b'metadonnees',
+        })
+        result = import_covers_zip(self.manga, archive, storage=self.storage, workers=2)
+
+        self.assertEqual(result['uploaded'], [1, 3])
+        self.assertEqual(sorted(result['skipped']), ['akira/akira-09.jpg', 'akira/notes.txt'])
+        self.assertEqual(result['errors'], {})
+        tome = self.manga.tomes.get(numero=3)
+        self.assertEqual(tome.cover.name, 'karlBouvier/akira-03.png')
+        with self.storage.open(tome.cover.name) as fichier:
+            self.assertEqual(fichier.read(), b'troisieme')
+        self.assertFalse(self.manga.tomes.get(numero=2).cover)
+
+    @override_settings(COVER_UPLOAD_MAX_BYTES=1000)
+    def test_image_trop_volumineuse(self):
+        # 100 Ko de zéros : quelques centaines d'octets compressés
+        archive = self.archive({'akira-01.jpg': b'\xff' * 100, 'akira-02.jpg': b'\0' * 100_000})
+        result = import_covers_zip(self.manga, archive, storage=self.storage, workers=2)
+        self.assertEqual(result['uploaded'], [1])
+        self.assertEqual(list(result['errors']), ['akira-02.jpg'])
+        self.assertFalse(self.manga.tomes.get(numero=2).cover)
+
+    @override_settings(COVER_UPLOAD_MAX_BYTES=1000, COVER_ZIP_MAX_BYTES=1500)
+    def test_archive_trop_volumineuse(self):
+        archive = self.archive({f'akira-{numero}.jpg': b'\0' * 800 for numero in (1, 2, 3)})
+        with self.assertRaises(CoverUploadError):
+            import_covers_zip(self.manga, archive, storage=self.storage)
+        # Rien n'est envoyé avant la vérification de la taille totale
+        self.assertEqual(self.storage.listdir('')[1], [])
+        self.assertFalse(self.manga.tomes.exclude(cover='').exists())
+
+
+class ImportCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dossier.cleanup)
+
+    def importer(self, contenu):
+        path = f'{self.dossier.name}/catalogue.csv'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(contenu)
+        stderr = StringIO()
+        call_command('import_catalog', path, stdout=StringIO(), stderr=stderr)
+        return stderr.getvalue()
+
+    def test_slugs_en_collision(self):
+        Category.objects.create(name='Shonen', slug='shonen')
+        self.importer(
+            'nom,prix,nombre_tome,categories\n'
+            'Naruto,6.90,2,Shōnen|Shonen\n'
+            'Bleach,6.90,1,Shōnen!|Seinen\n'
+            'Monster,7.50,1,Seinen?\n'
+        )
+        self.assertEqual(
+            dict(Category.objects.values_list('name', 'slug')),
+            {'Shonen': 'shonen', 'Shōnen': 'shonen-2', 'Shōnen!': 'shonen-3', 'Seinen': 'seinen', 'Seinen?': 'seinen-2'},
+        )
+        categories = lambda nom: sorted(Manga.objects.get(nom=nom).categories.values_list('name', flat=True))
+        self.assertEqual(categories('Naruto'), ['Shonen', 'Shōnen'])
+        self.assertEqual(categories('Bleach'), ['Seinen', 'Shōnen!'])
+        self.assertEqual(categories('Monster'), ['Seinen?'])
+
+    def test_fiche_invalidee(self):
+        manga = Manga.objects.create(nom='Berserk', prix='6.90', nombre_tome=1)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('lecteur', 'lecteur@example.com', 'motdepasse'))
+        url = f'/api/manga/{manga.pk}/'
+        self.assertEqual(client.get(url).json()['manga']['prix'], 6.9)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.importer('nom,prix,nombre_tome\nBerserk,7.20,2\n')
+
+        detail = client.get(url).json()
+        self.assertEqual(detail['manga']['prix'], 7.2)
+        self.assertEqual(len(detail['tomes']), 2)
+
+    def test_caches_invalides(self):
+        # Versions dans un cache partagé, relu par une instance distincte comme le ferait un autre processus
+        location = self.dossier.name + '/versions'
+        partage = override_settings(
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'catalog_versions': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': location,
+                    'TIMEOUT': None,
+                },
+            },
+            CATALOG_VERSION_CACHE_ALIAS='catalog_versions',
+            INDEX_VERSION_CHECK_INTERVAL=0,
+        )
+        partage.enable()
+        self.addCleanup(partage.disable)
+        for index in (trigram_index, prefix_index):
+            index.reset()
+            self.addCleanup(index.reset)
+        autre_processus = FileBasedCache(location, {'TIMEOUT': None})
+
+        def version(scope):
+            return autre_processus.get(catalog_cache._version_key(scope))
+
+        Manga.objects.create(nom='Berserk', prix='6.90', nombre_tome=1)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('lecteur', 'lecteur@example.com', 'motdepasse'))
+
+        def noms(url, **params):
+            data = client.get(url, params).json()
+            return [m['nom'] for m in data.get('mangas', data.get('suggestions'))]
+
+        # Listes, recherches et index en mémoire chargés avant l'import
+        self.assertEqual(noms('/api/manga/'), ['Berserk'])
+        self.assertEqual(noms('/api/recherche/', q='berserk'), ['Berserk'])
+        self.assertEqual(noms('/api/recherche/', q='bersrek', fuzzy='1'), ['Berserk'])
+        self.assertEqual(noms('/api/recherche/suggest/', q='ber'), ['Berserk'])
+        versions = {scope: version(scope) for scope in (catalog_cache.CATALOG_SCOPE, catalog_cache.TITLES_SCOPE)}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.importer('nom,prix,nombre_tome\nBerserk,7.20,1\nBerserker Ultimate,8.00,1\n')
+
+        for scope, avant in versions.items():
+            self.assertGreater(version(scope), avant or 0)
+        data = client.get('/api/manga/').json()
+        self.assertEqual(
+            [(m['nom'], m['prix']) for m in data['mangas']], [('Berserk', '7.20'), ('Berserker Ultimate', '8.00')],
+        )
+        self.assertEqual(noms('/api/recherche/', q='berserk'), ['Berserk', 'Berserker Ultimate'])
+        self.assertEqual(noms('/api/recherche/', q='ultimat', fuzzy='1'), ['Berserker Ultimate'])
+        self.assertEqual(noms('/api/recherche/suggest/', q='ber'), ['Berserk', 'Berserker Ultimate'])
+
+
+class ResumeCollectionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('lecteur', 'lecteur@example.com', 'motdepasse')
+        self.autre = User.objects.create_user('autre', 'autre@example.com', 'motdepasse')
+        self.berserk = Manga.objects.create(nom='Berserk', prix='6.90', nombre_tome=4)
+        self.akira = Manga.objects.create(nom='Akira', prix='14.50', nombre_tome=2)
+        self.b1, self.b2, self.b3, self.b4 = self.berserk.tomes.order_by('numero')
+        self.a1, self.a2 = self.akira.tomes.order_by('numero')
+
+    def resumes(self):
+        return {
+            (r.utilisateur.username, r.manga.nom): (r.nombre_possedes, r.taux_completion)
+            for r in ResumeCollection.objects.select_related('utilisateur', 'manga')
+        }
+
+    def test_ajout_et_retrait_par_l_utilisateur(self):
+        self.user.tomes_possedes.add(self.b1, self.b2, self.a1)
+        self.assertEqual(self.resumes(), {('lecteur', 'Berserk'): (2, 0.5), ('lecteur', 'Akira'): (1, 0.5)})
+        self.assertIsNotNone(ResumeCollection.objects.get(manga=self.berserk).date_dernier_ajout)
+
+        self.user.tomes_possedes.remove(self.b2, self.a1)
+        self.assertEqual(self.resumes(), {('lecteur', 'Berserk'): (1, 0.25)})
+
+        self.user.tomes_possedes.clear()
+        self.assertEqual(self.resumes(), {})
+
+    def test_ajout_et_retrait_par_le_tome(self):
+        self.b1.possesseurs.add(self.user, self.autre)
+        self.b2.possesseurs.add(self.user)
+        self.assertEqual(self.resumes(), {('lecteur', 'Berserk'): (2, 0.5), ('autre', 'Berserk'): (1, 0.25)})
+
+        self.b1.possesseurs.remove(self.user)
+        self.assertEqual(self.resumes(), {('lecteur', 'Berserk'): (1, 0.25), ('autre', 'Berserk'): (1, 0.25)})
+
+        self.b1.possesseurs.clear()
+        self.assertEqual(self.resumes(), {('lecteur', 'Berserk'): (1, 0.25)})
+
+        self.b2.possesseurs.set([self.autre])
+        self.assertEqual(self.resumes(), {('autre', 'Berserk'): (1, 0.25)})
+
+    def test_migration_de_remplissage(self):
+        # Possessions antérieures au résumé : aucun signal n'a été envoyé
+        Possession = Tome.possesseurs.through
+        Possession.objects.bulk_create([
+            Possession(user=self.user, tome=self.b1),
+            Possession(user=self.user, tome=self.b2),
+            Possession(user=self.autre, tome=self.a1),
+            Possession(user=self.autre, tome=self.a2),
+        ])
+        date = timezone.now() - timedelta(days=30)
+        ResumeCollection.objects.create(utilisateur=self.user, manga=self.berserk, nombre_possedes=1, date_dernier_ajout=date)
+        ResumeCollection.objects.create(utilisateur=self.autre, manga=self.berserk, nombre_possedes=3)
+
+        migration = importlib.import_module('produit.migrations.0016_resumecollection_backfill')
+        migration.remplir_resumes(apps, None)
+
+        self.assertEqual(self.resumes(), {('lecteur', 'Berserk'): (2, 0.5), ('autre', 'Akira'): (2, 1.0)})
+        self.assertEqual(ResumeCollection.objects.get(utilisateur=self.user).date_dernier_ajout, date)
+
+
+class PanierTotauxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('lecteur', 'lecteur@example.com', 'motdepasse')
+        self.panier = Panier.objects.create(utilisateur=self.user)
+        self.berserk = Manga.objects.create(nom='Berserk', prix='6.90', nombre_tome=2)
+        self.akira = Manga.objects.create(nom='Akira', prix='14.50', nombre_tome=1)
+        self.b1, self.b2 = self.berserk.tomes.order_by('numero')
+        self.a1 = self.akira.tomes.get()
+
+    def totaux(self):
+        self.panier.refresh_from_db()
+        return self.panier.total_tomes, self.panier.total_prix
+
+    def test_ajout_modification_retrait(self):
+        self.panier.ajouter_tome(self.b1, 2)
+        self.panier.ajouter_tome(self.a1)
+        self.assertEqual(self.totaux(), (3, Decimal('28.30')))
+        self.panier.ajouter_tome(self.b1)
+        self.assertEqual(self.totaux(), (4, Decimal('35.20')))
+
+        self.panier.modifier_quantite(self.a1, 3)
+        self.assertEqual(self.totaux(), (6, Decimal('64.20')))
+        self.assertIsNone(self.panier.modifier_quantite(self.b2, 1))
+
+        self.assertTrue(self.panier.retirer_tome(self.b1))
+        self.assertEqual(self.totaux(), (3, Decimal('43.50')))
+        self.assertFalse(self.panier.retirer_tome(self.b1))
+
+        self.panier.vider()
+        self.assertEqual(self.totaux(), (0, Decimal('0')))
+        self.assertFalse(self.panier.items.exists())
+
+    def test_changement_de_prix(self):
+        self.panier.ajouter_tome(self.b1, 2)
+        self.berserk.prix = Decimal('7.50')
+        self.berserk.save()
+        self.assertEqual(self.totaux(), (2, Decimal('15.00')))
+
+    def test_suppression_en_cascade(self):
+        autre = Panier.objects.create(utilisateur=User.objects.create_user('autre'))
+        for panier in (self.panier, autre):
+            panier.ajouter_tome(self.b1, 2)
+            panier.ajouter_tome(self.a1)
+
+        self.b1.delete()
+        self.assertEqual(self.totaux(), (1, Decimal('14.50')))
+        autre.refresh_from_db()
+        self.assertEqual((autre.total_tomes, autre.total_prix), (1, Decimal('14.50')))
+
+        self.panier.ajouter_tome(self.b2)
+        self.akira.delete()
+        self.assertEqual(self.totaux(), (1, Decimal('6.90')))
+        self.assertEqual(PanierItem.objects.filter(panier=self.panier).count(), 1)
+
+
+class PanierBatchViewTests(TestCase):
+    url = '/api/panier/batch/'
+
+    def setUp(self):
+        self.user = User.objects.create_user('lecteur', 'lecteur@example.com', 'motdepasse')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.panier = Panier.objects.create(utilisateur=self.user)
+        self.t1, self.t2 = Manga.objects.create(nom='Berserk', prix='6.90', nombre_tome=2).tomes.order_by('numero')
+
+    def envoyer(self, operations):
+        return self.client.post(self.url, {'operations': operations}, format='json')
+
+    def quantites(self):
+        return dict(self.panier.items.values_list('tome_id', 'quantite'))
+
+    def test_operations_appliquees_dans_l_ordre(self):
+        self.panier.ajouter_tome(self.t2, 4)
+        response = self.envoyer([
+            {'action': 'add', 'tome_id': self.t1.pk, 'quantite': 2},
+            {'action': 'add', 'tome_id': self.t1.pk},
+            {'action': 'set', 'tome_id': self.t2.pk, 'quantite': 1},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_tomes'], 4)
+        self.assertAlmostEqual(response.json()['total_prix'], 27.6)
+        self.assertEqual(self.quantites(), {self.t1.pk: 3, self.t2.pk: 1})
+
+        response = self.envoyer([
+            {'action': 'remove', 'tome_id': self.t1.pk},
+            {'action': 'set', 'tome_id': self.t2.pk, 'quantite': 0},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['items'], [
+            {'tome_id': self.t1.pk, 'quantite': 0}, {'tome_id': self.t2.pk, 'quantite': 0},
+        ])
+        self.assertEqual(self.quantites(), {})
+        self.panier.refresh_from_db()
+        self.assertEqual(self.panier.total_tomes, 0)
+
+    def test_validation(self):
+        self.panier.ajouter_tome(self.t1)
+        cas = {
+            'liste manquante': None,
+            'liste vide': [],
+            'trop d\'opérations': [{'tome_id': self.t1.pk}] * 201,
+            'action inconnue': [{'action': 'double', 'tome_id': self.t1.pk}],
+            'tome_id invalide': [{'tome_id': 'abc'}],
+            'quantité nulle': [{'action': 'add', 'tome_id': self.t1.pk, 'quantite': 0}],
+            'quantité négative': [{'action': 'set', 'tome_id': self.t1.pk, 'quantite': -1}],
+            'quantité trop grande': [{'action': 'set', 'tome_id': self.t1.pk, 'quantite': PanierItem.QUANTITE_MAX + 1}],
+            'tome introuvable': [{'tome_id': self.t2.pk}, {'tome_id': 999999}],
+        }
+        for nom, operations in cas.items():
+            with self.subTest(nom):
+                response = self.envoyer(operations)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['error'], 'Opérations invalides')
+        # Tout ou rien : la première opération valide n'a pas été appliquée
+        self.assertEqual(self.quantites(), {self.t1.pk: 1})
+        self.assertEqual(
+            self.envoyer(cas['tome introuvable']).json()['details'],
+            [{'index': 1, 'error': 'Tome 999999 introuvable'}],
+        )
+
+    def test_quantite_max_cumulee(self):
+        self.panier.ajouter_tome(self.t1, PanierItem.QUANTITE_MAX - 1)
+        for operations in (
+            [{'action': 'add', 'tome_id': self.t1.pk, 'quantite': 2}],
+            [{'action': 'add', 'tome_id': self.t2.pk, 'quantite': 6}, {'action': 'add', 'tome_id': self.t2.pk, 'quantite': 5}],
+        ):
+            with self.subTest(operations=operations):
+                response = self.envoyer(operations)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(str(PanierItem.QUANTITE_MAX), response.json()['error'])
+        self.assertEqual(self.quantites(), {self.t1.pk: PanierItem.QUANTITE_MAX - 1})
+
+        # Une quantité qui redescend sous le maximum dans le même lot est acceptée
+        response = self.envoyer([
+            {'action': 'add', 'tome_id': self.t1.pk, 'quantite': 5},
+            {'action': 'set', 'tome_id': self.t1.pk, 'quantite': PanierItem.QUANTITE_MAX},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantites(), {self.t1.pk: PanierItem.QUANTITE_MAX})
+
+
+@override_settings(PANIER_BACKEND='redis')
+class PanierRedisTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        panier_redis.set_client(self.redis)
+        self.addCleanup(panier_redis.set_client, None)
+        planifier = mock.patch('produit.tasks.persister_paniers_redis_task.apply_async')
+        self.apply_async = planifier.start()
+        self.addCleanup(planifier.stop)
+
+        self.user = User.objects.create_user('lecteur', 'lecteur@example.com', 'motdepasse')
+        self.t1, self.t2 = Manga.objects.create(nom='Berserk', prix='6.90', nombre_tome=2).tomes.order_by('numero')
+        self.t3 = Manga.objects.create(nom='Akira', prix='14.50', nombre_tome=1).tomes.get()
+
+    def panier_redis(self):
+        return panier_redis.PanierRedis(self.user)
+
+    def lignes_en_base(self):
+        return dict(PanierItem.objects.filter(panier__utilisateur=self.user).values_list('tome_id', 'quantite'))
+
+    def test_chargement_depuis_la_base(self):
+        Panier.objects.create(utilisateur=self.user).ajouter_tome(self.t1, 3)
+        panier = self.panier_redis()
+        self.assertEqual((panier.total_tomes, panier.total_prix), (3, Decimal('20.70')))
+        self.assertEqual(self.redis.hgetall(panier.key), {str(self.t1.pk): '3', panier_redis.LOADED_FIELD: '1'})
+        self.assertGreater(self.redis.ttl(panier.key), 0)
+
+        # Panier vide mais chargé : la base n'est plus relue
+        self.redis.hdel(panier.key, self.t1.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.panier_redis().total_tomes, 0)
+
+    def test_ajout_modification_retrait(self):
+        panier = self.panier_redis()
+        self.assertEqual(panier.ajouter_tome(self.t1, 2).quantite, 2)
+        self.assertEqual(panier.ajouter_tome(self.t1).quantite, 3)
+        panier.ajouter_tome(self.t3)
+        self.assertEqual((panier.total_tomes, panier.total_prix), (4, Decimal('35.20')))
+
+        self.assertEqual(panier.modifier_quantite(self.t3, 2).quantite, 2)
+        self.assertIsNone(panier.modifier_quantite(self.t2, 1))
+        self.assertTrue(panier.retirer_tome(self.t1))
+        self.assertFalse(panier.retirer_tome(self.t1))
+
+        relu = self.panier_redis()
+        self.assertEqual(
+            [(ligne.tome_id, ligne.quantite, ligne.prix_total) for ligne in relu.items.select_related('tome').all()],
+            [(self.t3.pk, 2, Decimal('29.00'))],
+        )
+        # Rien en base tant que l'écriture différée n'a pas tourné
+        self.assertEqual(self.lignes_en_base(), {})
+        self.assertEqual(self.redis.smembers(panier_redis.DIRTY_KEY), {str(self.user.pk)})
+        self.apply_async.assert_called_once_with(countdown=settings.PANIER_REDIS_FLUSH_DELAY)
+
+    def test_operations_groupees(self):
+        panier = self.panier_redis()
+        panier.ajouter_tome(self.t2, 4)
+        finales = panier.appliquer_operations([('add', self.t1.pk, 2), ('set', self.t2.pk, 0), ('add', self.t1.pk, 1)])
+        self.assertEqual(finales, {self.t1.pk: 3, self.t2.pk: 0})
+        self.assertEqual(panier_redis._quantites(self.redis.hgetall(panier.key)), {self.t1.pk: 3})
+        with self.assertRaises(ValueError):
+            panier.appliquer_operations([('add', self.t1.pk, PanierItem.QUANTITE_MAX)])
+        self.assertEqual(self.panier_redis().total_tomes, 3)
+
+    def test_vue_ajout(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(f'/api/panier/ajouter/{self.t1.pk}/', {'quantite': 2}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_tomes'], 2)
+        self.assertEqual(self.redis.hget(panier_redis._items_key(self.user.pk), self.t1.pk), '2')
+        self.assertFalse(Panier.objects.filter(utilisateur=self.user).exists())
+
+    def test_ecriture_differee(self):
+        autre = User.objects.create_user('autre')
+        self.panier_redis().ajouter_tome(self.t1, 2)
+        panier_autre = panier_redis.PanierRedis(autre)
+        panier_autre.ajouter_tome(self.t3)
+        # Une seule tâche planifiée pour tous les paniers modifiés
+        self.assertEqual(self.apply_async.call_count, 1)
+
+        self.assertEqual(panier_redis.persister_paniers_modifies(), 2)
+        self.assertEqual(self.lignes_en_base(), {self.t1.pk: 2})
+        panier = Panier.objects.get(utilisateur=self.user)
+        self.assertEqual((panier.total_tomes, panier.total_prix), (2, Decimal('13.80')))
+        self.assertEqual(self.redis.scard(panier_redis.DIRTY_KEY), 0)
+        self.assertFalse(self.redis.exists(panier_redis.FLUSH_SCHEDULED_KEY))
+
+        # Les lignes retirées de Redis disparaissent de la base
+        self.panier_redis().retirer_tome(self.t1)
+        self.assertEqual(panier_redis.persister_paniers_modifies(), 1)
+        self.assertEqual(self.lignes_en_base(), {})
+        self.assertEqual(panier_redis.persister_paniers_modifies(), 0)
+
+    def test_echec_d_ecriture(self):
+        self.panier_redis().ajouter_tome(self.t1, 2)
+        with mock.patch('produit.panier_redis.persister_panier', side_effect=DatabaseError('database is locked')), \
+                mock.patch('builtins.print'):
+            self.assertEqual(panier_redis.persister_paniers_modifies(), 0)
+        # Le panier reste à écrire et l'est au passage suivant
+        self.assertEqual(self.redis.smembers(panier_redis.DIRTY_KEY), {str(self.user.pk)})
+        self.assertEqual(panier_redis.persister_paniers_modifies(), 1)
+        self.assertEqual(self.lignes_en_base(), {self.t1.pk: 2})
+
+    def test_echec_d_ecriture_au_paiement(self):
+        panier = self.panier_redis()
+        panier.ajouter_tome(self.t1)
+        with mock.patch('produit.panier_redis.persister_panier', side_effect=DatabaseError('database is locked')):
+            with self.assertRaises(DatabaseError):
+                panier.persister()
+        self.assertEqual(self.redis.smembers(panier_redis.DIRTY_KEY), {str(self.user.pk)})
+        panier.persister()
+        self.assertEqual(self.redis.scard(panier_redis.DIRTY_KEY), 0)
+        self.assertEqual(self.lignes_en_base(), {self.t1.pk: 1})
+
+    def test_echec_de_planification(self):
+        self.apply_async.side_effect = ConnectionError('broker injoignable')
+        with mock.patch('builtins.print') as affichage:
+            self.panier_redis().ajouter_tome(self.t1)
+        self.assertIn('❌', affichage.call_args[0][0])
+        # La prochaine modification retente la planification
+        self.assertFalse(self.redis.exists(panier_redis.FLUSH_SCHEDULED_KEY))
+        self.assertEqual(self.redis.smembers(panier_redis.DIRTY_KEY), {str(self.user.pk)})
+
+    def test_vider(self):
+        panier = self.panier_redis()
+        panier.ajouter_tome(self.t1, 2)
+        panier.persister()
+        with self.captureOnCommitCallbacks(execute=True):
+            panier.vider()
+        self.assertEqual(self.lignes_en_base(), {})
+        self.assertEqual(self.redis.hgetall(panier.key), {panier_redis.LOADED_FIELD: '1'})
+        self.assertEqual(self.panier_redis().total_tomes, 0)
@@ -0,0 +1,17 @@
+"""
+Text normalisation shared by the in-memory search indexes
+"""
+import re
+import unicodedata
+
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize_title(value):
+    """
+    Lowercase, strip accents and collapse punctuation/whitespace:
+    "  Dragon-Ball Z !" -> "dragon ball z"
+    """
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(ch for ch in value if not unicodedata.combining(ch))
+    return _NON_WORD.sub(' ', value.lower()).replace('_', ' ').strip()
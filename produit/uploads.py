@@ -0,0 +1,128 @@
+"""
+Streaming cover uploads (API and admin zip import)
+"""
+import logging
+import os
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from storages.backends.gcloud import GoogleCloudStorage
+
+from utils.gcs import upload_stream
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+
+CONTENT_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+    '.gif': 'image/gif',
+}
+
+
+class CoverUploadError(ValueError):
+    pass
+
+
+def cover_name_for(tome, filename):
+    """Nom final du fichier dans le stockage (upload_to du champ + nom disponible)"""
+    field = tome._meta.get_field('cover')
+    return field.generate_filename(tome, os.path.basename(filename))
+
+
+def store_cover(tome, stream, filename, content_type=None, storage=None):
+    """
+    Enregistre le flux comme couverture du tome, sans le charger en mémoire.
+    Sur GCS, le flux est envoyé en upload résumable par morceaux de GS_BLOB_CHUNK_SIZE ;
+    sur un autre stockage (tests, dev), Storage.save le copie par morceaux.
+    Ne touche pas la base : retourne le nom à affecter à tome.cover.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in IMAGE_EXTENSIONS:
+        raise CoverUploadError(f"Extension non supportée : {extension or filename}")
+
+    storage = storage or default_storage
+    name = storage.get_available_name(cover_name_for(tome, filename))
+    if isinstance(storage, GoogleCloudStorage):
+        upload_stream(
+            name,
+            stream,
+            content_type=content_type or CONTENT_TYPES[extension],
+            bucket_name=storage.bucket_name,
+        )
+        return name
+    return storage.save(name, File(stream, name=filename))
+
+
+def tome_numero_from_filename(filename):
+    """'one-piece/Tome 012.jpg' -> 12 (dernier nombre du nom de fichier)"""
+    numbers = re.findall(r'\d+', os.path.splitext(os.path.basename(filename))[0])
+    return int(numbers[-1]) if numbers else None
+
+
+def import_covers_zip(manga, archive, storage=None, workers=None):
+    """
+    Associe chaque image du zip à un tome du manga d'après le numéro dans son nom
+    et les envoie en parallèle. Les couvertures sont enregistrées en base par le
+    thread appelant une fois les envois terminés.
+    Les images de plus de COVER_UPLOAD_MAX_BYTES une fois décompressées sont refusées ;
+    une archive de plus de COVER_ZIP_MAX_BYTES décompressés lève CoverUploadError.
+    Retourne {'uploaded': [numero, ...], 'skipped': [nom, ...], 'errors': {nom: message}}.
+    """
+    workers = workers or getattr(settings, 'COVER_UPLOAD_WORKERS', 8)
+    max_member = getattr(settings, 'COVER_UPLOAD_MAX_BYTES', 20 * 1024 * 1024)
+    max_total = getattr(settings, 'COVER_ZIP_MAX_BYTES', 1024 * 1024 * 1024)
+    tomes = {tome.numero: tome for tome in manga.tomes.all()}
+    result = {'uploaded': [], 'skipped': [], 'errors': {}}
+
+    with zipfile.ZipFile(archive) as zf:
+        jobs = {}
+        total = 0
+        for info in zf.infolist():
+            if info.is_dir() or os.path.basename(info.filename).startswith('.'):
+                continue
+            tome = tomes.get(tome_numero_from_filename(info.filename))
+            if tome is None or os.path.splitext(info.filename)[1].lower() not in IMAGE_EXTENSIONS:
+                result['skipped'].append(info.filename)
+                continue
+            # Taille annoncée par l'archive : zipfile ne décompresse jamais au-delà
+            # (un en-tête qui ment échoue au contrôle CRC)
+            if info.file_size > max_member:
+                result['errors'][info.filename] = (
+                    f"Image trop volumineuse une fois décompressée ({info.file_size} octets, max {max_member})"
+                )
+                continue
+            total += info.file_size
+            if total > max_total:
+                raise CoverUploadError(f"Archive trop volumineuse une fois décompressée (max {max_total} octets)")
+            jobs[info.filename] = (tome, info)
+
+        def _upload(job):
+            tome, info = job
+            # ZipFile sérialise l'accès au fichier sous-jacent : chaque membre reste un flux
+            with zf.open(info) as stream:
+                return store_cover(tome, stream, info.filename, storage=storage)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {filename: executor.submit(_upload, job) for filename, job in jobs.items()}
+
+        for filename, future in futures.items():
+            tome, _ = jobs[filename]
+            try:
+                tome.cover = future.result()
+            except Exception as exc:
+                logger.warning(f"Cover upload failed for {filename}: {exc}")
+                result['errors'][filename] = str(exc)
+                continue
+            tome.save(update_fields=['cover'])
+            result['uploaded'].append(tome.numero)
+
+    result['uploaded'].sort()
+    return result
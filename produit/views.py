@@ -3,9 +3,9 @@ from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import ensure_csrf_cookie
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from .models import Manga, Tome, Panier, PanierItem, Commande, CommandeItem, Payment
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from rest_framework import status
 from .tasks import test_task, send_email_task, process_order_task
 from celery.result import AsyncResult
@@ -13,11 +13,21 @@ import stripe
 from django.conf import settings
 from .serializer import CreatePaymentIntentSerializer, PaymentSerializer
 import json
+import re
+from decimal import Decimal
+from utils import stripe_client
+from utils.gcs import get_cached_signed_urls
+from .covers import build_srcset, variant_names
+from .uploads import store_cover, CoverUploadError
+from .panier_redis import PanierRedis
+from .stripe_events import enregistrer_evenement
 
 # Create your views here.
 
 def get_or_create_panier(user):
     """Récupère ou crée un panier pour l'utilisateur"""
+    if settings.PANIER_BACKEND == 'redis':
+        return PanierRedis(user)
     panier, created = Panier.objects.get_or_create(utilisateur=user)
     return panier
 
@@ -37,7 +47,11 @@ def panier_view(request):
     user = request.user
     panier = get_or_create_panier(user)
     
-    items = panier.items.select_related('tome__manga').all()
+    items = list(panier.items.select_related('tome__manga').all())
+    cover_urls = get_cached_signed_urls(
+        [item.tome.cover.name for item in items if item.tome.cover]
+        + [name for item in items for name in variant_names(item.tome.cover_variantes)]
+    )
     items_data = [
         {
             'id': item.id,
@@ -50,7 +64,8 @@ def panier_view(request):
                     # 'auteur': item.tome.manga.auteur,
                     'prix': float(item.tome.manga.prix),
                 },
-                'cover': item.tome.cover.url if item.tome.cover else None,
+                'cover': cover_urls.get(item.tome.cover.name),
+                'cover_srcset': build_srcset(item.tome.cover_variantes, item.tome.cover_placeholder, cover_urls),
             },
             'quantite': item.quantite,
             'prix_total': float(item.prix_total),
@@ -72,7 +87,7 @@ def ajouter_au_panier_view(request, tome_id):
     Body: { quantite: number }
     Returns: Updated cart info
     """
-    tome = get_object_or_404(Tome, id=tome_id)
+    tome = get_object_or_404(Tome.objects.select_related('manga'), id=tome_id)
     user = request.user
     panier = get_or_create_panier(user)
     
@@ -104,7 +119,7 @@ def retirer_du_panier_view(request, tome_id):
     Returns: Updated cart info
     """
     try:
-        tome = get_object_or_404(Tome, id=tome_id)
+        tome = get_object_or_404(Tome.objects.select_related('manga'), id=tome_id)
         user = request.user
         panier = get_or_create_panier(user)
         
@@ -139,7 +154,7 @@ def modifier_quantite_view(request, tome_id):
     Returns: Updated cart info
     """
     try:
-        tome = get_object_or_404(Tome, id=tome_id)
+        tome = get_object_or_404(Tome.objects.select_related('manga'), id=tome_id)
         user = request.user
         panier = get_or_create_panier(user)
         
@@ -161,31 +176,28 @@ def modifier_quantite_view(request, tome_id):
                     {'error': 'Tome non trouvé dans le panier'}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
-        elif nouvelle_quantite > 10:
+        elif nouvelle_quantite > PanierItem.QUANTITE_MAX:
             return Response(
-                {'error': 'Quantité maximale de 10 autorisée'}, 
+                {'error': f'Quantité maximale de {PanierItem.QUANTITE_MAX} autorisée'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         else:
             # Mettre à jour la quantité
-            try:
-                item = panier.items.get(tome=tome)
-                item.quantite = nouvelle_quantite
-                item.save()
-                
-                return Response({
-                    'success': True,
-                    'message': f'Quantité de {tome} mise à jour',
-                    'quantite': item.quantite,
-                    'prix_total': float(item.prix_total),
-                    'total_tomes': panier.total_tomes,
-                    'total_prix': float(panier.total_prix)
-                })
-            except PanierItem.DoesNotExist:
+            item = panier.modifier_quantite(tome, nouvelle_quantite)
+            if item is None:
                 return Response(
                     {'error': 'Tome non trouvé dans le panier'}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
+
+            return Response({
+                'success': True,
+                'message': f'Quantité de {tome} mise à jour',
+                'quantite': item.quantite,
+                'prix_total': float(item.prix_total),
+                'total_tomes': panier.total_tomes,
+                'total_prix': float(panier.total_prix)
+            })
             
     except ValueError:
         return Response(
@@ -198,6 +210,77 @@ def modifier_quantite_view(request, tome_id):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+# Nombre maximal d'opérations acceptées par panier_batch_view
+PANIER_BATCH_MAX_OPERATIONS = 200
+PANIER_BATCH_ACTIONS = ('add', 'set', 'remove')
+
+
+def _valider_operations_panier(operations):
+    """Retourne (operations [(action, tome_id, quantite)], erreurs [{index, error}])"""
+    if not isinstance(operations, list) or not operations:
+        return [], [{'index': None, 'error': 'Liste d\'opérations manquante'}]
+    if len(operations) > PANIER_BATCH_MAX_OPERATIONS:
+        return [], [{'index': None, 'error': f'{PANIER_BATCH_MAX_OPERATIONS} opérations maximum'}]
+
+    valides, indexes, erreurs = [], [], []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            erreurs.append({'index': index, 'error': 'Opération invalide'})
+            continue
+        action = operation.get('action', 'add')
+        try:
+            tome_id = int(operation.get('tome_id'))
+            quantite = int(operation.get('quantite', 1 if action == 'add' else 0))
+        except (TypeError, ValueError):
+            erreurs.append({'index': index, 'error': 'tome_id ou quantite invalide'})
+            continue
+        if action not in PANIER_BATCH_ACTIONS:
+            erreurs.append({'index': index, 'error': f'Action inconnue : {action}'})
+        elif action == 'add' and not 1 <= quantite <= PanierItem.QUANTITE_MAX:
+            erreurs.append({'index': index, 'error': 'Quantité invalide'})
+        elif action == 'set' and not 0 <= quantite <= PanierItem.QUANTITE_MAX:
+            erreurs.append({'index': index, 'error': 'Quantité invalide'})
+        else:
+            valides.append((action, tome_id, quantite))
+            indexes.append(index)
+
+    # Une seule requête pour vérifier l'existence de tous les tomes
+    existants = set(Tome.objects.filter(id__in={t for _, t, _ in valides}).values_list('id', flat=True))
+    for index, (_, tome_id, _) in zip(indexes, valides):
+        if tome_id not in existants:
+            erreurs.append({'index': index, 'error': f'Tome {tome_id} introuvable'})
+    return valides, erreurs
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def panier_batch_view(request):
+    """
+    API endpoint to apply several cart changes at once (all or nothing)
+    Body: { operations: [{ action: "add"|"set"|"remove", tome_id: number, quantite: number }] }
+    Returns: Final quantity of each touched tome and the updated cart totals
+    """
+    operations = request.data.get('operations') if isinstance(request.data, dict) else request.data
+    operations, erreurs = _valider_operations_panier(operations)
+    if erreurs:
+        return Response(
+            {'error': 'Opérations invalides', 'details': erreurs},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    panier = get_or_create_panier(request.user)
+    try:
+        quantites = panier.appliquer_operations(operations)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'success': True,
+        'items': [{'tome_id': tome_id, 'quantite': quantite} for tome_id, quantite in quantites.items()],
+        'total_tomes': panier.total_tomes,
+        'total_prix': float(panier.total_prix)
+    })
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def vider_panier_view(request):
@@ -237,18 +320,30 @@ def commander_view(request):
         user = request.user
         panier = get_or_create_panier(user)
         
+        # Une seule lecture des lignes : totaux et snapshot en sont tirés
+        items = list(panier.items.select_related('tome__manga').all())
+        
         # Vérifier que le panier n'est pas vide
-        if panier.total_tomes == 0:
+        if not items:
             return Response(
                 {'error': 'Votre panier est vide'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        total_tomes = sum(item.quantite for item in items)
+        total_prix = sum((item.prix_total for item in items), Decimal('0'))
+        items_data = [
+            {
+                'manga_nom': item.tome.manga.nom,
+                'tome_numero': item.tome.numero,
+                'quantite': item.quantite,
+                'prix_unitaire': float(item.tome.manga.prix),
+                'prix_total': float(item.prix_total)
+            }
+            for item in items
+        ]
+        
         with transaction.atomic():
-            total_tomes = panier.total_tomes
-            total_prix = panier.total_prix
-            items_data = []
-            
             # Créer la commande en base de données
             commande = Commande.objects.create(
                 utilisateur=user,
@@ -257,26 +352,20 @@ def commander_view(request):
                 statut=Commande.STATUT_EN_ATTENTE  # En attente de paiement
             )
             
-            # Créer les éléments de la commande
-            for item in panier.items.select_related('tome__manga').all():
-                # Créer l'élément de commande (snapshot)
-                CommandeItem.objects.create(
+            # Créer les éléments de la commande (snapshot) en un seul INSERT
+            CommandeItem.objects.bulk_create([
+                CommandeItem(
                     commande=commande,
                     tome=item.tome,
                     quantite=item.quantite,
                     prix_unitaire=item.tome.manga.prix,
                 )
-                
-                # Préparer les données pour la réponse
-                items_data.append({
-                    'manga_nom': item.tome.manga.nom,
-                    'tome_numero': item.tome.numero,
-                    'quantite': item.quantite,
-                    'prix_unitaire': float(item.tome.manga.prix),
-                    'prix_total': float(item.prix_total)
-                })
+                for item in items
+            ])
             
             # Note: Le panier ne sera vidé qu'après paiement réussi (via webhook)
+            # Panier Redis : la commande part du panier écrit en base
+            panier.persister()
         
         return Response({
             'success': True,
@@ -348,7 +437,11 @@ def detail_commande_view(request, commande_id):
     """
     user = request.user
     commande = get_object_or_404(Commande, id=commande_id, utilisateur=user)
-    items = commande.items.select_related('tome__manga').all()
+    items = list(commande.items.select_related('tome__manga').all())
+    cover_urls = get_cached_signed_urls(
+        [item.tome.cover.name for item in items if item.tome.cover]
+        + [name for item in items for name in variant_names(item.tome.cover_variantes)]
+    )
     
     items_data = []
     for item in items:
@@ -361,7 +454,8 @@ def detail_commande_view(request, commande_id):
                     'nom': item.tome.manga.nom,
                     # 'auteur': item.tome.manga.auteur,
                 },
-                'cover': item.tome.cover.url if item.tome.cover else None,
+                'cover': cover_urls.get(item.tome.cover.name),
+                'cover_srcset': build_srcset(item.tome.cover_variantes, item.tome.cover_placeholder, cover_urls),
             },
             'quantite': item.quantite,
             'prix_unitaire': float(item.prix_unitaire),
@@ -381,6 +475,50 @@ def detail_commande_view(request, commande_id):
     })
 
 
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def upload_cover_view(request, tome_id):
+    """
+    API endpoint to upload a tome cover (staff only)
+    POST /api/tomes/<tome_id>/cover/?filename=cover.jpg
+    Body: the raw image (Content-Type: image/*), streamed to storage by chunks
+    Returns: the stored cover name
+    """
+    tome = get_object_or_404(Tome, id=tome_id)
+
+    content_type = request.content_type or ''
+    if not content_type.startswith('image/'):
+        return Response(
+            {'error': 'Le corps de la requête doit être une image (Content-Type: image/*)'},
+            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+    if content_length <= 0:
+        return Response({'error': 'Image manquante'}, status=status.HTTP_411_LENGTH_REQUIRED)
+    if content_length > settings.COVER_UPLOAD_MAX_BYTES:
+        return Response({'error': 'Image trop volumineuse'}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    disposition = re.search(r'filename="?([^";]+)"?', request.META.get('HTTP_CONTENT_DISPOSITION', ''))
+    filename = request.GET.get('filename') or (disposition.group(1) if disposition else f'tome-{tome.numero}')
+
+    # request.stream (et non request.data/body) : le corps n'est jamais chargé en entier
+    try:
+        tome.cover = store_cover(tome, request.stream, filename, content_type=content_type)
+    except CoverUploadError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    tome.save(update_fields=['cover'])
+
+    return Response({
+        'success': True,
+        'tome_id': tome.id,
+        'cover': tome.cover.name,
+    }, status=status.HTTP_201_CREATED)
+
+
 # Celery Test API Endpoints
 
 @api_view(['POST'])
@@ -495,9 +633,6 @@ def create_payment_intent(request):
     """
     Crée un PaymentIntent Stripe pour une commande
     """
-    # Configure Stripe
-    stripe.api_key = settings.STRIPE_SECRET_KEY
-    
     serializer = CreatePaymentIntentSerializer(data=request.data, context={'request': request})
     if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -522,20 +657,21 @@ def create_payment_intent(request):
         }, status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        # Créer le PaymentIntent avec Stripe
-        intent = stripe.PaymentIntent.create(
-            amount=int(commande.total_prix * 100),  # Stripe utilise les centimes
-            currency=settings.STRIPE_CURRENCY,
-            metadata={
+        # Créer le PaymentIntent avec Stripe ; la clé d'idempotence évite un second intent
+        # pour la même commande (réessai réseau, double envoi)
+        intent = stripe_client.create_payment_intent({
+            'amount': int(commande.total_prix * 100),  # Stripe utilise les centimes
+            'currency': settings.STRIPE_CURRENCY,
+            'metadata': {
                 'commande_id': commande.id,
                 'commande_reference': str(commande.reference),
                 'user_id': request.user.id,
                 'user_email': request.user.email,
             },
-            automatic_payment_methods={
+            'automatic_payment_methods': {
                 'enabled': True,
             },
-        )
+        }, idempotency_key=f'payment-intent-{commande.reference}')
         
         # Créer l'enregistrement Payment dans la base de données
         payment = Payment.objects.create(
@@ -555,10 +691,19 @@ def create_payment_intent(request):
             'currency': intent.currency,
         }, status=status.HTTP_201_CREATED)
         
+    except stripe.error.APIConnectionError:
+        return Response({
+            'error': 'Stripe ne répond pas, réessayez dans quelques instants'
+        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
     except stripe.error.StripeError as e:
         return Response({
             'error': f'Erreur Stripe: {str(e)}'
         }, status=status.HTTP_400_BAD_REQUEST)
+    except IntegrityError:
+        # Envoi concurrent : l'autre requête a enregistré le paiement (même PaymentIntent)
+        return Response({
+            'error': 'Un paiement existe déjà pour cette commande'
+        }, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({
             'error': f'Erreur serveur: {str(e)}'
@@ -611,64 +756,7 @@ def stripe_webhook(request):
     except stripe.error.SignatureVerificationError:
         return Response({'error': 'Invalid signature'}, status=400)
     
-    # Traiter l'événement
-    if event['type'] == 'payment_intent.succeeded':
-        payment_intent = event['data']['object']
-        handle_payment_success(payment_intent)
-    elif event['type'] == 'payment_intent.payment_failed':
-        payment_intent = event['data']['object']
-        handle_payment_failure(payment_intent)
-    
-    return Response({'status': 'success'})
+    # Enregistrer l'événement et répondre tout de suite : le traitement est fait par Celery
+    enregistrer_evenement(event, json.loads(payload))
 
-
-def handle_payment_success(payment_intent):
-    """
-    Traite un paiement réussi
-    """
-    try:
-        payment = Payment.objects.get(
-            stripe_payment_intent_id=payment_intent['id']
-        )
-        
-        with transaction.atomic():
-            # Mettre à jour le statut du paiement
-            payment.statut = Payment.STATUT_REUSSI
-            payment.save()
-            
-            # Mettre à jour le statut de la commande
-            commande = payment.commande
-            commande.statut = Commande.STATUT_PAYEE
-            commande.save()
-            
-            # Ajouter les tomes à la collection de l'utilisateur
-            for item in commande.items.all():
-                for _ in range(item.quantite):
-                    item.tome.possesseurs.add(commande.utilisateur)
-            
-            # Vider le panier de l'utilisateur
-            panier = get_or_create_panier(commande.utilisateur)
-            panier.vider()
-            
-    except Payment.DoesNotExist:
-        print(f"Payment not found for intent: {payment_intent['id']}")
-    except Exception as e:
-        print(f"Error handling payment success: {str(e)}")
-
-
-def handle_payment_failure(payment_intent):
-    """
-    Traite un échec de paiement
-    """
-    try:
-        payment = Payment.objects.get(
-            stripe_payment_intent_id=payment_intent['id']
-        )
-        
-        payment.statut = Payment.STATUT_ECHEC
-        payment.save()
-        
-    except Payment.DoesNotExist:
-        print(f"Payment not found for intent: {payment_intent['id']}")
-    except Exception as e:
-        print(f"Error handling payment failure: {str(e)}")
\ No newline at end of file
+    return Response({'status': 'received'})
\ No newline at end of file
@@ -0,0 +1,208 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import Storage, storages
+
+# Cache disque des objets lus depuis le stockage distant (GCS) :
+# un fichier par objet + un fichier .sha256 à côté (somme de contrôle et taille),
+# ordre LRU donné par la date de modification, rafraîchie à chaque lecture.
+CHECKSUM_SUFFIX = '.sha256'
+COPY_CHUNK_SIZE = 1024 * 1024
+# Après dépassement de la taille max, on évince jusqu'à ce seuil pour ne pas évincer à chaque écriture
+EVICTION_TARGET_RATIO = 0.9
+
+
+class CachedStorage(Storage):
+    """
+    Storage avec cache disque en lecture autour d'un backend distant.
+
+    Les lectures ('rb') passent par un cache local borné en taille (LRU) et sont
+    servies par mmap ; les écritures, suppressions et URLs sont déléguées au backend.
+    backend : instance de Storage (par défaut le stockage 'default', ex. FileSystemStorage en test).
+    """
+
+    def __init__(self, backend=None, cache_dir=None, max_bytes=None):
+        self._backend = backend
+        self.cache_dir = str(cache_dir or getattr(settings, 'COVER_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'cover_cache')))
+        self.max_bytes = max_bytes if max_bytes is not None else getattr(settings, 'COVER_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._size = None
+        # Fichiers dont la somme de contrôle a déjà été vérifiée par ce processus : {chemin: (taille, inode)}
+        self._verified = {}
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = storages['default']
+        return self._backend
+
+    # Chemins du cache
+
+    def _cache_path(self, name):
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    # Lecture
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            return self.backend.open(name, mode)
+        path = self._cache_path(name)
+        if not self._is_valid(path):
+            self._fetch(name, path)
+        os.utime(path)  # LRU : dernière lecture
+        return self._mmap_file(path, name)
+
+    def _mmap_file(self, path, name):
+        with open(path, 'rb') as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                return File(BytesIO(b''), name=name)
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        cached = File(mapped, name=name)
+        cached.size = len(mapped)  # mmap.size est une méthode : File ne saurait pas la lire
+        return cached
+
+    def _is_valid(self, path):
+        try:
+            stat = os.stat(path)
+            with open(path + CHECKSUM_SUFFIX, 'r') as fh:
+                checksum, size = fh.read().split()
+        except (OSError, ValueError):
+            return False
+        if stat.st_size != int(size):
+            return self._discard(path)
+        if self._verified.get(path) == (stat.st_size, stat.st_ino):
+            return True
+        if _file_checksum(path) != checksum:
+            return self._discard(path)
+        self._verified[path] = (stat.st_size, stat.st_ino)
+        return True
+
+    def _fetch(self, name, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out, self.backend.open(name, 'rb') as source:
+                for chunk in source.chunks(COPY_CHUNK_SIZE):
+                    out.write(chunk)
+                    sha.update(chunk)
+                    size += len(chunk)
+            # Écriture atomique : un lecteur concurrent ne voit jamais un fichier partiel
+            with open(tmp_path + CHECKSUM_SUFFIX, 'w') as fh:
+                fh.write(f'{sha.hexdigest()} {size}')
+            os.replace(tmp_path, path)
+            os.replace(tmp_path + CHECKSUM_SUFFIX, path + CHECKSUM_SUFFIX)
+        except Exception:
+            for leftover in (tmp_path, tmp_path + CHECKSUM_SUFFIX):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            raise
+        self._verified[path] = (size, os.stat(path).st_ino)
+        self._account(size)
+
+    # Taille et éviction
+
+    def _account(self, size):
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for filename in files:
+                if filename.endswith(CHECKSUM_SUFFIX) or filename.endswith('.part'):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICTION_TARGET_RATIO
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            self._discard(path)
+            total -= size
+        self._size = total
+
+    def _discard(self, path):
+        for victim in (path, path + CHECKSUM_SUFFIX):
+            try:
+                os.remove(victim)
+            except OSError:
+                pass
+        self._verified.pop(path, None)
+        return False
+
+    def evict(self, name):
+        """Retire un objet du cache local (après remplacement ou suppression)"""
+        self._discard(self._cache_path(name))
+
+    def clear(self):
+        with self._lock:
+            for path, _, _ in list(self._entries()):
+                self._discard(path)
+            self._size = 0
+
+    # Délégation au backend
+
+    def save(self, name, content, max_length=None):
+        name = self.backend.save(name, content, max_length=max_length)
+        self.evict(name)
+        return name
+
+    def _save(self, name, content):
+        return self.save(name, content)
+
+    def delete(self, name):
+        self.backend.delete(name)
+        self.evict(name)
+
+    def exists(self, name):
+        return self.backend.exists(name)
+
+    def size(self, name):
+        return self.backend.size(name)
+
+    def url(self, name):
+        return self.backend.url(name)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def get_modified_time(self, name):
+        return self.backend.get_modified_time(name)
+
+    def get_available_name(self, name, max_length=None):
+        return self.backend.get_available_name(name, max_length=max_length)
+
+    def generate_filename(self, filename):
+        return self.backend.generate_filename(filename)
+
+
+def _file_checksum(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(COPY_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
@@ -1,16 +1,178 @@
+import hashlib
+import os
+import threading
+import time
+from cachetools import LRUCache
 from google.cloud import storage
 from datetime import timedelta
 from django.conf import settings
+from django.core.cache import caches
+
+# Client GCS partagé par le processus (recréé après un fork, ex. workers Celery prefork)
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+_buckets = {}
+
+# Cache des URLs signées : LRU local au processus, puis cache partagé (Redis)
+_url_lock = threading.Lock()
+_url_cache = LRUCache(maxsize=getattr(settings, 'GCS_SIGNED_URL_CACHE_SIZE', 10000))
+
+
+def _reset_after_fork():
+    global _lock, _client, _client_pid, _buckets, _url_lock
+    _lock = threading.Lock()
+    _client = None
+    _client_pid = None
+    _buckets = {}
+    _url_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_client():
+    """
+    Retourne le client GCS du processus courant, créé au premier appel.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                _buckets.clear()
+                _client = storage.Client(project=settings.GS_PROJECT_ID, credentials=settings.GS_CREDENTIALS)
+                _client_pid = pid
+    return _client
+
+
+def get_bucket(bucket_name=None):
+    """
+    Retourne l'objet bucket (mis en cache) ; aucun appel réseau n'est fait.
+    """
+    bucket_name = bucket_name or settings.GS_BUCKET_NAME
+    client = get_client()
+    bucket = _buckets.get(bucket_name)
+    if bucket is None:
+        bucket = _buckets.setdefault(bucket_name, client.bucket(bucket_name))
+    return bucket
+
 
 def generate_signed_url(blob_name, bucket_name=settings.GS_BUCKET_NAME, expiration_minutes=1):
     """
     Génère une URL signée pour un fichier stocké sur Google Cloud Storage.
     """
-    # Crée le client GCS
-    client = storage.Client(project=settings.GS_PROJECT_ID, credentials=settings.GS_CREDENTIALS)
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(blob_name)
+    blob = get_bucket(bucket_name).blob(blob_name)
 
     # Génère l'URL signée
     url = blob.generate_signed_url(expiration=timedelta(minutes=expiration_minutes))
     return url
+
+
+def generate_signed_urls(blob_names, bucket_name=settings.GS_BUCKET_NAME, expiration_minutes=1):
+    """
+    Génère les URLs signées d'une liste de fichiers avec un seul client et un seul bucket.
+    Retourne un dict {blob_name: url} (les doublons ne sont signés qu'une fois).
+    """
+    bucket = get_bucket(bucket_name)
+    expiration = timedelta(minutes=expiration_minutes)
+    return {
+        blob_name: bucket.blob(blob_name).generate_signed_url(expiration=expiration)
+        for blob_name in dict.fromkeys(blob_names)
+        if blob_name
+    }
+
+
+def upload_stream(blob_name, stream, content_type=None, bucket_name=None, chunk_size=None):
+    """
+    Envoie un flux (ex. corps de requête) vers GCS par morceaux, en upload résumable :
+    seul un morceau de chunk_size octets est gardé en mémoire. Retourne le nombre d'octets envoyés.
+    """
+    bucket_name = bucket_name or settings.GS_BUCKET_NAME
+    chunk_size = chunk_size or settings.GS_BLOB_CHUNK_SIZE
+    blob = get_bucket(bucket_name).blob(blob_name, chunk_size=chunk_size)
+    written = 0
+    with blob.open('wb', content_type=content_type, chunk_size=chunk_size) as out:
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            out.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def _shared_url_key(bucket_name, blob_name):
+    digest = hashlib.md5(f'{bucket_name}/{blob_name}'.encode('utf-8')).hexdigest()
+    return f'gcs:signed-url:{digest}'
+
+
+def get_cached_signed_urls(blob_names, bucket_name=None):
+    """
+    Retourne {blob_name: url} en réutilisant les URLs signées encore valides.
+
+    Les URLs sont signées pour GCS_SIGNED_URL_LIFETIME secondes et réutilisées
+    tant qu'il leur reste plus de GCS_SIGNED_URL_SAFETY_MARGIN secondes : le
+    même fichier garde la même URL, ce qui la rend cacheable par le navigateur.
+    Recherche dans le LRU du processus, puis dans le cache partagé, puis signe
+    les manquantes en un seul appel.
+    """
+    bucket_name = bucket_name or settings.GS_BUCKET_NAME
+    lifetime = getattr(settings, 'GCS_SIGNED_URL_LIFETIME', 3600)
+    margin = getattr(settings, 'GCS_SIGNED_URL_SAFETY_MARGIN', 300)
+    now = time.time()
+
+    urls = {}
+    missing = []
+    with _url_lock:
+        for blob_name in dict.fromkeys(blob_names):
+            if not blob_name:
+                continue
+            entry = _url_cache.get((bucket_name, blob_name))
+            if entry and entry[1] - now > margin:
+                urls[blob_name] = entry[0]
+            else:
+                missing.append(blob_name)
+    if not missing:
+        return urls
+
+    shared = caches[getattr(settings, 'GCS_SIGNED_URL_CACHE_ALIAS', 'default')]
+    keys = {_shared_url_key(bucket_name, blob_name): blob_name for blob_name in missing}
+    found = {}
+    for key, entry in shared.get_many(list(keys)).items():
+        if entry and entry[1] - now > margin:
+            found[keys[key]] = entry
+
+    to_sign = [blob_name for blob_name in missing if blob_name not in found]
+    if to_sign:
+        expires_at = now + lifetime
+        signed = generate_signed_urls(to_sign, bucket_name=bucket_name, expiration_minutes=lifetime / 60)
+        new_entries = {blob_name: (url, expires_at) for blob_name, url in signed.items()}
+        shared.set_many(
+            {_shared_url_key(bucket_name, blob_name): entry for blob_name, entry in new_entries.items()},
+            timeout=max(int(lifetime - margin), 1),
+        )
+        found.update(new_entries)
+
+    with _url_lock:
+        for blob_name, entry in found.items():
+            _url_cache[(bucket_name, blob_name)] = entry
+            urls[blob_name] = entry[0]
+    return urls
+
+
+def get_cached_signed_url(blob_name, bucket_name=None):
+    """
+    Version unitaire de get_cached_signed_urls.
+    """
+    return get_cached_signed_urls([blob_name], bucket_name=bucket_name).get(blob_name)
+
+
+def evict_signed_url(blob_name, bucket_name=None):
+    """
+    Oublie l'URL signée d'un fichier (couverture remplacée ou supprimée).
+    """
+    bucket_name = bucket_name or settings.GS_BUCKET_NAME
+    with _url_lock:
+        _url_cache.pop((bucket_name, blob_name), None)
+    caches[getattr(settings, 'GCS_SIGNED_URL_CACHE_ALIAS', 'default')].delete(
+        _shared_url_key(bucket_name, blob_name)
+    )
@@ -0,0 +1,82 @@
+import os
+import threading
+
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+# Client Stripe partagé par le processus : une session HTTP avec pool de connexions
+# (keep-alive vers l'API), des timeouts stricts, recréé après un fork (workers prefork)
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+_session = None
+
+
+def _reset_after_fork():
+    global _lock, _client, _client_pid, _session
+    _lock = threading.Lock()
+    _client = None
+    _client_pid = None
+    _session = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _build_session():
+    pool_size = getattr(settings, 'STRIPE_HTTP_POOL_SIZE', 20)
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_client():
+    """
+    Retourne le StripeClient du processus courant, créé au premier appel.
+    Les erreurs réseau (dont les timeouts) sont réessayées STRIPE_MAX_NETWORK_RETRIES fois.
+    """
+    global _client, _client_pid, _session
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                _session = _build_session()
+                http_client = stripe.RequestsClient(
+                    # (connexion, lecture) : requests accepte un tuple
+                    timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT),
+                    session=_session,
+                )
+                base_addresses = {'api': settings.STRIPE_API_BASE} if settings.STRIPE_API_BASE else {}
+                _client = stripe.StripeClient(
+                    settings.STRIPE_SECRET_KEY,
+                    base_addresses=base_addresses,
+                    max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+                    http_client=http_client,
+                )
+                _client_pid = pid
+    return _client
+
+
+def close_client():
+    """Ferme la session HTTP ; le prochain get_client() en recrée une (réglages modifiés, tests)"""
+    global _client, _client_pid, _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _client = None
+        _client_pid = None
+        _session = None
+
+
+def create_payment_intent(params, idempotency_key=None):
+    """
+    Crée un PaymentIntent. Avec une clé d'idempotence, un nouvel essai (réseau, double clic)
+    renvoie le même PaymentIntent au lieu d'en créer un second.
+    """
+    options = {'idempotency_key': idempotency_key} if idempotency_key else {}
+    return get_client().payment_intents.create(params=params, options=options)